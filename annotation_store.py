@@ -0,0 +1,224 @@
+import glob
+import json
+import logging
+import os
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from output_parser import parse_file
+
+try:
+    import pyarrow  # noqa: F401
+    FORMAT = 'parquet'
+except ImportError:
+    # pandas needs pyarrow for Parquet; keep the same layout in pickle files
+    FORMAT = 'pickle'
+
+STORE_DIR = 'store'
+GOLD = 'gold'
+
+EVENT_COLUMNS = ['noteID', 'id', 'start', 'end', 'text', 'type', 'val']
+TLINK_COLUMNS = ['noteID', 'id', 'fromID', 'fromText', 'toID', 'toText', 'type']
+CATEGORICAL = ('noteID', 'id', 'type', 'fromID', 'toID')
+
+# task: (record tag, gold directory, attributes a line of model output needs)
+SOURCES = {
+    'ner': ('EVENT', 'eval/ner', ('text', 'type')),
+    're': ('TLINK', 'eval/re', ('toID', 'fromID', 'type')),
+    'nerre': ('TLINK', 'eval/re', ('toText', 'fromText', 'type')),
+}
+
+
+def task_columns(task: str) -> list:
+    return EVENT_COLUMNS if SOURCES[task][0] == 'EVENT' else TLINK_COLUMNS
+
+
+def run_name(path: str) -> str:
+    '''
+    Run of an output_<mode>_<model>_<yymmdd> directory (or of one of its task folders): <mode>_<model>_<yymmdd>
+    '''
+    path = os.path.normpath(path)
+    if os.path.basename(path) in SOURCES:
+        path = os.path.dirname(path)
+    name = os.path.basename(path)
+    return name[len('output_'):] if name.startswith('output_') else name
+
+
+def parse_run(run: str) -> dict:
+    '''
+    {'mode', 'model', 'date'} of a run name; model names may hold '_'.
+    '''
+    if run == GOLD:
+        return {'mode': None, 'model': None, 'date': None}
+    mode, rest = run.split('_', 1)
+    model, _, execute_date = rest.rpartition('_')
+    return {'mode': mode, 'model': model, 'date': execute_date}
+
+
+def read_note(path: str, tag: str, keywords: tuple, gold: bool):
+    '''
+    (records, dropped lines) of one annotation file.
+    Gold files are well-formed XML; model outputs go through output_parser.
+    '''
+    if gold:
+        return [element.attrib for element in ET.parse(path).getroot().findall(tag)], 0
+    return parse_file(path, tag, keywords)
+
+
+def _note_frame(records: list, note: str, columns: list) -> pd.DataFrame:
+    df = pd.DataFrame(records, columns=columns[1:])
+    df.insert(0, 'noteID', note)
+    return df
+
+
+class AnnotationStore:
+    '''
+    Gold and model annotations of the corpus in columnar files, written once and re-read cheaply.
+
+    <output_dir>/store/<run>/<task>.parquet - all annotations of a run and task, sorted by noteID
+    <output_dir>/store/<run>/<task>.json    - size and mtime of every source file, dropped lines per note
+
+    run - 'gold' (result/eval) or <mode>_<model>_<yymmdd> (result/output_<mode>_<model>_<yymmdd>)
+    noteID, ids and type are categorical columns. A partition is refreshed when its source files
+    change, re-parsing only the notes whose file is new or modified. Without pyarrow, partitions
+    are pickled DataFrames instead of Parquet files.
+    '''
+    def __init__(self, output_dir: str, processes: int = None):
+        self.output_dir = output_dir
+        self.root = os.path.join(output_dir, STORE_DIR)
+        self.processes = processes
+        self.manifests = {}
+
+    def source_dir(self, run: str, task: str) -> str:
+        if run == GOLD:
+            return os.path.join(self.output_dir, SOURCES[task][1])
+        return os.path.join(self.output_dir, 'output_' + run, task)
+
+    def _paths(self, run: str, task: str):
+        extension = '.parquet' if FORMAT == 'parquet' else '.pkl'
+        base = os.path.join(self.root, run, task)
+        return base + extension, base + '.json'
+
+    def _read_manifest(self, path: str) -> dict:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _read_table(self, path: str) -> pd.DataFrame:
+        if FORMAT == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    def _write_table(self, df: pd.DataFrame, path: str):
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        if FORMAT == 'parquet':
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp, path)
+
+    def _parse(self, run: str, task: str, files: dict) -> dict:
+        # {noteID: (DataFrame, dropped lines)} of the given files, parsed across processes
+        tag, _, keywords = SOURCES[task]
+        columns = task_columns(task)
+        parsed = {}
+        results = {}
+        if self.processes == 1 or len(files) <= 1:
+            # In this process, e.g. inside a worker of an evaluation sweep
+            for note, path in files.items():
+                try:
+                    results[note] = read_note(path, tag, keywords, run == GOLD)
+                except Exception as e:
+                    results[note] = e
+        else:
+            with ProcessPoolExecutor(max_workers = self.processes) as executor:
+                futures = {note: executor.submit(read_note, path, tag, keywords, run == GOLD) for note, path in files.items()}
+                for note, future in futures.items():
+                    try:
+                        results[note] = future.result()
+                    except Exception as e:
+                        results[note] = e
+        for note, result in results.items():
+            if isinstance(result, Exception):
+                logging.error(f'Error reading annotations: \n{result}')
+                logging.error(f'Error occurred file: {files[note]}')
+                continue
+            records, dropped = result
+            if dropped:
+                logging.info(f'dropped {dropped} malformed lines of {files[note]}')
+            parsed[note] = (_note_frame(records, note, columns), dropped)
+        return parsed
+
+    def refresh(self, run: str, task: str) -> dict:
+        '''
+        Bring the partition of run and task up to date with its source files; return its manifest.
+        '''
+        table_path, manifest_path = self._paths(run, task)
+        files = {os.path.splitext(os.path.basename(path))[0]: path
+                 for path in glob.glob(os.path.join(self.source_dir(run, task), '*.xml'))}
+        sources = {}
+        for note, path in files.items():
+            stat = os.stat(path)
+            sources[note] = [stat.st_size, stat.st_mtime_ns]
+
+        manifest = self._read_manifest(manifest_path)
+        if manifest.get('format') == FORMAT and manifest.get('sources') == sources and os.path.exists(table_path):
+            self.manifests[(run, task)] = manifest
+            return manifest
+
+        # Keep rows of unchanged notes and re-parse the rest
+        previous = manifest.get('sources', {}) if manifest.get('format') == FORMAT and os.path.exists(table_path) else {}
+        unchanged = [note for note in sources if previous.get(note) == sources[note]]
+        changed = {note: files[note] for note in sources if previous.get(note) != sources[note]}
+        frames = [pd.DataFrame(columns=task_columns(task))]
+        if unchanged:
+            df = self._read_table(table_path)
+            frames.append(df[df['noteID'].isin(unchanged)].astype({column: object for column in CATEGORICAL if column in df}))
+        dropped = {note: count for note, count in manifest.get('dropped', {}).items() if note in unchanged}
+        for note, (df, count) in self._parse(run, task, changed).items():
+            frames.append(df)
+            if count:
+                dropped[note] = count
+
+        df = pd.concat(frames, ignore_index=True).sort_values('noteID', kind='stable', ignore_index=True)
+        for column in CATEGORICAL:
+            if column in df:
+                df[column] = df[column].astype('category')
+        os.makedirs(os.path.dirname(table_path), exist_ok=True)
+        self._write_table(df, table_path)
+
+        manifest = dict(parse_run(run), run=run, task=task, format=FORMAT, sources=sources, dropped=dropped)
+        tmp = f'{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, manifest_path)
+        logging.info(f'annotation store {run}/{task}: parsed {len(changed)} of {len(sources)} notes')
+        self.manifests[(run, task)] = manifest
+        return manifest
+
+    def load(self, run: str, task: str, notes = None) -> pd.DataFrame:
+        '''
+        Annotations of run and task (refreshed if stale), optionally only of the given noteIDs.
+        '''
+        self.refresh(run, task)
+        df = self._read_table(self._paths(run, task)[0])
+        if notes is not None:
+            df = df[df['noteID'].isin(list(notes))].reset_index(drop=True)
+        return df
+
+    def notes(self, run: str, task: str) -> list:
+        '''
+        noteIDs with a source file, including notes without annotations.
+        '''
+        return sorted(self.refresh(run, task)['sources'])
+
+    def dropped(self, run: str, task: str) -> dict:
+        '''
+        {noteID: dropped lines} of the model output of run and task.
+        '''
+        return self.refresh(run, task)['dropped']
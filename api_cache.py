@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+def cache_key(model: str, temp: float, messages: list, task: str, backend: str = 'openai') -> str:
+    '''
+    Content address of a request: sha256 over model, temperature, messages, task and backend.
+    backend - name of the backend answering the request (backends.py), so responses of a mock
+    or another server are never returned for the OpenAI API. Keys of 'openai' stay as before.
+    '''
+    request = {'model': model, 'temperature': temp, 'messages': messages, 'task': task}
+    if backend != 'openai':
+        request['backend'] = backend
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    '''
+    Persistent on-disk cache of API responses stored in SQLite.
+
+    Responses are keyed by cache_key(), so re-running the same prompts on another day
+    (into a new output_<mode>_<model>_<yymmdd> directory) does not call the API again.
+    When the stored responses exceed max_bytes, the least recently used ones are evicted.
+    The total size is kept in the file (meta table), so caches of runs writing at the same time
+    see each other's responses. Hit and miss counters are kept per instance.
+    '''
+    def __init__(self, db_path: str, max_bytes: int = 1024 * 1024 * 1024):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Runs executing at the same time share the file; wait for their writes instead of failing
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                task TEXT,
+                                model TEXT,
+                                response TEXT,
+                                size INTEGER,
+                                created REAL,
+                                accessed REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+        self.conn.execute("INSERT OR IGNORE INTO meta SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM responses")
+        self.conn.commit()
+        self.total_bytes = self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        return self.conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+
+    def _add_bytes(self, size: int):
+        self.conn.execute("UPDATE meta SET value = value + ? WHERE name = 'total_bytes'", (size,))
+
+    @classmethod
+    def from_config(cls, config, output_dir: str):
+        '''
+        Read [openai] cache (on/off) and cache_max_mb from api.config.
+        The cache is stored in <output_dir>/cache/responses.sqlite. Return None if disabled.
+        The mock backend uses mock_cache (off by default) instead, so its injected errors are not hidden.
+        '''
+        if config['openai'].get('backend', 'openai') == 'mock':
+            enabled = config['openai'].getboolean('mock_cache', fallback=False)
+        else:
+            enabled = config['openai'].getboolean('cache', fallback=True)
+        if not enabled:
+            return None
+        max_mb = config['openai'].getfloat('cache_max_mb', fallback=1024)
+        return cls(os.path.join(output_dir, 'cache', 'responses.sqlite'), int(max_mb * 1024 * 1024))
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str, task: str = None, model: str = None):
+        size = len(response.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            # Take the write lock first, so the total includes writes of the other runs
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+                self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (key, task, model, response, size, now, now))
+                self._add_bytes(size - (old[0] if old else 0))
+                self.total_bytes = self._total_bytes()
+                self._evict()
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Free down to 90% of the budget so eviction doesn't run on every put
+        target = self.max_bytes * 0.9
+        evicted, freed = 0, 0
+        for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+            if self.total_bytes - freed <= target:
+                break
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            freed += size
+            evicted += 1
+        self._add_bytes(-freed)
+        self.total_bytes -= freed
+        logging.info(f'response cache: evicted {evicted} responses ({self.total_bytes} bytes left)')
+
+    def stats(self) -> dict:
+        with self.lock:
+            count = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            self.total_bytes = self._total_bytes()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': count, 'bytes': self.total_bytes}
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"response cache - hits: {stats['hits']}, misses: {stats['misses']}, "
+                     f"entries: {stats['entries']}, size: {round(stats['bytes'] / 1024 / 1024, 2)} MB")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
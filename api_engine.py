@@ -0,0 +1,164 @@
+import logging
+import threading
+
+import tqdm as td
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from rate_limit import RateLimiter, estimate_tokens
+from retry import RetryPolicy
+from api_cache import ResponseCache, cache_key
+from chunking import split_windows, merge_event_responses
+from backends import OpenAIBackend
+from output_parser import filter_lines
+
+
+def get_concurrency(config) -> int:
+    '''
+    Number of notes sent to the API at the same time.
+    Read from [openai] concurrency in api.config, defaults to 1 (sequential).
+    '''
+    return max(1, config['openai'].getint('concurrency', fallback=1))
+
+
+def request_completion(messages: list, model: str, temp: float, note: str, policy: RetryPolicy, backend,
+                       limiter: RateLimiter = None, cache: ResponseCache = None, task: str = None,
+                       budget: threading.Semaphore = None) -> str:
+    '''
+    Call the model backend (see backends.py) and retry failed requests by the retry policy.
+    Return empty string if every request failed.
+
+    If limiter is given, every attempt waits for its RPM/TPM budget before being sent.
+    If budget is given, every attempt holds one of its slots while the request is in flight.
+    If cache is given, a cached response of the same model, temperature, messages, task and backend
+    is returned without calling the API, and new responses are stored.
+    '''
+    if cache is not None:
+        key = cache_key(model, temp, messages, task, getattr(backend, 'name', 'openai'))
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+    estimated_tokens = estimate_tokens(messages)
+
+    def create():
+        if limiter is not None:
+            limiter.acquire(estimated_tokens)
+        if budget is not None:
+            with budget:
+                content, usage = backend.create(messages, model, temp)
+        else:
+            content, usage = backend.create(messages, model, temp)
+        if limiter is not None:
+            limiter.record(usage)
+        return content
+
+    response = policy.call(create, note)
+    if response is None:
+        return ''
+    if cache is not None:
+        cache.put(key, response, task, model)
+    return response
+
+
+def clean_response(response: str, keywords: tuple) -> str:
+    '''
+    Remove incomplete lines (lines without all keywords) and wrap the response with <TAGS>
+    '''
+    lines, dropped = filter_lines(response, keywords)
+    if dropped:
+        logging.debug(f'dropped {dropped} incomplete lines of the response')
+    return '<TAGS>\n' + '\n'.join(lines) + '\n</TAGS>'
+
+
+def output_file_path(path: str, note: str) -> str:
+    return os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')
+
+
+def run_requests(notes: list, path: str, shots: list, config, keywords: tuple, api_retry: int = 6,
+                 desc: str = "Generating output from i2b2", limiter: RateLimiter = None,
+                 cache: ResponseCache = None, task: str = None, chunk_chars: int = 0, chunk_overlap: int = 0,
+                 backend = None, budget: threading.Semaphore = None):
+    '''
+    Shared execution engine of run_ner, run_re and run_nerre.
+
+    notes - input .txt files
+    path - output directory of the task
+    shots - messages sent before the note (system prompt and few-shot example)
+    keywords - attributes a line needs to keep in the output
+
+    Notes whose .xml output already exists are skipped.
+    The rest are sent to the API with upto [openai] concurrency requests in flight,
+    and each output is written as soon as its response arrives.
+    Requests are paced by limiter, or by [openai] rpm_limit/tpm_limit if no limiter is given.
+    Failed requests are retried with exponential backoff upto (api_retry - 1) attempts per note.
+    Responses are looked up in and stored to cache (keyed with task) if it is given.
+
+    chunk_chars > 0 splits notes longer than chunk_chars into overlapping windows
+    (see chunking.split_windows), which are sent in parallel and merged back into one
+    output with offsets of the original note. Only applicable to <EVENT/> outputs (NER).
+
+    backend - model backend (backends.get_backend), the OpenAI API if None.
+    limiter, budget - shared by runs executed at the same time (pipeline.py), so that together they stay
+    under one RPM/TPM quota and one number of requests in flight (budget, a semaphore).
+    '''
+    model = config['openai']['model']
+    temp = float(config['openai']['temperature'])
+    concurrency = get_concurrency(config)
+    if limiter is None:
+        limiter = RateLimiter.from_config(config)
+    policy = RetryPolicy.from_config(config, api_retry)
+    if backend is None:
+        backend = OpenAIBackend(config['openai']['api_key'])
+
+    # Split pending notes into windows: {note: [(offset, text), ...]}
+    windows = {}
+    for note in notes:
+        if os.path.exists(output_file_path(path, note)):
+            logging.info('output exists: %s' % note)
+        else:
+            with open(note, 'r') as f:
+                content = f.read()
+            windows[note] = split_windows(content, chunk_chars, chunk_overlap)
+
+    def process(note, index):
+        offset, content = windows[note][index]
+        label = note if len(windows[note]) == 1 else f'{note}#{index}'
+        messages = shots + [{'role':'user', 'content':content}]
+        return request_completion(messages, model, temp, label, policy, backend, limiter, cache, task, budget)
+
+    def save(note, responses):
+        if any(response == '' for response in responses):
+            logging.info(f"pass saving {os.path.splitext(os.path.basename(note))[0]} file due to empty response...\n")
+            return
+        if len(responses) == 1:
+            response = responses[0]
+        else:
+            response = merge_event_responses(zip([offset for offset, _ in windows[note]], responses))
+        with open(output_file_path(path, note), 'w', encoding='utf-8') as f:
+            f.write(clean_response(response, keywords))
+
+    logging.info(f'start API requests with concurrency {concurrency}...')
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        futures = {executor.submit(process, note, index): (note, index)
+                   for note in windows for index in range(len(windows[note]))}
+        responses = {note: [None] * len(windows[note]) for note in windows}
+        remaining = {note: len(windows[note]) for note in windows}
+        with td.tqdm(total = len(windows), desc = desc, unit = "files") as progress:
+            for future in as_completed(futures):
+                note, index = futures[future]
+                try:
+                    responses[note][index] = future.result()
+                except Exception as e:
+                    logging.error(f'{note}: error while processing note: \n{e}')
+                    responses[note][index] = ''
+                remaining[note] -= 1
+                if remaining[note] == 0:
+                    try:
+                        save(note, responses.pop(note))
+                    except Exception as e:
+                        logging.error(f'{note}: error while saving output: \n{e}')
+                    progress.update(1)
+    policy.log_summary()
+    if cache is not None:
+        cache.log_stats()
@@ -0,0 +1,202 @@
+import openai
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+
+class OpenAIBackend:
+    '''
+    OpenAI chat completion API.
+    api_base=None uses the OpenAI endpoint; any OpenAI-compatible server can be given instead.
+    '''
+    def __init__(self, api_key: str, api_base: str = None):
+        self.api_key = api_key
+        self.api_base = api_base
+        # part of the response cache key (api_cache.cache_key)
+        self.name = 'openai' if api_base is None else 'compatible:' + api_base
+
+    def create(self, messages: list, model: str, temp: float):
+        '''
+        Return (content, usage) of the first choice.
+        '''
+        kwargs = {'api_key': self.api_key}
+        if self.api_base:
+            kwargs['api_base'] = self.api_base
+        completions = openai.ChatCompletion.create(
+            model = model,
+            temperature = temp,
+            n = 1,
+            messages = messages,
+            **kwargs
+        )
+        return completions.choices[0]['message']['content'], completions.get('usage')
+
+
+class MockAPIError(Exception):
+    '''
+    Error injected by MockBackend, shaped like openai.error so retry.py classifies it by http_status.
+    '''
+    def __init__(self, message: str, http_status: int, headers: dict = None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.headers = headers or {}
+
+
+def _fraction(*keys) -> float:
+    '''
+    Deterministic number in [0, 1) from the keys.
+    '''
+    digest = hashlib.sha256('|'.join(str(key) for key in keys).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def _to_line(element) -> str:
+    # Raw attribute values, the way GPT writes them (unescaped)
+    return f'<{element.tag} ' + ' '.join(f'{k}="{v}"' for k, v in element.attrib.items()) + '/>'
+
+
+class MockBackend:
+    '''
+    Deterministic local model that replays gold annotations from result/eval/*.
+
+    The note is found by looking the user message up in result/data/<task>/*.txt
+    (windows of chunked notes are matched by substring and get the gold entities inside
+    the window with offsets relative to it). The task is inferred from the prompt.
+
+    latency - mean secs per request (spread 0.5x - 1.5x)
+    error_rate - share of attempts failing with 429 (with Retry-After), 500 or a timeout
+    Latency and errors depend only on the request and the attempt number, so runs are reproducible.
+    '''
+    name = 'mock'
+
+    def __init__(self, output_dir: str, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.output_dir = output_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.attempts = {}
+        self.notes = None
+        self.gold = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, output_dir: str):
+        return cls(output_dir,
+                   latency = config['openai'].getfloat('mock_latency', fallback=0.0),
+                   error_rate = config['openai'].getfloat('mock_error_rate', fallback=0.0),
+                   seed = config['openai'].getint('mock_seed', fallback=0))
+
+    def _load_notes(self):
+        with self.lock:
+            if self.notes is None:
+                notes = {}
+                for task in ('ner', 're', 'nerre'):
+                    for path in glob.glob(os.path.join(self.output_dir, 'data', task, '*.txt')):
+                        with open(path, 'r') as f:
+                            notes[(task, os.path.splitext(os.path.basename(path))[0])] = f.read()
+                self.notes = notes
+        return self.notes
+
+    def _gold(self, task: str, note_id: str) -> list:
+        key = (task, note_id)
+        if key not in self.gold:
+            path = os.path.join(self.output_dir, 'eval', task, note_id + '.xml')
+            elements = []
+            if os.path.exists(path):
+                elements = list(ET.parse(path).getroot())
+            self.gold[key] = elements
+        return self.gold[key]
+
+    @staticmethod
+    def infer_task(messages: list) -> str:
+        system = messages[0]['content'] if messages and messages[0]['role'] == 'system' else ''
+        if 'TLINK' not in system:
+            return 'ner'
+        return 're' if '<EVENT' in messages[-1]['content'] else 'nerre'
+
+    def find_note(self, task: str, content: str):
+        '''
+        Return (noteID, offset of content in the note), or (None, 0) if no note matches.
+        '''
+        notes = self._load_notes()
+        for (note_task, note_id), text in notes.items():
+            if note_task == task and text == content:
+                return note_id, 0
+        for (note_task, note_id), text in notes.items():
+            if note_task == task:
+                offset = text.find(content)
+                if offset >= 0:
+                    return note_id, offset
+        return None, 0
+
+    def replay(self, task: str, note_id: str, offset: int = 0, length: int = None) -> str:
+        lines = []
+        if task == 'ner':
+            for event in self._gold('ner', note_id):
+                start, end = int(event.get('start')), int(event.get('end'))
+                if length is not None and (start < offset or end > offset + length):
+                    continue
+                event = ET.Element(event.tag, dict(event.attrib, start=str(start - offset), end=str(end - offset)))
+                lines.append(_to_line(event))
+        else:
+            if task == 'nerre':
+                lines += [_to_line(event) for event in self._gold('ner', note_id)]
+            lines += [_to_line(tlink) for tlink in self._gold('re', note_id)]
+        return '\n'.join(lines)
+
+    def respond(self, messages: list) -> str:
+        '''
+        Sleep for the simulated latency, maybe raise an injected error, and return the gold annotation.
+        '''
+        content = messages[-1]['content']
+        key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        with self.lock:
+            attempt = self.attempts.get(key, 0) + 1
+            self.attempts[key] = attempt
+
+        if self.latency > 0:
+            time.sleep(self.latency * (0.5 + _fraction(self.seed, key, attempt, 'latency')))
+        if _fraction(self.seed, key, attempt, 'error') < self.error_rate:
+            kind = _fraction(self.seed, key, attempt, 'kind')
+            if kind < 0.5:
+                raise MockAPIError('mock rate limit reached', 429, {'Retry-After': '1'})
+            elif kind < 0.8:
+                raise MockAPIError('mock server error', 500)
+            else:
+                raise TimeoutError('mock request timed out')
+
+        task = self.infer_task(messages)
+        note_id, offset = self.find_note(task, content)
+        if note_id is None:
+            logging.debug('mock backend: no note matches the request')
+            return ''
+        notes = self._load_notes()
+        length = None if len(content) == len(notes[(task, note_id)]) else len(content)
+        return self.replay(task, note_id, offset, length)
+
+    def create(self, messages: list, model: str, temp: float):
+        response = self.respond(messages)
+        prompt_tokens = sum(len(message['content']) for message in messages) // 4
+        return response, {'prompt_tokens': prompt_tokens, 'completion_tokens': len(response) // 4,
+                          'total_tokens': prompt_tokens + len(response) // 4}
+
+
+def get_backend(config, output_dir: str):
+    '''
+    Model backend selected by [openai] backend in api.config:
+    openai - OpenAI API
+    compatible - OpenAI-compatible server at [openai] api_base
+    mock - MockBackend replaying gold annotations of output_dir
+    '''
+    backend = config['openai'].get('backend', 'openai')
+    if backend == 'openai':
+        return OpenAIBackend(config['openai']['api_key'])
+    elif backend == 'compatible':
+        return OpenAIBackend(config['openai']['api_key'], config['openai']['api_base'])
+    elif backend == 'mock':
+        return MockBackend.from_config(config, output_dir)
+    raise ValueError(f'unknown backend: {backend}')
@@ -0,0 +1,211 @@
+import configparser
+import json
+import logging
+import os, glob
+import time
+import uuid
+import urllib.request
+import urllib.error
+from datetime import date
+
+import tqdm as td
+
+from api_engine import clean_response, output_file_path
+from chunking import split_windows, merge_event_responses
+from run_api import TASKS, get_output_path, get_shots
+
+CHAT_ENDPOINT = '/v1/chat/completions'
+FINAL_STATUS = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchClient:
+    '''
+    Minimal client of the OpenAI Files and Batch endpoints.
+    api_base can point to any server implementing them, e.g. mock_server.py.
+    '''
+    def __init__(self, api_base: str, api_key: str, timeout: float = 600):
+        self.api_base = api_base.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _request(self, method: str, url: str, data: bytes = None, content_type: str = None) -> bytes:
+        request = urllib.request.Request(self.api_base + url, data = data, method = method)
+        request.add_header('Authorization', f'Bearer {self.api_key}')
+        if content_type is not None:
+            request.add_header('Content-Type', content_type)
+        try:
+            with urllib.request.urlopen(request, timeout = self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f'{method} {url} failed with {e.code}: {e.read().decode("utf-8", "replace")}') from e
+
+    def _json(self, method: str, url: str, payload: dict = None) -> dict:
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        return json.loads(self._request(method, url, data, 'application/json' if data is not None else None))
+
+    def upload_file(self, path: str, purpose: str = 'batch') -> str:
+        boundary = uuid.uuid4().hex
+        with open(path, 'rb') as f:
+            content = f.read()
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\n{purpose}\r\n'
+                f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+                f'Content-Type: application/jsonl\r\n\r\n').encode('utf-8') + content + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        response = self._request('POST', '/files', body, f'multipart/form-data; boundary={boundary}')
+        return json.loads(response)['id']
+
+    def create_batch(self, input_file_id: str, metadata: dict = None) -> dict:
+        return self._json('POST', '/batches', {'input_file_id': input_file_id, 'endpoint': CHAT_ENDPOINT,
+                                               'completion_window': '24h', 'metadata': metadata or {}})
+
+    def get_batch(self, batch_id: str) -> dict:
+        return self._json('GET', f'/batches/{batch_id}')
+
+    def download(self, file_id: str) -> str:
+        return self._request('GET', f'/files/{file_id}/content').decode('utf-8')
+
+
+def build_batch_requests(output_dir: str, config, tasks = ('ner', 're', 'nerre'), modes = (True, False), execute_date: str = None) -> list:
+    '''
+    One chat completion request per note (or per window of long NER notes) for every task/mode.
+    custom_id = <task>/<one|zero>/<noteID>/<window index>-of-<windows>/<window offset>
+    Notes whose .xml output already exists are skipped.
+    '''
+    model = config['openai']['model']
+    temp = float(config['openai']['temperature'])
+    requests = []
+    for task in tasks:
+        notes = glob.glob(os.path.join(output_dir, 'data', task, '*.txt'))
+        if task == 'ner':
+            chunk_chars = config['NER'].getint('chunk_chars', fallback=0)
+            chunk_overlap = config['NER'].getint('chunk_overlap', fallback=0)
+        else:
+            chunk_chars, chunk_overlap = 0, 0
+        for few_shot in modes:
+            mode = 'one' if few_shot else 'zero'
+            path = get_output_path(output_dir, config, task, few_shot, execute_date)
+            shots = get_shots(config, task, few_shot)
+            for note in notes:
+                if os.path.exists(output_file_path(path, note)):
+                    logging.info('output exists: %s' % note)
+                    continue
+                note_id = os.path.splitext(os.path.basename(note))[0]
+                with open(note, 'r') as f:
+                    content = f.read()
+                windows = split_windows(content, chunk_chars, chunk_overlap)
+                for index, (offset, window) in enumerate(windows):
+                    requests.append({
+                        'custom_id': f'{task}/{mode}/{note_id}/{index}-of-{len(windows)}/{offset}',
+                        'method': 'POST',
+                        'url': CHAT_ENDPOINT,
+                        'body': {
+                            'model': model,
+                            'temperature': temp,
+                            'n': 1,
+                            'messages': shots + [{'role':'user', 'content':window}]
+                        }
+                    })
+    return requests
+
+
+def write_batch_file(requests: list, path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+
+
+def wait_for_batch(client: BatchClient, batch_id: str, poll_interval: float = 30) -> dict:
+    while True:
+        batch = client.get_batch(batch_id)
+        counts = batch.get('request_counts') or {}
+        logging.info(f"batch {batch_id}: {batch['status']} ({counts.get('completed', 0)}/{counts.get('total', 0)} requests)")
+        if batch['status'] in FINAL_STATUS:
+            return batch
+        time.sleep(poll_interval)
+
+
+def fan_out(output_dir: str, config, results: str, execute_date: str = None) -> int:
+    '''
+    Write batch results back into output_<mode>_<model>_<yymmdd>/<task>/<noteID>.xml,
+    the same layout run_ner/run_re/run_nerre produce and eval.py expects.
+    A note is written only if every window of it succeeded; like failed interactive requests,
+    the others get no output, so they are recorded as failed and sent again by the next run.
+    Return the number of notes written.
+    '''
+    # {(task, mode, noteID): (number of windows, {index: (offset, response)})}
+    notes = {}
+    for line in results.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        task, mode, note_id, window, offset = result['custom_id'].split('/')
+        index, count = window.split('-of-')
+        response = ''
+        if result.get('response') and result['response'].get('status_code') == 200:
+            response = result['response']['body']['choices'][0]['message']['content']
+        else:
+            logging.error(f"{result['custom_id']}: batch request failed: {result.get('error')}")
+        notes.setdefault((task, mode, note_id), (int(count), {}))[1][int(index)] = (int(offset), response)
+
+    written = 0
+    for (task, mode, note_id), (count, windows) in td.tqdm(notes.items(), desc = "Writing batch output", unit = "files"):
+        if len(windows) < count:
+            logging.info(f"pass saving {note_id} file of {mode}-shot {task}, {count - len(windows)} of {count} windows missing...")
+            continue
+        responses = [windows[index] for index in sorted(windows)]
+        if any(response == '' for _, response in responses):
+            logging.info(f"pass saving {note_id} file of {mode}-shot {task} due to empty response...")
+            continue
+        response = responses[0][1] if len(responses) == 1 else merge_event_responses(responses)
+        path = get_output_path(output_dir, config, task, mode == 'one', execute_date)
+        os.makedirs(path, exist_ok=True)
+        with open(output_file_path(path, note_id), 'w', encoding='utf-8') as f:
+            f.write(clean_response(response, TASKS[task][1]))
+        written += 1
+    return written
+
+
+def run_batch(output_dir: str, tasks = ('ner', 're', 'nerre'), modes = (True, False), execute_date: str = None, config = None):
+    '''
+    Run the tasks for the whole corpus through the OpenAI Batch API.
+
+    Build one JSONL request file from result/data/{ner,re,nerre} and the task prompts,
+    submit it, poll every [openai] batch_poll_interval secs until it finishes,
+    and fan the results out into output_<mode>_<model>_<yymmdd>/<task>/<noteID>.xml.
+    The batch is sent to [openai] api_base, so a local stand-in server can be used for testing.
+    config - api.config settings, read from the working directory if None
+    '''
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read(os.path.join(os.getcwd(), "api.config"))
+    if execute_date is None:
+        execute_date = date.today().strftime("%y%m%d")
+
+    requests = build_batch_requests(output_dir, config, tasks, modes, execute_date)
+    if not requests:
+        logging.info('no notes to submit in batch mode')
+        return 0
+
+    batch_dir = os.path.join(output_dir, 'batch')
+    os.makedirs(batch_dir, exist_ok=True)
+    input_path = os.path.join(batch_dir, f'batch_{execute_date}_{uuid.uuid4().hex[:8]}.jsonl')
+    write_batch_file(requests, input_path)
+    logging.info(f'batch input file with {len(requests)} requests: {input_path}')
+
+    client = BatchClient(config['openai'].get('api_base', 'https://api.openai.com/v1'), config['openai']['api_key'])
+    file_id = client.upload_file(input_path)
+    batch = client.create_batch(file_id, {'tasks': ','.join(tasks), 'date': execute_date})
+    logging.info(f"submitted batch {batch['id']}")
+
+    batch = wait_for_batch(client, batch['id'], config['openai'].getfloat('batch_poll_interval', fallback=30))
+    if batch['status'] != 'completed':
+        logging.error(f"batch {batch['id']} ended with status {batch['status']}")
+    written = 0
+    if batch.get('output_file_id'):
+        results = client.download(batch['output_file_id'])
+        with open(os.path.splitext(input_path)[0] + '_output.jsonl', 'w', encoding='utf-8') as f:
+            f.write(results)
+        written = fan_out(output_dir, config, results, execute_date)
+    if batch.get('error_file_id'):
+        logging.error(f"batch errors:\n{client.download(batch['error_file_id'])}")
+    logging.info(f'wrote {written} notes from batch {batch["id"]}')
+    return written
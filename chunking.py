@@ -0,0 +1,98 @@
+import re
+
+from output_parser import iter_records
+
+# i2b2 notes have one sentence per line; also break after sentence-final punctuation.
+SENTENCE_END = re.compile(r'\n|(?<=[.!?])\s+')
+
+
+def sentence_spans(text: str) -> list:
+    '''
+    (start, end) character spans of the sentences in text, including trailing whitespace.
+    '''
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+        if end > start:
+            spans.append((start, end))
+            start = end
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def split_windows(text: str, max_chars: int, overlap: int = 0) -> list:
+    '''
+    Split a note into overlapping windows on sentence boundaries.
+    Return list of (offset, window text), where offset is the start of the window in the note.
+
+    Each window holds as many whole sentences as fit in max_chars (a longer sentence
+    becomes its own window), and the next window starts with the sentences of the last
+    `overlap` characters of the previous one. max_chars <= 0 disables chunking.
+    '''
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [(0, text)]
+    spans = sentence_spans(text)
+    windows = []
+    i = 0
+    while i < len(spans):
+        start = spans[i][0]
+        j = i
+        while j < len(spans) and spans[j][1] - start <= max_chars:
+            j += 1
+        if j == i:
+            j = i + 1
+        end = spans[j - 1][1]
+        windows.append((start, text[start:end]))
+        if j >= len(spans):
+            break
+        # Step back over the sentences that fall in the overlap, but always move forward and
+        # keep room for the next sentence, so every window holds at least one new sentence
+        k = j
+        while k - 1 > i and end - spans[k - 1][0] <= overlap and spans[j][1] - spans[k - 1][0] <= max_chars:
+            k -= 1
+        i = k
+    return windows
+
+
+def merge_event_responses(responses: list) -> str:
+    '''
+    Merge per-window NER responses into one response of the whole note.
+
+    responses - list of (offset, response) of each window
+    start/end of every <EVENT .../> are shifted by the window offset,
+    and entities found twice in overlapping windows (same start, end, text and type) are kept once.
+    IDs reused by different windows for different entities are renumbered.
+    '''
+    lines = []
+    seen = set()
+    used_ids = set()
+    next_id = {}
+    for offset, response in responses:
+        for attrs in iter_records(response.split('\n'), 'EVENT', ('text', 'type')):
+            if 'text' not in attrs or 'type' not in attrs:
+                continue
+            try:
+                attrs['start'] = str(int(attrs['start']) + offset)
+                attrs['end'] = str(int(attrs['end']) + offset)
+            except (KeyError, ValueError):
+                continue
+            key = (attrs['start'], attrs['end'], attrs['text'], attrs['type'])
+            if key in seen:
+                continue
+            seen.add(key)
+
+            entity_id = attrs.get('id', '')
+            if not entity_id or entity_id in used_ids:
+                prefix = re.match(r'[A-Za-z]*', entity_id).group(0) or ('E' if attrs['type'] in ('PROBLEM', 'TEST', 'TREATMENT', 'OCCURRENCE') else 'T')
+                n = next_id.get(prefix, 1000)
+                while f'{prefix}{n}' in used_ids:
+                    n += 1
+                entity_id = f'{prefix}{n}'
+                next_id[prefix] = n + 1
+                attrs['id'] = entity_id
+            used_ids.add(entity_id)
+
+            lines.append('<EVENT ' + ' '.join(f'{k}="{v}"' for k, v in attrs.items()) + '/>')
+    return '\n'.join(lines)
@@ -1,15 +1,448 @@
-import tqdm as td
 import os, glob
 from datetime import date
 import configparser
 import logging
 
+import numpy as np
 import pandas as pd
 
-import xml.etree.ElementTree as ET
-import re
+from annotation_store import AnnotationStore, GOLD, SOURCES, TLINK_COLUMNS, run_name
+from eval_bootstrap import METRICS, count_matrix, intervals, paired_pvalue, resample_totals, resample_weights, rule_scores
+from eval_cache import EvalCache, file_hash
+from temporal_closure import canonical_links, closure
 
-def eval_ner(output_dir: str, execute_date: str, few_shot: bool = True):
+NER_COLUMNS = ['noteID', 'id', 'start', 'end', 'text', 'type']
+
+
+def index_note_files(directory: str) -> dict:
+    '''
+    {noteID: path} of the .xml files in directory.
+    '''
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in glob.glob(os.path.join(directory, '*.xml'))}
+
+
+def pair_note_files(gold_dir: str, output_dir: str):
+    '''
+    Pair gold and model files by noteID.
+    Return (pairs, missing, extra):
+    pairs - [(noteID, gold file, output file)] of notes found in both directories
+    missing - noteIDs with a gold file but no model output (e.g. skipped by the API runner)
+    extra - noteIDs with a model output but no gold file
+    '''
+    gold = index_note_files(gold_dir)
+    output = index_note_files(output_dir)
+    missing = sorted(gold.keys() - output.keys())
+    extra = sorted(output.keys() - gold.keys())
+    if missing:
+        logging.warning(f'{len(missing)} of {len(gold)} gold notes have no output in {output_dir}: {", ".join(missing)}')
+    if extra:
+        logging.warning(f'{len(extra)} outputs in {output_dir} have no gold note: {", ".join(extra)}')
+    pairs = [(note, gold[note], output[note]) for note in sorted(gold.keys() & output.keys())]
+    return pairs, missing, extra
+
+
+def load_annotations(output_dir: str, path: str, task: str, columns: list, notes: list, processes: int = None):
+    '''
+    (df_original, df_output) of the given notes of the model output in path,
+    read from the annotation store (parsed into it first if the files changed).
+    '''
+    store = AnnotationStore(output_dir, processes)
+    df_original = store.load(GOLD, task, notes)[columns]
+    df_output = store.load(run_name(path), task, notes)[columns]
+    dropped = sum(count for note, count in store.dropped(run_name(path), task).items() if note in set(notes))
+    if dropped:
+        logging.info(f'dropped {dropped} malformed lines in total')
+    return df_original, df_output
+
+
+EXACT_KEYS = ['noteID', 'start', 'end', 'text', 'type']
+
+
+def is_exact_match(row, df_to_compare, type):
+    '''
+    True if any annotation of df_to_compare has the same noteID, start, end, text and type as row.
+    Reference implementation of exact matching (one scan of df_to_compare per row).
+    '''
+    # Filter the comparison dataframe for the current type
+    df_filtered = df_to_compare[df_to_compare['type'] == type]
+    # Check if there's any row in the filtered dataframe that matches all criteria
+    return any(
+        (df_filtered['noteID'] == row['noteID']) &
+        (df_filtered['start'] == row['start']) &
+        (df_filtered['end'] == row['end']) &
+        (df_filtered['text'] == row['text']) &
+        (df_filtered['type'] == row['type'])
+    )
+
+
+def exact_match(df_original, df_output, keys = EXACT_KEYS):
+    '''
+    Exact matching of NER annotations, from one groupby over the match keys.
+
+    Gold and model annotations are stacked and grouped by keys (the columns merged_df is joined on);
+    a key is matched if it holds at least one gold and one model annotation.
+    Annotations with a missing key value never match.
+    Return boolean arrays (gold_matched, model_matched) aligned with the rows of each dataframe.
+    '''
+    frame = pd.concat([df_original[keys].assign(gold=True, model=False),
+                       df_output[keys].assign(gold=False, model=True)], ignore_index=True)
+    complete = frame[keys].notna().all(axis=1).to_numpy()
+    grouped = frame[complete].groupby(keys, sort=False, observed=True)
+    matched = np.zeros(len(frame), dtype=bool)
+    matched[complete] = (grouped['gold'].transform('any') & grouped['model'].transform('any')).to_numpy()
+    return matched[:len(df_original)], matched[len(df_original):]
+
+
+def exact_type_counts(df_original, df_output, types, keys = EXACT_KEYS):
+    '''
+    Per-type exact match counts of NER annotations:
+    TP - gold annotations with a matched key
+    FN - gold annotations with an unmatched key
+    FP - model annotations with an unmatched key
+    Return a DataFrame indexed by types with TP, FP and FN columns.
+    '''
+    gold_matched, model_matched = exact_match(df_original, df_output, keys)
+    counts = match_counts(df_original, gold_matched, df_output, model_matched, 'exact', by = ['type'])
+    return counts.set_index('type')[['TP', 'FP', 'FN']].reindex(types, fill_value=0).astype(int)
+
+
+def exact_type_counts_reference(df_original, df_output, types):
+    '''
+    exact_type_counts computed row by row with is_exact_match; quadratic, kept as a regression check.
+    '''
+    rows = []
+    for t in types:
+        original_t = df_original[df_original['type'] == t]
+        output_t = df_output[df_output['type'] == t]
+        TP_t = sum(original_t.apply(is_exact_match, axis=1, df_to_compare=df_output, type=t)) if len(original_t) else 0
+        matched_t = sum(output_t.apply(is_exact_match, axis=1, df_to_compare=df_original, type=t)) if len(output_t) else 0
+        rows.append({'TP': TP_t, 'FP': len(output_t) - matched_t, 'FN': len(original_t) - TP_t})
+    return pd.DataFrame(rows, index=pd.Index(types, name='type'), columns=['TP', 'FP', 'FN']).astype(int)
+
+
+def check_exact_type_counts(df_original, df_output, types = None) -> bool:
+    '''
+    Compare exact_type_counts with the row-by-row reference; log the types that differ.
+    '''
+    if types is None:
+        types = list(set(df_original['type'].unique().tolist()))
+    counts = exact_type_counts(df_original, df_output, types)
+    reference = exact_type_counts_reference(df_original, df_output, types)
+    differ = (counts != reference).any(axis=1)
+    if differ.any():
+        logging.error(f'exact match counts differ from the reference:\n{counts[differ]}\nreference:\n{reference[differ]}')
+        return False
+    return True
+
+
+def relax_match(df_original, df_output):
+    '''
+    Relaxed span matching of NER annotations.
+
+    A gold and a model annotation match if they are in the same note, have the same text and type,
+    and their spans overlap:
+      (gold start < model start < gold end) & (gold start < model end)
+      | (model start < gold start) & (gold start < model end)
+
+    Candidate pairs come from one join on noteID, type and text, so only annotations of the same
+    partition are compared, and the overlap test runs vectorized over all pairs at once.
+    Return boolean arrays (gold_matched, model_matched) aligned with the rows of each dataframe.
+    '''
+    keys = ['noteID', 'type', 'text']
+    gold = df_original[keys].copy()
+    gold['start'] = pd.to_numeric(df_original['start'], errors='coerce')
+    gold['end'] = pd.to_numeric(df_original['end'], errors='coerce')
+    gold['gold_idx'] = np.arange(len(df_original))
+    model = df_output[keys].copy()
+    model['start'] = pd.to_numeric(df_output['start'], errors='coerce')
+    model['end'] = pd.to_numeric(df_output['end'], errors='coerce')
+    model['model_idx'] = np.arange(len(df_output))
+
+    pairs = gold.merge(model, on=keys, suffixes=('_gold', '_model'))
+    gold_start, gold_end = pairs['start_gold'].to_numpy(), pairs['end_gold'].to_numpy()
+    model_start, model_end = pairs['start_model'].to_numpy(), pairs['end_model'].to_numpy()
+    condition1 = (gold_start < model_start) & (model_start < gold_end) & (gold_start < model_end)
+    condition2 = (model_start < gold_start) & (gold_start < model_end)
+    matched = pairs[condition1 | condition2]
+
+    gold_matched = np.zeros(len(df_original), dtype=bool)
+    gold_matched[matched['gold_idx'].to_numpy()] = True
+    model_matched = np.zeros(len(df_output), dtype=bool)
+    model_matched[matched['model_idx'].to_numpy()] = True
+    return gold_matched, model_matched
+
+
+COUNT_COLUMNS = ['noteID', 'metric', 'type', 'TP', 'FP', 'FN']
+
+
+def match_counts(df_original, gold_matched, df_output, model_matched, metric: str,
+                 by: list = ['noteID', 'type'], tp_from: str = 'gold') -> pd.DataFrame:
+    '''
+    TP/FP/FN per group of annotations from per-annotation match flags.
+    TP - matched gold annotations (tp_from='gold') or matched model annotations (tp_from='model')
+    FN - unmatched gold annotations
+    FP - unmatched model annotations
+    '''
+    gold = df_original[by].assign(TP = gold_matched if tp_from == 'gold' else False, FP = False, FN = ~gold_matched)
+    model = df_output[by].assign(TP = model_matched if tp_from == 'model' else False, FP = ~model_matched, FN = False)
+    counts = (pd.concat([gold, model], ignore_index=True)
+              .groupby(by, observed=True, dropna=False)[['TP', 'FP', 'FN']].sum().astype(int).reset_index())
+    counts['metric'] = metric
+    return counts[[column for column in COUNT_COLUMNS if column in counts]]
+
+
+def pair_counts(merged_df, metric: str) -> pd.DataFrame:
+    '''
+    TP/FP/FN per noteID and type of an outer merge with indicator: rows found in both, right_only and left_only.
+    '''
+    counts = pd.DataFrame({
+        'noteID': merged_df['noteID'].astype(object),
+        'type': merged_df['type'].astype(object),
+        'TP': (merged_df['_merge'] == 'both').to_numpy(),
+        'FP': (merged_df['_merge'] == 'right_only').to_numpy(),
+        'FN': (merged_df['_merge'] == 'left_only').to_numpy(),
+    }).groupby(['noteID', 'type'], dropna=False)[['TP', 'FP', 'FN']].sum().astype(int).reset_index()
+    counts['metric'] = metric
+    return counts[COUNT_COLUMNS]
+
+
+def total_counts(counts, metric: str):
+    '''
+    (TP, FP, FN) of a metric summed over all notes and types.
+    '''
+    totals = counts.loc[counts['metric'] == metric, ['TP', 'FP', 'FN']].sum()
+    return int(totals['TP']), int(totals['FP']), int(totals['FN'])
+
+
+def type_totals(counts, metric: str) -> pd.DataFrame:
+    '''
+    TP/FP/FN of a metric per type, summed over all notes.
+    '''
+    return counts[counts['metric'] == metric].groupby('type', observed=True)[['TP', 'FP', 'FN']].sum().astype(int)
+
+
+def ner_note_counts(df_original, df_output):
+    '''
+    merged_df and per-note counts of NER:
+    exact_micro - rows of the exact match merge; exact - exact match per annotation
+    relax_micro - relaxed match, TP from gold annotations; relax - relaxed match, TP from model annotations
+    '''
+    merged_df = df_original.merge(df_output, on = EXACT_KEYS, how = 'outer', indicator = True)
+    gold_exact, model_exact = exact_match(df_original, df_output)
+    gold_relax, model_relax = relax_match(df_original, df_output)
+    counts = pd.concat([
+        pair_counts(merged_df, 'exact_micro'),
+        match_counts(df_original, gold_exact, df_output, model_exact, 'exact'),
+        match_counts(df_original, gold_relax, df_output, model_relax, 'relax_micro'),
+        match_counts(df_original, gold_relax, df_output, model_relax, 'relax', tp_from = 'model'),
+    ], ignore_index=True)
+    return merged_df, counts
+
+
+def closure_counts(df_original, df_output) -> pd.DataFrame:
+    '''
+    Per-note counts of closure-based evaluation (temporal awareness) of TLINKs.
+    closure_precision - model links (TP) implied or not (FP) by the closure of the gold links
+    closure_recall - gold links (TP) implied or not (FN) by the closure of the model links
+    Links are compared in closure form (temporal_closure.canonical), e.g. B AFTER A as A BEFORE B.
+    '''
+    keys = ['noteID', 'fromID', 'toID', 'type']
+    gold_closure, _ = closure(df_original)
+    model_closure, _ = closure(df_output)
+    precision_df = gold_closure[keys].merge(canonical_links(df_output), on=keys, how='right', indicator=True)
+    recall_df = canonical_links(df_original).merge(model_closure[keys], on=keys, how='left', indicator=True)
+    return pd.concat([pair_counts(precision_df, 'closure_precision'), pair_counts(recall_df, 'closure_recall')], ignore_index=True)
+
+
+def re_note_counts(df_original, df_output):
+    merged_df = df_original.merge(df_output, on=['noteID', 'fromID', 'toID', 'type'], how='outer', indicator=True)
+    return merged_df, pd.concat([pair_counts(merged_df, 'exact'), closure_counts(df_original, df_output)], ignore_index=True)
+
+
+def nerre_note_counts(df_original, df_output):
+    merged_df = df_original.merge(df_output, on = ['noteID', 'fromText', 'toText', 'type'], how = 'outer', indicator=True)
+    return merged_df, pair_counts(merged_df, 'exact')
+
+
+# task: (annotation columns, per-note counts)
+EVALUATORS = {
+    'ner': (NER_COLUMNS, ner_note_counts),
+    're': (TLINK_COLUMNS, re_note_counts),
+    'nerre': (TLINK_COLUMNS, nerre_note_counts),
+}
+
+# task: [(match, micro metric, macro metric, macro over gold types only, skip types without TP)]
+# the rules eval_ner, eval_re and eval_nerre report with
+SUMMARY_RULES = {
+    'ner': [('exact', 'exact_micro', 'exact', True, False), ('relax', 'relax_micro', 'relax', True, True)],
+    're': [('exact', 'exact', 'exact', False, True)],
+    'nerre': [('exact', 'exact', 'exact', False, False)],
+}
+
+
+def scores(TP: int, FP: int, FN: int):
+    '''
+    (precision, recall, f1)
+    '''
+    precision = TP / (TP + FP) if TP + FP != 0 else 0
+    recall = TP / (TP + FN) if TP + FN != 0 else 0
+    f1 = (2 * precision * recall) / (precision + recall) if precision + recall != 0 else 0
+    return precision, recall, f1
+
+
+def summarize(counts, task: str) -> list:
+    '''
+    One dict per match kind (exact, and relax for NER) with micro and macro precision, recall and f1
+    and <type>_precision/_recall/_f1 of every type in the macro average, from per-note counts.
+    '''
+    gold_counts = type_totals(counts, 'exact')
+    gold_types = gold_counts.index[(gold_counts['TP'] + gold_counts['FN']) > 0].tolist()
+    rows = []
+    for match, micro_metric, macro_metric, gold_only, skip_zero in SUMMARY_RULES[task]:
+        row = {'match': match}
+        row['micro_precision'], row['micro_recall'], row['micro_f1'] = scores(*total_counts(counts, micro_metric))
+        type_counts = type_totals(counts, macro_metric)
+        types = gold_types if gold_only else type_counts.index.tolist()
+        macro = []
+        for t in types:
+            TP_t, FP_t, FN_t = (int(count) for count in type_counts.loc[t, ['TP', 'FP', 'FN']])
+            if skip_zero and TP_t == 0:
+                continue
+            macro.append(scores(TP_t, FP_t, FN_t))
+            row[f'{t}_precision'], row[f'{t}_recall'], row[f'{t}_f1'] = macro[-1]
+        for i, name in enumerate(('macro_precision', 'macro_recall', 'macro_f1')):
+            row[name] = sum(score[i] for score in macro) / len(macro) if macro else 0
+        rows.append(row)
+    return rows
+
+
+def _rule_metrics(task: str) -> list:
+    # metric slots of the count matrix of a task: 'exact' (gold types) and every micro and macro metric
+    metrics = ['exact']
+    for _, micro, macro, _, _ in SUMMARY_RULES[task]:
+        metrics += [metric for metric in (micro, macro) if metric not in metrics]
+    return metrics
+
+
+def _bootstrap_scores(totals, task: str, metrics: list) -> dict:
+    # {match: {metric: array}} of summed counts, following SUMMARY_RULES
+    return {match: rule_scores(totals, metrics.index(micro), metrics.index(macro), gold_only, skip_zero, metrics.index('exact'))
+            for match, micro, macro, gold_only, skip_zero in SUMMARY_RULES[task]}
+
+
+def confidence_intervals(counts, task: str, resamples: int = 1000, alpha: float = 0.05, seed: int = 0) -> list:
+    '''
+    Note-level bootstrap confidence intervals of the micro and macro metrics of summarize.
+    One dict per match kind with <metric>, <metric>_low and <metric>_high.
+
+    Notes are drawn with replacement; every resample is a weighted sum over the notes x counts
+    matrix of per-note TP/FP/FN, so no annotations are merged again.
+    '''
+    metrics = _rule_metrics(task)
+    notes, types, matrix = count_matrix(counts, metrics)
+    point = _bootstrap_scores(matrix.sum(axis=0), task, metrics)
+    samples = _bootstrap_scores(resample_totals(matrix, resample_weights(len(notes), resamples, seed)), task, metrics)
+    return [dict(match=match, notes=len(notes), resamples=resamples, **intervals(point[match], samples[match], alpha))
+            for match in point]
+
+
+def paired_test(counts_a, counts_b, task: str, resamples: int = 1000, alpha: float = 0.05, seed: int = 0) -> list:
+    '''
+    Paired bootstrap comparison of two runs of a task over their shared notes.
+    One dict per match kind and metric with a (run a), b (run b), the difference a - b,
+    its confidence interval and a two-sided p-value. Both runs are scored on the same resamples.
+    '''
+    metrics = _rule_metrics(task)
+    shared = sorted(set(counts_a['noteID'].astype(str)) & set(counts_b['noteID'].astype(str)))
+    counts_a = counts_a[counts_a['noteID'].astype(str).isin(shared)]
+    counts_b = counts_b[counts_b['noteID'].astype(str).isin(shared)]
+    # one type axis for both runs
+    both = pd.concat([counts_a.assign(run = 'a'), counts_b.assign(run = 'b')], ignore_index=True)
+    both['metric'] = both['run'] + ':' + both['metric']
+    slots = ['a:' + metric for metric in metrics] + ['b:' + metric for metric in metrics]
+    _, _, matrix = count_matrix(both, slots, shared)
+    matrix_a, matrix_b = matrix[:, :len(metrics)], matrix[:, len(metrics):]
+    weights = resample_weights(len(shared), resamples, seed)
+    point_a = _bootstrap_scores(matrix_a.sum(axis=0), task, metrics)
+    point_b = _bootstrap_scores(matrix_b.sum(axis=0), task, metrics)
+    samples_a = _bootstrap_scores(resample_totals(matrix_a, weights), task, metrics)
+    samples_b = _bootstrap_scores(resample_totals(matrix_b, weights), task, metrics)
+    rows = []
+    for match in point_a:
+        for metric in METRICS:
+            observed = float(point_a[match][metric] - point_b[match][metric])
+            deltas = samples_a[match][metric] - samples_b[match][metric]
+            low, high = np.quantile(deltas, [alpha / 2, 1 - alpha / 2]) if resamples else (observed, observed)
+            rows.append({'match': match, 'metric': metric, 'notes': len(shared),
+                         'a': float(point_a[match][metric]), 'b': float(point_b[match][metric]),
+                         'difference': observed, 'difference_low': float(low), 'difference_high': float(high),
+                         'p_value': paired_pvalue(observed, deltas)})
+    return rows
+
+
+def log_summary(counts, task: str):
+    '''
+    Log micro, per-type and macro precision, recall and f1 of every match kind of a task (summarize).
+    '''
+    for row in summarize(counts, task):
+        match = row['match']
+        logging.info(f'Overall {match} match micro metrics...')
+        for metric in ('precision', 'recall', 'f1'):
+            logging.info(f"{match} match micro-{metric}: {round(row['micro_' + metric], 3)}")
+        logging.info('')
+        types = [key[:-len('_precision')] for key in row
+                 if key.endswith('_precision') and key not in ('micro_precision', 'macro_precision')]
+        for t in types:
+            logging.info(f'{match} macro type: {t}...')
+            for metric in ('precision', 'recall', 'f1'):
+                logging.info(f"{match} match macro {metric}: {round(row[f'{t}_{metric}'], 3)}")
+            logging.info('')
+        logging.info(f'Overall {match} macro performance...')
+        for metric in ('precision', 'recall', 'f1'):
+            logging.info(f"{match} match macro {metric}: {round(row['macro_' + metric], 3)}")
+        logging.info('')
+
+
+def log_confidence_intervals(counts, task: str, resamples: int, alpha: float = 0.05):
+    '''
+    Log the bootstrap intervals of micro and macro f1 (resamples = 0 skips them).
+    '''
+    if not resamples:
+        return
+    logging.info(f'Bootstrap {round(100 * (1 - alpha))}% confidence intervals ({resamples} resamples of notes)...')
+    for row in confidence_intervals(counts, task, resamples, alpha):
+        for metric in ('micro_f1', 'macro_f1'):
+            logging.info(f"{row['match']} match {metric.replace('_', '-')}: {round(row[metric], 3)} "
+                         f"[{round(row[metric + '_low'], 3)}, {round(row[metric + '_high'], 3)}]")
+    logging.info('')
+
+
+def evaluate_notes(output_dir: str, path: str, task: str, columns: list, note_counts,
+                   processes: int = None, incremental: bool = False):
+    '''
+    (merged_df, counts) of the notes with both a gold file and a model output in path.
+    counts - TP/FP/FN per noteID, metric and type (COUNT_COLUMNS) from note_counts(df_original, df_output)
+
+    Results are cached per note with the content hashes of its gold and output files (eval_cache.py).
+    With incremental, only notes whose files changed are loaded and scored again; the corpus-level
+    metrics are then aggregated from the per-note counts.
+    '''
+    pairs, missing, extra = pair_note_files(os.path.join(output_dir, SOURCES[task][1]), path)
+    keys = {note: (file_hash(original), file_hash(output)) for note, original, output in pairs}
+    cache = EvalCache.for_run(output_dir, run_name(path), task)
+    notes = cache.stale(keys) if incremental else list(keys)
+
+    df_original, df_output = load_annotations(output_dir, path, task, columns, notes, processes)
+    merged_df, counts = note_counts(df_original, df_output)
+    cache.update(keys, notes, counts, merged_df)
+    cache.save()
+    if incremental:
+        logging.info(f're-scored {len(notes)} of {len(keys)} notes')
+    return cache.merged, cache.counts
+
+
+def eval_ner(output_dir: str, execute_date: str, few_shot: bool = True, processes: int = None, incremental: bool = False,
+             resamples: int = 1000):
     '''
     Get performane of the task.
     By comparing gold standard and GPT-generated data, calculate performance.
@@ -25,9 +458,9 @@ def eval_ner(output_dir: str, execute_date: str, few_shot: bool = True):
     TP - (gold standard start < model start < gold standard end) & (gold standard start < model end)
       |- (model start < gold standard start) & (gold standard < model end)
     FP & FN - same as strict match    
+
+    Bootstrap confidence intervals of micro and macro f1 are logged from `resamples` resamples of notes (0 skips them).
     '''
-    # Read gold standard data
-    original_files = glob.glob(os.path.join(output_dir, 'eval/ner', '*.xml'))
     # Read GPT-generated output
     config = configparser.ConfigParser()
     config.read(os.path.join(os.getcwd(), "api.config"))
@@ -44,256 +477,24 @@ def eval_ner(output_dir: str, execute_date: str, few_shot: bool = True):
         else:
             date_path = "output_zero_" + model + "_" + execute_date + "/ner"
     path = os.path.join(output_dir, date_path)
-    output_files = glob.glob(os.path.join(path, "*.xml"))
     
     ### Calculate metrics
-    # preprocess
-    df_original_list = []
-    df_output_list = []
-    for original, output in td.tqdm(zip(original_files, output_files), total = len(original_files), desc = "Evaluating NER performance", unit = "files"):
-        with open(original, 'r') as f:
-            gold = f.read()
-        with open(output, 'r') as f:
-            gpt_output = f.read()
-        
-        # Replace unescaped special characters
-        gpt_output = gpt_output.replace('&', '&amp;')        
-        # Remove lines without text/type entities
-        lines = gpt_output.strip().split('\n')
-        lines = [line for line in lines if all(keyword in line for keyword in ('text', 'type'))]
-        gpt_output = '\n'.join(lines)
-        # Use regex to find the text attribute and then apply the replacement function
-        gpt_output = re.sub(r'text="([^"]*)"', 
-                            lambda match: 'text="' + match.group(1).replace('<', '&lt;').replace('>', '&gt;') + '"',
-                            gpt_output)
-        # Remove incomplete lines
-        pattern = r'<EVENT[^>]*\/>'
-        matches = re.findall(pattern, gpt_output) 
-        gpt_output = '<TAGS>\n' + '\n'.join(matches) + '\n</TAGS>'
-        
-        # Process original list
-        original_root = ET.fromstring(gold)
-        original_rows_by_note = []
-        # Append by individual note
-        try:
-            for event in original_root.findall("EVENT"):
-                row = {
-                    'noteID': os.path.splitext(os.path.basename(original))[0],
-                    'id': event.get('id'),
-                    'start': event.get('start'),
-                    'end': event.get('end'),
-                    'text': event.get('text'),
-                    'type': event.get('type')
-                }
-                original_rows_by_note.append(row)
-            # Append by whole corpus
-            df_original_list.append(pd.DataFrame(original_rows_by_note))
-            
-            ## Process output list
-            output_root = ET.fromstring(gpt_output)
-            output_rows_by_note = []
-            # Append by individual note
-            for event in output_root.findall("EVENT"):
-                row = {
-                    'noteID': os.path.splitext(os.path.basename(output))[0],
-                    'id': event.get('id'),
-                    'start': event.get('start'),
-                    'end': event.get('end'),
-                    'text': event.get('text'),
-                    'type': event.get('type')
-                }
-                output_rows_by_note.append(row)
-            # Append by whoel corpus
-            df_output_list.append(pd.DataFrame(output_rows_by_note))
-        except Exception as e:
-            logging.error(f'Error merging output files for evaluation: \n{e}')
-            logging.error(f'Error occurred file: {output}')
-        
-    df_original = pd.concat(df_original_list, ignore_index = True)
-    df_output = pd.concat(df_output_list, ignore_index = True)
-    
-    ### Calculate precision, recall, and f1-score
-    merged_df = df_original.merge(df_output, on = ['start', 'end', 'text', 'type'], how = 'outer', indicator = True)
+    # preprocess - gold and model annotations of the notes in both, from the annotation store
+    merged_df, counts = evaluate_notes(output_dir, path, 'ner', NER_COLUMNS, ner_note_counts, processes, incremental)
     
-    TP = len(merged_df[merged_df['_merge'] == 'both'])
-    FP = len(merged_df[merged_df['_merge'] == 'right_only'])
-    FN = len(merged_df[merged_df['_merge'] == 'left_only'])
-
-    ## Exact micro metrics
-    micro_precision = TP / (TP + FP) if TP + FP != 0 else 0
-    micro_recall = TP / (TP + FN) if TP + FN != 0 else 0
-    micro_f1 = (2 * micro_precision * micro_recall) / (micro_precision + micro_recall) if micro_precision + micro_recall != 0 else 0
-
+    ### Calculate precision, recall, and f1-score (exact and relax match, micro and macro)
     logging.info(f'Performance of named entity recognition:\n{path}')
     logging.info(f'================================')
-    logging.info(f'Overall exact match micro metrics...')
-    logging.info(f'exact match micro-precission: {round(micro_precision, 3)}')
-    logging.info(f'exact match micro-recall: {round(micro_recall, 3)}')
-    logging.info(f'exact match micro-f1: {round(micro_f1, 3)}\n')
-
-    # Define a function to check for an exact match across all fields
-    def is_exact_match(row, df_to_compare, type):
-        # Filter the comparison dataframe for the current type
-        df_filtered = df_to_compare[df_to_compare['type'] == type]
-        # Check if there's any row in the filtered dataframe that matches all criteria
-        return any(
-            (df_filtered['start'] == row['start']) &
-            (df_filtered['end'] == row['end']) &
-            (df_filtered['text'] == row['text']) &
-            (df_filtered['type'] == row['type'])
-        )
-
-    # For macro-average, we need to calculate metrics for each 'type' and then average them
-    # types = df_original['type'].unique().tolist() + df_output['type'].unique().tolist()
-    types = df_original['type'].unique().tolist()
-    types = list(set(types))  # get unique types
-    
-    # Initialize lists to hold the precision, recall, and F1 for each type
-    macro_precision_list, macro_recall_list, macro_f1_list = [], [], []
+    log_summary(counts, 'ner')
 
-    # Iterate over each unique type
-    for t in types:
-        # Calculate TP, FP, and FN for each type
-        TP_t = sum(df_original[df_original['type'] == t].apply(is_exact_match, axis=1, df_to_compare=df_output, type=t))
-        FP_t = sum(df_output[df_output['type'] == t].apply(is_exact_match, axis=1, df_to_compare=df_original, type=t))
-        FN_t = len(df_original[(df_original['type'] == t)]) - TP_t
-        
-        # Calculate precision, recall, and F1 for each type
-        precision_t = TP_t / (TP_t + FP_t) if TP_t + FP_t != 0 else 0
-        recall_t = TP_t / (TP_t + FN_t) if TP_t + FN_t != 0 else 0
-        f1_t = 2 * precision_t * recall_t / (precision_t + recall_t) if precision_t + recall_t != 0 else 0
-        
-        # Append the metrics to their respective lists
-        macro_precision_list.append(precision_t)
-        macro_recall_list.append(recall_t)
-        macro_f1_list.append(f1_t)
-        
-        logging.info(f'Exact macro relation type: {t}...')
-        logging.info(f'exact match macro precision: {round(precision_t, 3)}')
-        logging.info(f'exact match macro recall: {round(recall_t, 3)}')
-        logging.info(f'exact match macro f1-score: {round(f1_t, 3)}\n')
-
-    # Calculate the macro-averaged metrics
-    macro_precision = sum(macro_precision_list) / len(macro_precision_list)
-    macro_recall = sum(macro_recall_list) / len(macro_recall_list)
-    macro_f1 = sum(macro_f1_list) / len(macro_f1_list)
-    
-    logging.info(f'Overall exact macro performance...')
-    logging.info(f'exact match macro precision: {round(macro_precision, 3)}')
-    logging.info(f'exact match macro recall: {round(macro_recall, 3)}')
-    logging.info(f'exact match macro f1-score: {round(macro_f1, 3)}\n')
-    
-    ## Relax match
-    # macro metrics
-    # Define a function to check for overlap and text match
-    def is_relax_macro_match(gold_start, gold_end, gold_text, gold_type, model_start, model_end, model_text, model_type):
-        # Check for the two overlap conditions you've described
-        condition1 = (gold_start < model_start < gold_end) and (gold_start < model_end)
-        condition2 = (model_start < gold_start) and (gold_start < model_end)
-        # Check for text and type match
-        text_type_match = (gold_text == model_text) and (gold_type == model_type)
-        return (condition1 or condition2) and text_type_match
-
-    # Initialize counts
-    TP = 0
-    FP = 0
-    FN = 0
-
-    # Iterate over each row in the gold standard dataframe
-    # This approach might be too slow but better for memory-saving
-    for index, gold_row in td.tqdm(df_original.iterrows(), desc='Calculating TP/FN for relax macro metrics...', total=df_original.shape[0]):
-        # Find any matching annotations in the model's output
-        matches = df_output.apply(lambda model_row: is_relax_macro_match(
-            gold_row['start'], gold_row['end'], gold_row['text'], gold_row['type'],
-            model_row['start'], model_row['end'], model_row['text'], model_row['type']
-        ), axis=1)
-        
-        # If there's at least one match, it's a TP; otherwise, it's an FN
-        if matches.any():
-            TP += 1
-        else:
-            FN += 1
-
-    # Any annotation in the model's output that doesn't match with the gold standard is a FP
-    for index, model_row in td.tqdm(df_output.iterrows(), desc='Calculating FP for relax macro metrics...', total=df_output.shape[0]):
-        matches = df_original.apply(lambda gold_row: is_relax_macro_match(
-            gold_row['start'], gold_row['end'], gold_row['text'], gold_row['type'],
-            model_row['start'], model_row['end'], model_row['text'], model_row['type']
-        ), axis=1)
-        
-        # If there's no match, it's a FP
-        if not matches.any():
-            FP += 1
-
-    # Micro-averaged metrics
-    relax_micro_precision = TP / (TP + FP) if TP + FP != 0 else 0
-    relax_micro_recall = TP / (TP + FN) if TP + FN != 0 else 0
-    relax_micro_f1 = (2 * micro_precision * micro_recall) / (micro_precision + micro_recall) if micro_precision + micro_recall != 0 else 0
-
-    logging.info(f'Overall relax match micro metrics...')
-    logging.info(f'relax match micro-precission: {round(relax_micro_precision, 3)}')
-    logging.info(f'relax match micro-recall: {round(relax_micro_recall, 3)}')
-    logging.info(f'relax match micro-f1: {round(relax_micro_f1, 3)}\n')
-    
-    # Define a function to check for a relaxed match
-    def is_relaxed_micro_match(gold_row, model_row):
-        # Check for the two overlap conditions you've described
-        condition1 = (gold_row['start'] < model_row['start'] < gold_row['end']) and (gold_row['start'] < model_row['end'])
-        condition2 = (model_row['start'] < gold_row['start']) and (gold_row['start'] < model_row['end'])
-        # Check for text and type match
-        text_type_match = (gold_row['text'] == model_row['text']) and (gold_row['type'] == model_row['type'])
-        return (condition1 or condition2) and text_type_match
-
-    # Initialize lists to hold the precision, recall, and F1 for each type
-    macro_precision_list, macro_recall_list, macro_f1_list = [], [], []
-
-    # Iterate over each unique type
-    types = df_original['type'].unique().tolist()
-    types = list(set(types))  # get unique types
-    for t in types:
-        # Filter the dataframes for the current type
-        df_original_type = df_original[df_original['type'] == t]
-        df_output_type = df_output[df_output['type'] == t]
-
-        # Calculate TP, FP, and FN for each type using relaxed match
-        TP_t = sum(df_output_type.apply(lambda model_row: df_original_type.apply(lambda gold_row: is_relaxed_micro_match(gold_row, model_row), axis=1).any(), axis=1))
-        FN_t = sum(df_original_type.apply(lambda gold_row: not df_output_type.apply(lambda model_row: is_relaxed_micro_match(gold_row, model_row), axis=1).any(), axis=1))
-        FP_t = sum(df_output_type.apply(lambda model_row: not df_original_type.apply(lambda gold_row: is_relaxed_micro_match(gold_row, model_row), axis=1).any(), axis=1))
-
-        if not TP_t == 0: 
-            # Calculate precision, recall, and F1 for each type
-            precision_t = TP_t / (TP_t + FP_t) if TP_t + FP_t != 0 else 0
-            recall_t = TP_t / (TP_t + FN_t) if TP_t + FN_t != 0 else 0
-            f1_t = 2 * precision_t * recall_t / (precision_t + recall_t) if precision_t + recall_t != 0 else 0
-            
-            # Append the metrics to their respective lists
-            macro_precision_list.append(precision_t)
-            macro_recall_list.append(recall_t)
-            macro_f1_list.append(f1_t)
-
-            # Print the metrics for the current type
-            logging.info(f"Relax macro relation type: {t}...")
-            logging.info(f"relax match macro precision: {round(precision_t, 3)}")
-            logging.info(f"relax match macro recall: {round(recall_t, 3)}")
-            logging.info(f"relax match macro f1-score: {round(f1_t, 3)}\n")
-        else:
-            logging.info(f'passing type: {t} for not having TP')
-
-    # Calculate the macro-averaged metrics
-    relax_macro_precision = sum(macro_precision_list) / len(macro_precision_list)
-    relax_macro_recall = sum(macro_recall_list) / len(macro_recall_list)
-    relax_macro_f1 = sum(macro_f1_list) / len(macro_f1_list)
-
-    # Output the macro-averaged metrics
-    logging.info(f"Overall relax macro performance...")
-    logging.info(f"relax match macro precision: {round(relax_macro_precision, 3)}")
-    logging.info(f"relax match macro recall: {round(relax_macro_recall, 3)}")
-    logging.info(f"relax match macro f1-score: {round(relax_macro_f1, 3)}\n")
+    # Bootstrap intervals over notes of the metrics above
+    log_confidence_intervals(counts, 'ner', resamples)
     
     return merged_df
 
 
-def eval_re(output_dir, execute_date = None, few_shot: bool = True):
+def eval_re(output_dir, execute_date = None, few_shot: bool = True, processes: int = None, incremental: bool = False,
+             resamples: int = 1000):
     '''
     Get performance of the task.
     By comparing gold standard and GPT-generated data, calculate performance.
@@ -304,9 +505,13 @@ def eval_re(output_dir, execute_date = None, few_shot: bool = True):
     TP - correctly match all IDs and type.
     FP - Model identifies the relation not in gold standard. 
     FN - Relation exists in gold standard, but not in model result OR IDs are identical but type is different.
+
+    Temporal awareness: a model TLINK is correct if the temporal closure of the gold TLINKs implies it (precision)
+    and a gold TLINK is found if the closure of the model TLINKs implies it (recall), e.g. A BEFORE B and B BEFORE C
+    imply A BEFORE C. See temporal_closure.py.
+
+    Bootstrap confidence intervals of micro and macro f1 are logged from `resamples` resamples of notes (0 skips them).
     '''
-    # Read gold standard data
-    original_files = glob.glob(os.path.join(output_dir, 'eval/re', '*.xml'))
     # Read GPT generated output
     config = configparser.ConfigParser()
     config.read(os.path.join(os.getcwd(), "api.config"))
@@ -323,132 +528,33 @@ def eval_re(output_dir, execute_date = None, few_shot: bool = True):
         else:
             date_path = "output_zero_" + model + "_" + execute_date + "/re"
     path = os.path.join(output_dir, date_path)
-    output_files = glob.glob(os.path.join(path, '*.xml'))
-        
-    ### Calculate metrics
-    # preprocess
-    df_original_list = []
-    df_output_list = []
-    for original, output in td.tqdm(zip(original_files, output_files), total=len(original_files), desc="Evaluating tRE performance", unit="files"):
-        with open(original, 'r') as f:
-            gold = f.read()
-        with open(output, 'r') as f:
-            gpt_output = f.read()
-            
-        # Replace unescaped special characters
-        gpt_output = gpt_output.replace('&', '&amp;')
-        # Remove incomplete lines
-        lines = gpt_output.strip().split('\n')
-        lines = [line for line in lines if all(keyword in line for keyword in ('toID', 'fromID', 'type'))]
-        gpt_output = '\n'.join(lines)
-        # Remove xml tags in text snippet
-        gpt_output = re.sub(r'(<EVENT.*?/EVENT>)|(<TIMEX.*?/TIMEX>)|(<EVENT|<TIMEX|</EVENT>|</TIMEX>)', '', gpt_output)
-        # Remove complete lines
-        pattern = r'<TLINK[^>]*\/>'
-        matches = re.findall(pattern, gpt_output)
-        gpt_output = '<TAGS>\n' + '\n'.join(matches) + '\n</TAGS>'
-        
-        ## Process original list
-        original_root = ET.fromstring(gold)
-        original_rows_by_note = []
-        # Append by individual note
-        try:
-            for tlink in original_root.findall("TLINK"):
-                row = {
-                    'noteID': os.path.splitext(os.path.basename(original))[0],
-                    'id': tlink.get('id'),
-                    'fromID': tlink.get('fromID'),
-                    'fromText': tlink.get('fromText'),
-                    'toID': tlink.get('toID'),
-                    'toText': tlink.get('toText'),
-                    'type': tlink.get('type')
-                }
-                original_rows_by_note.append(row)
-            # Append by whole corpus
-            df_original_list.append(pd.DataFrame(original_rows_by_note))
-            
-            ## Process output list
-            output_root = ET.fromstring(gpt_output)
-            output_rows_by_note = []
-            # Append by individual note
-            for tlink in output_root.findall("TLINK"):
-                row = {
-                    'noteID': os.path.splitext(os.path.basename(output))[0],
-                    'id': tlink.get('id'),
-                    'fromID': tlink.get('fromID'),
-                    'fromText': tlink.get('fromText'),
-                    'toID': tlink.get('toID'),
-                    'toText': tlink.get('toText'),
-                    'type': tlink.get('type')
-                }
-                output_rows_by_note.append(row)
-            # Append by whole corpus
-            df_output_list.append(pd.DataFrame(output_rows_by_note))
-        except Exception as e:
-            logging.error(f'Error merging output files for evaluation: \n{e}\n')
-            logging.error(f'Error occrred file: {output}')
-        
-    df_original = pd.concat(df_original_list, ignore_index = True) # (175,7)
-    df_output = pd.concat(df_output_list, ignore_index = True) # (128,7)
-    # pd.set_option('display.max_columns', None)
-    # df_original.groupby('noteID').count()
-    
-    merged_df = df_original.merge(df_output, on=['fromID', 'toID', 'type'], how='outer', indicator=True)
-
-    TP = len(merged_df[merged_df['_merge'] == 'both'])
-    FP = len(merged_df[merged_df['_merge'] == 'right_only'])
-    FN = len(merged_df[merged_df['_merge'] == 'left_only'])
     
-    ### Calculate precision, recall, and f1-score
-    # Micro-averaged metrics
-    micro_precision = TP / (TP + FP) if TP + FP != 0 else 0
-    micro_recall = TP / (TP + FN) if TP + FN != 0 else 0
-    micro_f1 = (2 * micro_precision * micro_recall) / (micro_precision + micro_recall) if micro_precision + micro_recall != 0 else 0
+    ### Calculate metrics
+    # preprocess - gold and model annotations of the notes in both, from the annotation store
+    merged_df, counts = evaluate_notes(output_dir, path, 're', TLINK_COLUMNS, re_note_counts, processes, incremental)
 
+    ### Calculate precision, recall, and f1-score (micro and macro over types with TP)
     logging.info(f'Performance of temporal relation extraction:\n{path}')
     logging.info(f'================================')
-    logging.info(f'micro-precission: {round(micro_precision, 3)}')
-    logging.info(f'micro-recall: {round(micro_recall, 3)}')
-    logging.info(f'micro-f1: {round(micro_f1, 3)}\n')
-
-    # For macro-average, we need to calculate metrics for each 'type' and then average them
-    types = df_original['type'].unique().tolist() + df_output['type'].unique().tolist()
-    types = list(set(types))  # get unique types
+    log_summary(counts, 're')
 
-    macro_precision_list, macro_recall_list, macro_f1_list = [], [], []
+    # Temporal awareness: links are correct if implied by the other side's temporal closure
+    TP_p, FP_p, _ = total_counts(counts, 'closure_precision')
+    TP_r, _, FN_r = total_counts(counts, 'closure_recall')
+    closure_precision = TP_p / (TP_p + FP_p) if TP_p + FP_p != 0 else 0
+    closure_recall = TP_r / (TP_r + FN_r) if TP_r + FN_r != 0 else 0
+    closure_f1 = (2 * closure_precision * closure_recall) / (closure_precision + closure_recall) if closure_precision + closure_recall != 0 else 0
 
-    for t in types:
-        TP_t = len(merged_df[(merged_df['type'] == t) & (merged_df['_merge'] == 'both')])
-        FP_t = len(merged_df[(merged_df['type'] == t) & (merged_df['_merge'] == 'right_only')])
-        FN_t = len(merged_df[(merged_df['type'] == t) & (merged_df['_merge'] == 'left_only')])
-        
-        if not TP_t == 0: 
-            precision_t = TP_t / (TP_t + FP_t) if TP_t + FP_t != 0 else 0
-            recall_t = TP_t / (TP_t + FN_t) if TP_t + FN_t != 0 else 0
-            f1_t = (2 * precision_t * recall_t) / (precision_t + recall_t) if precision_t + recall_t != 0 else 0
-            
-            macro_precision_list.append(precision_t)
-            macro_recall_list.append(recall_t)
-            macro_f1_list.append(f1_t)
-            
-            logging.info(f'Relation type: {t}...')
-            logging.info(f'macro precision: {round(precision_t, 3)}...')
-            logging.info(f'macro recall: {round(recall_t, 3)}...')
-            logging.info(f'macro f1-score: {round(f1_t, 3)}\n')
-        else:
-            logging.info(f'pass type: {t} for not having TP')
+    logging.info(f'Overall temporal awareness (closure-based) performance...')
+    logging.info(f'temporal awareness precision: {round(closure_precision, 3)}')
+    logging.info(f'temporal awareness recall: {round(closure_recall, 3)}')
+    logging.info(f'temporal awareness f1: {round(closure_f1, 3)}\n')
 
-    macro_precision = sum(macro_precision_list) / len(macro_precision_list)
-    macro_recall = sum(macro_recall_list) / len(macro_recall_list)
-    macro_f1 = sum(macro_f1_list) / len(macro_f1_list)
-
-    logging.info(f'Overall macro performance...')
-    logging.info(f'macro precision: {round(macro_precision, 3)}')
-    logging.info(f'macro recall: {round(macro_recall, 3)}')
-    logging.info(f'macro f1: {(round(macro_f1, 3))}\n')
+    log_confidence_intervals(counts, 're', resamples)
     return merged_df
     
-def eval_nerre(output_dir: str, execute_date = None, few_shot: bool = True):
+def eval_nerre(output_dir: str, execute_date = None, few_shot: bool = True, processes: int = None, incremental: bool = False,
+             resamples: int = 1000):
     '''
     Get performance of end-to-end approach of the task
     By comparing gold standard and GPT-generated data, calculate performacne.
@@ -463,10 +569,9 @@ def eval_nerre(output_dir: str, execute_date = None, few_shot: bool = True):
     TP - correctly match all text and type.
     FP - Model identified the relation not in gold standard.
     FN - Reltaion exists in gold standard, but not in model result OR entities are identical but type is different.
+
+    Bootstrap confidence intervals of micro and macro f1 are logged from `resamples` resamples of notes (0 skips them).
     '''
-    # Read gold standard data
-    # Currently, evaluation is not differnt from relation-extraction.
-    original_files = glob.glob(os.path.join(output_dir, 'eval/re', '*.xml')) 
     # Read GPT-generated output
     config = configparser.ConfigParser()
     config.read(os.path.join(os.getcwd(), "api.config"))
@@ -483,130 +588,17 @@ def eval_nerre(output_dir: str, execute_date = None, few_shot: bool = True):
         else:
             date_path = "output_zero_" + model + "_" + execute_date + "/nerre"
     path = os.path.join(output_dir, date_path)
-    output_files = glob.glob(os.path.join(path, "*.xml"))
     
     ### Calculate metrics
-    # preprocess
-    df_original_list = []
-    df_output_list = []
-    for original, output in td.tqdm(zip(original_files, output_files), total = len(original_files), desc = "Evaluting NERRE performance", unit = "files"):
-        with open(original, 'r') as f:
-            gold = f.read()
-        with open(output, 'r') as f:
-            gpt_output = f.read()
-        
-        # Replace unescaped special characters
-        gpt_output = gpt_output.replace('&', '&amp;')
-        # Remove incomplete lines
-        lines = gpt_output.strip().split('\n')
-        lines = [line for line in lines if all(keyword in line for keyword in ('toText', 'fromText', 'type'))]
-        gpt_output = '\n'.join(lines)
-        # Remove xml tags in text snippet
-        gpt_output = re.sub(r'(<EVENT.*?/EVENT>)|(<TIMEX.*?/TIMEX>)|(<EVENT|<TIMEX|</EVENT>|</TIMEX>)', '', gpt_output)
-        # Use regex to find the fromText/toText attributes and then apply the replacement function
-        gpt_output = re.sub(r'fromText="([^"]*)"', 
-                            lambda match: 'fromText="' + match.group(1).replace('<', '&lt;').replace('>', '&gt;') + '"',
-                            gpt_output)
-        gpt_output = re.sub(r'toText="([^"]*)"', 
-                            lambda match: 'tpText="' + match.group(1).replace('<', '&lt;').replace('>', '&gt;') + '"', 
-                            gpt_output)
-        # Remove complete lines
-        pattern = r'<TLINK[^>]*\/>'
-        matches = re.findall(pattern, gpt_output)
-        gpt_output = '<TAGS>\n' + '\n'.join(matches) + '\n</TAGS>'
-        
-        ## Process original list
-        original_root = ET.fromstring(gold)
-        original_rows_by_note = []
-        # Append by individual note
-        try:
-            for tlink in original_root.findall("TLINK"):
-                row = {
-                    'noteID': os.path.splitext(os.path.basename(original))[0],
-                    'id': tlink.get('id'),
-                    'fromID': tlink.get('fromID'),
-                    'fromText': tlink.get('fromText'),
-                    'toID': tlink.get('toID'),
-                    'toText': tlink.get('toText'),
-                    'type': tlink.get('type')
-                }
-                original_rows_by_note.append(row)
-            # Append by whole corpus
-            df_original_list.append(pd.DataFrame(original_rows_by_note))
-            
-            ## Process output list
-            output_root = ET.fromstring(gpt_output)
-            output_rows_by_note = []
-            # Append by individual notes
-            for tlink in output_root.findall("TLINK"):
-                row = {
-                    'noteID': os.path.splitext(os.path.basename(output))[0],
-                    'id': tlink.get('id'),
-                    'fromID': tlink.get('fromID'),
-                    'fromText': tlink.get('fromText'),
-                    'toID': tlink.get('toID'),
-                    'toText': tlink.get('toText'),
-                    'type': tlink.get('type')
-                }
-                output_rows_by_note.append(row)
-            # Append by whole corpus
-            df_output_list.append(pd.DataFrame(output_rows_by_note))
-        except Exception as e:
-            logging.error(f'error merging output files for evaluation: \n{e}\n')
-            logging.error(f'error occurred file: {output}')
-        
-    df_original = pd.concat(df_original_list, ignore_index=True)
-    df_output = pd.concat(df_output_list, ignore_index=True)
-    
-    merged_df = df_original.merge(df_output, on = ['fromText','toText','type'], how = 'outer', indicator=True)
-    
-    TP = len(merged_df[merged_df['_merge'] == 'both'])
-    FP = len(merged_df[merged_df['_merge'] == 'right_only'])
-    FN = len(merged_df[merged_df['_merge'] == 'left_only'])
+    # preprocess - gold and model annotations of the notes in both, from the annotation store
+    # Currently, evaluation is not differnt from relation-extraction.
+    merged_df, counts = evaluate_notes(output_dir, path, 'nerre', TLINK_COLUMNS, nerre_note_counts, processes, incremental)
     
-    ### Calculate precision, recall, and f1-score
-    # Micro-averaged metrics
-    micro_precision = TP / (TP + FP) if TP + FP != 0 else 0
-    micro_recall = TP / (TP + FN) if TP + FN != 0 else 0
-    micro_f1 = (2 * micro_precision * micro_recall) / (micro_precision + micro_recall) if micro_precision + micro_recall != 0 else 0
-
+    ### Calculate precision, recall, and f1-score (micro and macro)
     logging.info(f'Performance of end-to-end temporal relation extraction:\n{path}')
     logging.info(f'================================')
-    logging.info(f'micro-precission: {round(micro_precision, 3)}')
-    logging.info(f'micro-recall: {round(micro_recall, 3)}')
-    logging.info(f'micro-f1: {round(micro_f1, 3)}\n')
+    log_summary(counts, 'nerre')
 
-    # For macro-average, we need to calculate metrics for each 'type' and then average them
-    types = df_original['type'].unique().tolist() + df_output['type'].unique().tolist()
-    types = list(set(types))  # get unique types
-
-    macro_precision_list, macro_recall_list, macro_f1_list = [], [], []
-
-    for t in types:
-        TP_t = len(merged_df[(merged_df['type'] == t) & (merged_df['_merge'] == 'both')])
-        FP_t = len(merged_df[(merged_df['type'] == t) & (merged_df['_merge'] == 'right_only')])
-        FN_t = len(merged_df[(merged_df['type'] == t) & (merged_df['_merge'] == 'left_only')])
-        
-        precision_t = TP_t / (TP_t + FP_t) if TP_t + FP_t != 0 else 0
-        recall_t = TP_t / (TP_t + FN_t) if TP_t + FN_t != 0 else 0
-        f1_t = (2 * precision_t * recall_t) / (precision_t + recall_t) if precision_t + recall_t != 0 else 0
-        
-        macro_precision_list.append(precision_t)
-        macro_recall_list.append(recall_t)
-        macro_f1_list.append(f1_t)
-        
-        logging.info(f'Relation type: {t}...')
-        logging.info(f'macro precision: {round(precision_t, 3)}')
-        logging.info(f'macro recall: {round(recall_t, 3)}')
-        logging.info(f'macro f1-score: {round(f1_t, 3)}\n')
-
-    macro_precision = sum(macro_precision_list) / len(macro_precision_list)
-    macro_recall = sum(macro_recall_list) / len(macro_recall_list)
-    macro_f1 = sum(macro_f1_list) / len(macro_f1_list)
-
-    logging.info(f'Overall macro performance...')
-    logging.info(f'macro precision: {round(macro_precision, 3)}')
-    logging.info(f'macro recall: {round(macro_recall, 3)}')
-    logging.info(f'macro f1: {round(macro_f1, 3)}\n')
+    log_confidence_intervals(counts, 'nerre', resamples)
     
     return merged_df
\ No newline at end of file
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+METRICS = ('micro_precision', 'micro_recall', 'micro_f1', 'macro_precision', 'macro_recall', 'macro_f1')
+
+
+def count_matrix(counts, metrics: list, notes: list = None):
+    '''
+    (notes, types, matrix) of per-note counts (eval.COUNT_COLUMNS).
+    matrix[note, metric, type, :] = TP, FP, FN; the last type slot holds annotations without a type,
+    which count toward micro metrics only. Notes without counts are all zeros.
+    '''
+    counts = counts[counts['metric'].isin(metrics)]
+    if notes is None:
+        notes = sorted(counts['noteID'].astype(str).unique())
+    types = sorted(counts['type'].dropna().astype(str).unique())
+    note_codes = pd.Categorical(counts['noteID'].astype(str), categories=notes).codes
+    metric_codes = pd.Categorical(counts['metric'], categories=list(metrics)).codes
+    type_codes = pd.Categorical(counts['type'].astype(object).where(counts['type'].notna()), categories=types).codes.copy()
+    type_codes[type_codes < 0] = len(types)
+    keep = note_codes >= 0
+    matrix = np.zeros((len(notes), len(metrics), len(types) + 1, 3), dtype=np.int64)
+    np.add.at(matrix, (note_codes[keep], metric_codes[keep], type_codes[keep]),
+              counts[['TP', 'FP', 'FN']].to_numpy(dtype=np.int64)[keep])
+    return notes, types, matrix
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape), where=denominator != 0)
+
+
+def prf(totals):
+    '''
+    (precision, recall, f1) arrays of TP/FP/FN totals in the last axis; 0 where undefined.
+    '''
+    TP, FP, FN = (totals[..., i].astype(float) for i in range(3))
+    precision = _ratio(TP, TP + FP)
+    recall = _ratio(TP, TP + FN)
+    f1 = _ratio(2 * precision * recall, precision + recall)
+    return precision, recall, f1
+
+
+def _macro(scores, mask):
+    # mean over the type axis of the types in mask; 0 without types
+    return _ratio((scores * mask).sum(axis=-1), mask.sum(axis=-1))
+
+
+def rule_scores(totals, micro: int, macro: int, gold_only: bool, skip_zero: bool, gold: int) -> dict:
+    '''
+    {metric: array} of the METRICS of summed counts totals[..., metric, type, 3].
+    micro/macro/gold - metric slots of the micro counts, the macro counts and the counts defining gold types
+    gold_only - macro over types with gold annotations (TP or FN of gold); otherwise over types with any count
+    skip_zero - leave types without TP out of the macro average
+    '''
+    result = dict(zip(METRICS[:3], prf(totals[..., micro, :, :].sum(axis=-2))))
+    typed = totals[..., :-1, :]
+    if gold_only:
+        mask = (typed[..., gold, :, 0] + typed[..., gold, :, 2]) > 0
+    else:
+        mask = typed[..., macro, :, :].sum(axis=-1) > 0
+    if skip_zero:
+        mask = mask & (typed[..., macro, :, 0] > 0)
+    for name, scores in zip(METRICS[3:], prf(typed[..., macro, :, :])):
+        result[name] = _macro(scores, mask)
+    return result
+
+
+def resample_weights(notes: int, resamples: int, seed: int = 0):
+    '''
+    (resamples, notes) matrix of how often each note is drawn in each bootstrap resample.
+    '''
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(notes, np.full(notes, 1 / notes), size=resamples) if notes else np.zeros((resamples, 0), dtype=np.int64)
+
+
+def resample_totals(matrix, weights):
+    '''
+    Summed counts of every resample: (resamples, metric, type, 3).
+    '''
+    return np.tensordot(weights, matrix, axes=(1, 0))
+
+
+def intervals(point: dict, samples: dict, alpha: float = 0.05) -> dict:
+    '''
+    {metric, metric_low, metric_high} percentile intervals of bootstrap samples around point estimates.
+    '''
+    result = {}
+    for name, value in point.items():
+        low, high = np.quantile(samples[name], [alpha / 2, 1 - alpha / 2])
+        result[name], result[f'{name}_low'], result[f'{name}_high'] = float(value), float(low), float(high)
+    return result
+
+
+def paired_pvalue(observed: float, deltas) -> float:
+    '''
+    Two-sided p-value of a paired bootstrap test: how often a resampled difference lies
+    at least |observed| away from the observed difference.
+    '''
+    return float(np.mean(np.abs(deltas - observed) >= abs(observed) - 1e-12)) if len(deltas) else 1.0
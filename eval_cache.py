@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import os
+import pickle
+
+import pandas as pd
+
+from annotation_store import STORE_DIR
+
+# Bump when the per-note counts change meaning, so cached results are recomputed
+VERSION = 2
+
+
+def file_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class EvalCache:
+    '''
+    Per-note evaluation results of one run and task, kept in <output_dir>/store/<run>/eval_<task>.pkl.
+
+    keys - {noteID: (sha256 of the gold file, sha256 of the output file)} the results were computed from
+    counts - TP/FP/FN per noteID, metric and type
+    merged - merged_df rows of the notes
+    A note is stale if either of its files changed; re-scoring replaces only the rows of stale notes.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.keys = {}
+        self.counts = None
+        self.merged = None
+        self._load()
+
+    @classmethod
+    def for_run(cls, output_dir: str, run: str, task: str):
+        return cls(os.path.join(output_dir, STORE_DIR, run, f'eval_{task}.pkl'))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            logging.error(f'ignoring unreadable evaluation cache {self.path}: \n{e}')
+            return
+        if cached.get('version') == VERSION:
+            self.keys, self.counts, self.merged = cached['keys'], cached['counts'], cached['merged']
+
+    def stale(self, keys: dict) -> list:
+        '''
+        noteIDs of keys whose results are missing or were computed from different files.
+        '''
+        return [note for note, key in keys.items() if self.keys.get(note) != key]
+
+    def update(self, keys: dict, notes: list, counts: pd.DataFrame, merged: pd.DataFrame):
+        '''
+        Replace the results of notes with counts and merged, and drop notes no longer in keys.
+        '''
+        keep = [note for note in keys if note not in set(notes)]
+        counts_list, merged_list = [], []
+        if self.counts is not None:
+            counts_list.append(self.counts[self.counts['noteID'].isin(keep)])
+            merged_list.append(self.merged[self.merged['noteID'].isin(keep)])
+        counts_list.append(counts)
+        merged_list.append(merged)
+        self.counts = pd.concat(counts_list, ignore_index=True).sort_values('noteID', kind='stable', ignore_index=True)
+        self.merged = pd.concat(merged_list, ignore_index=True).sort_values('noteID', kind='stable', ignore_index=True)
+        self.keys = dict(keys)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump({'version': VERSION, 'keys': self.keys, 'counts': self.counts, 'merged': self.merged}, f)
+        os.replace(self.path + '.tmp', self.path)
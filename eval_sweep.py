@@ -0,0 +1,124 @@
+import argparse
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import tqdm as td
+
+from annotation_store import AnnotationStore, GOLD, SOURCES, parse_run, run_name
+from eval import EVALUATORS, confidence_intervals, evaluate_notes, paired_test, summarize
+
+RUN_COLUMNS = ['run', 'task', 'mode', 'model', 'date', 'match', 'notes']
+METRIC_COLUMNS = [column for metric in ('micro_precision', 'micro_recall', 'micro_f1', 'macro_precision', 'macro_recall', 'macro_f1')
+                  for column in (metric, metric + '_low', metric + '_high')]
+
+
+def discover_runs(output_dir: str) -> list:
+    '''
+    [(run, task)] of every output_<mode>_<model>_<yymmdd>/<task> directory under output_dir.
+    '''
+    runs = []
+    for path in sorted(glob.glob(os.path.join(output_dir, 'output_*'))):
+        for task in SOURCES:
+            if os.path.isdir(os.path.join(path, task)):
+                runs.append((run_name(path), task))
+    return runs
+
+
+def run_counts(output_dir: str, run: str, task: str, incremental: bool = True):
+    '''
+    Per-note counts of one run and task (eval.evaluate_notes), scored in this process.
+    '''
+    columns, note_counts = EVALUATORS[task]
+    path = os.path.join(output_dir, 'output_' + run, task)
+    merged_df, counts = evaluate_notes(output_dir, path, task, columns, note_counts, processes = 1, incremental = incremental)
+    return counts
+
+
+def evaluate_run(output_dir: str, run: str, task: str, incremental: bool = True, resamples: int = 1000) -> list:
+    '''
+    Metrics rows (see eval.summarize) of one run and task, with the run's mode, model and date
+    and bootstrap intervals (<metric>_low, <metric>_high) of the micro and macro metrics.
+    '''
+    counts = run_counts(output_dir, run, task, incremental)
+    info = dict(parse_run(run), run = run, task = task, notes = int(counts['noteID'].nunique()))
+    rows = [dict(info, **row) for row in summarize(counts, task)]
+    if resamples:
+        for row, ci in zip(rows, confidence_intervals(counts, task, resamples)):
+            row.update({key: value for key, value in ci.items() if key.endswith(('_low', '_high'))})
+    return rows
+
+
+def sweep(output_dir: str, processes: int = None, incremental: bool = True, output_file: str = None,
+          resamples: int = 1000) -> pd.DataFrame:
+    '''
+    Evaluate every run under output_dir in parallel and write one metrics table.
+
+    One row per run, task and match kind (exact; relax for NER) with mode, model, date,
+    micro/macro precision, recall and f1 with bootstrap intervals, and <type>_precision/_recall/_f1 per type.
+    Runs are spread across processes; each run is scored incrementally from its evaluation cache.
+    The table goes to output_file (default: output_dir/metrics.csv).
+    '''
+    runs = discover_runs(output_dir)
+    logging.info(f'evaluating {len(runs)} run/task combinations under {output_dir}')
+
+    # Gold partitions are shared by every run; bring them up to date once before the workers read them
+    store = AnnotationStore(output_dir, processes)
+    for task in sorted(set(task for _, task in runs)):
+        store.refresh(GOLD, task)
+
+    rows = []
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        futures = [executor.submit(evaluate_run, output_dir, run, task, incremental, resamples) for run, task in runs]
+        for future, (run, task) in td.tqdm(zip(futures, runs), total = len(runs), desc = "Evaluating runs", unit = "runs"):
+            try:
+                rows += future.result()
+            except Exception as e:
+                logging.error(f'error occurred while evaluating {task} of {run}: \n{e}')
+
+    df = pd.DataFrame(rows)
+    type_columns = sorted(column for column in df.columns if column not in RUN_COLUMNS + METRIC_COLUMNS)
+    df = df.reindex(columns = RUN_COLUMNS + METRIC_COLUMNS + type_columns)
+    df = df.sort_values(['task', 'match', 'run'], ignore_index = True)
+
+    if output_file is None:
+        output_file = os.path.join(output_dir, 'metrics.csv')
+    df.to_csv(output_file, index = False)
+    logging.info(f'wrote metrics of {len(runs)} run/task combinations to {output_file}')
+    return df
+
+
+def compare_runs(output_dir: str, task: str, run_a: str, run_b: str, resamples: int = 1000) -> pd.DataFrame:
+    '''
+    Paired bootstrap test of two runs of a task (e.g. one-shot vs zero-shot prompts) on their shared notes.
+    One row per match kind and metric: a, b, difference a - b with its interval, and p-value.
+    '''
+    df = pd.DataFrame(paired_test(run_counts(output_dir, run_a, task), run_counts(output_dir, run_b, task), task, resamples))
+    df.insert(0, 'task', task)
+    df.insert(1, 'run_a', run_a)
+    df.insert(2, 'run_b', run_b)
+    for row in df.itertuples():
+        logging.info(f'{task} {row.match} {row.metric}: {round(row.a, 3)} vs {round(row.b, 3)}, '
+                     f'difference {round(row.difference, 3)} [{round(row.difference_low, 3)}, {round(row.difference_high, 3)}], '
+                     f'p = {round(row.p_value, 4)}')
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Evaluate every output_* run under a result directory into one metrics table')
+    parser.add_argument('--result-dir', default='result')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--full', action='store_true', help='re-score every note instead of only changed ones')
+    parser.add_argument('--output', default=None, help='metrics table path (default: <result-dir>/metrics.csv)')
+    parser.add_argument('--resamples', type=int, default=1000, help='bootstrap resamples of notes (0 skips intervals)')
+    parser.add_argument('--compare', nargs=3, metavar=('TASK', 'RUN_A', 'RUN_B'), default=None,
+                        help='paired bootstrap test of two runs, e.g. ner one_gpt-4_231027 zero_gpt-4_231027')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    if args.compare:
+        compare_runs(args.result_dir, *args.compare, resamples=args.resamples)
+    else:
+        sweep(args.result_dir, args.processes, not args.full, args.output, args.resamples)
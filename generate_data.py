@@ -4,288 +4,300 @@ import xml.dom.minidom as minidom
 
 
 import glob
+import json
 import logging
 import tqdm as td
+from concurrent.futures import ProcessPoolExecutor
 
 import chardet
+
+from markup import render_spans
 # Need to add merge_data for all function
 
-def generate_input_data(input_dir, output_dir):
+INPUT_TARGETS = ('data/ner', 'data/re', 'data/nerre')
+EVAL_TARGETS = ('eval/ner', 'eval/re', 'eval/nerre')
+
+
+# Bytes given to chardet when a file is not valid UTF-8
+DETECT_PREFIX = 64 * 1024
+MANIFEST = 'encoding_manifest.json'
+
+
+def detect_encoding(rawdata):
+    '''
+    Try strict UTF-8 first and fall back to chardet on a bounded prefix.
+    '''
+    try:
+        rawdata.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    encoding = chardet.detect(rawdata[:DETECT_PREFIX])['encoding']
+    try:
+        rawdata.decode(encoding)
+    except (UnicodeDecodeError, TypeError, LookupError):
+        # The prefix was not representative; detect on the whole file
+        encoding = chardet.detect(rawdata)['encoding']
+    return encoding
+
+
+def _manifest_key(xml_file):
+    stat = os.stat(xml_file)
+    return f'{os.path.abspath(xml_file)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def load_encoding_manifest(output_dir):
+    '''
+    Detected encoding per source file, keyed by path, size and mtime.
+    '''
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f'ignoring unreadable encoding manifest {path}: \n{e}')
+        return {}
+
+
+def save_encoding_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _read_xml(xml_file, encoding = None):
+    '''
+    Read, decode and parse an i2b2 XML file.
+    Return (root, encoding); encoding is detected if not given.
+    '''
+    with open(xml_file, 'rb') as f:
+        rawdata = f.read()
+    if encoding is None:
+        encoding = detect_encoding(rawdata)
+    xml_data = rawdata.decode(encoding)
+
+    # Replace unescaped special characters
+    xml_data = xml_data.replace('&', '&amp;')
+    # Parse the XML string
+    return ET.fromstring(xml_data), encoding
+
+
+def _is_target_event(event, lower: bool = True):
+    '''
+    Only EVENTs (problem, test, treatment and occurrence) with positive and factual will be extracted.
+    '''
+    event_modality = event.attrib.get('modality', '')
+    event_polarity = event.attrib.get('polarity', '')
+    if lower:
+        event_type = event.attrib.get('type', '').lower()  # converting type to lowercase for comparison
+        return event_modality == 'FACTUAL' and event_polarity == 'POS' and event_type in ['problem', 'treatment', 'test', 'occurrence']
+    event_type = event.attrib.get('type', '')
+    return event_modality == 'FACTUAL' and event_polarity == 'POS' and event_type in ['PROBLEM', 'TREATMENT', 'TEST', 'OCCURRENCE']
+
+
+def _target_tlinks(root, event, timex):
+    # Extract related TLINK of target event/timex
+    target_tlink = []
+    for tlink in root.findall(".//TLINK"):
+        # EVENT to EVENT
+        if (tlink.attrib["fromID"] in event and tlink.attrib["toID"] in event) and tlink.attrib["id"].startswith('TL'):
+            target_tlink.append(tlink.attrib)
+        # EVENT to TIME X
+        if (tlink.attrib["fromID"] in event and tlink.attrib["toID"] in timex) and tlink.attrib["id"].startswith('TL'):
+            target_tlink.append(tlink.attrib)
+        # TIMEX to EVENT
+        if (tlink.attrib["fromID"] in timex and tlink.attrib["toID"] in event) and tlink.attrib["id"].startswith('TL'):
+            target_tlink.append(tlink.attrib)
+    return target_tlink
+
+
+def _pretty_xml(items, tag):
+    root2 = ET.Element("TAGS")
+
+    # Iterating through the items and creating XML sub-elements
+    for item in items:
+        ET.SubElement(root2, tag, item)
+
+    # Creating the XML tree with the root2 element
+    tree = ET.ElementTree(root2)
+    rough_string = ET.tostring(tree.getroot(), 'utf-8')
+    reparsed = minidom.parseString(rough_string)
+    return reparsed.toprettyxml(indent="  ")
+
+
+def ner_input(root):
+    '''
+    NER and NER-RE input - text
+    '''
+    return root.find('TEXT').text
+
+
+def re_input(root):
+    '''
+    RE input - text with in-line NER annotation
+    '''
+    i2b2 = root.find('TEXT').text
+
+    # Extract EVENT and TIMEX3 annotations
+    annotations = []
+    for event in root.findall(".//EVENT"):
+        if _is_target_event(event):
+            annotations.append((int(event.attrib['start']), int(event.attrib['end']), f'<EVENT id:"{event.attrib["id"]}" type:"{event.attrib["type"]}">', f'</EVENT>'))
+    for timex in root.findall(".//TIMEX3"):
+        annotations.append((int(timex.attrib['start']), int(timex.attrib['end']), f'<TIMEX3 id:"{timex.attrib["id"]}" type:"{timex.attrib["type"]}" val:"{timex.attrib["val"]}">', f'</TIMEX3>'))
+
+    # Insert the annotations into the main text in one pass
+    return render_spans(i2b2, annotations)
+
+
+def ner_eval(root):
+    '''
+    NER gold standard - target EVENTs and TIMEX3s
+    '''
+    target_events = []
+    for event in root.findall(".//EVENT"):
+        if _is_target_event(event, lower=False):
+            target_events.append(event.attrib)
+    for timex in root.findall(".//TIMEX3"):
+        target_events.append(timex.attrib)
+    return _pretty_xml(target_events, 'EVENT')
+
+
+def re_eval(root):
+    '''
+    RE gold standard - only TLINK of PROBLEM, TEST, TREATMENT, and TIMEX3
+    '''
+    target_events = []
+    for event in root.findall(".//EVENT"):
+        if _is_target_event(event):
+            target_events.append(event.attrib['id'])
+    for timex in root.findall(".//TIMEX3"):
+        target_events.append(timex.attrib['id'])
+    target_events.sort(key=lambda x: x[0])
+
+    event = list(filter(lambda x:'E' in x, target_events))
+    timex = list(filter(lambda x:'T' in x, target_events))
+    return _pretty_xml(_target_tlinks(root, event, timex), 'TLINK')
+
+
+def nerre_eval(root):
+    '''
+    NER-RE gold standard - target EVENTs, TIMEX3s and their TLINKs
+    '''
+    target = []
+    target_list = []
+    for event in root.findall(".//EVENT"):
+        if _is_target_event(event):
+            target.append(event.attrib)
+            target_list.append(event.attrib['id'])
+    for timex in root.findall(".//TIMEX3"):
+        target.append(timex.attrib)
+        target_list.append(timex.attrib['id'])
+
+    target_list.sort(key=lambda x: x[0])
+    event = list(filter(lambda x:'E' in x, target_list))
+    timex = list(filter(lambda x:'T' in x, target_list))
+    target += _target_tlinks(root, event, timex)
+    return _pretty_xml(target, 'EVENT')
+
+
+# artifact: (converter, file extension)
+CONVERTERS = {
+    'data/ner': (ner_input, '.txt'),
+    'data/re': (re_input, '.txt'),
+    'data/nerre': (ner_input, '.txt'),
+    'eval/ner': (ner_eval, '.xml'),
+    'eval/re': (re_eval, '.xml'),
+    'eval/nerre': (nerre_eval, '.xml'),
+}
+
+
+def convert_file(xml_file, output_dir, targets = INPUT_TARGETS + EVAL_TARGETS, encoding = None):
+    '''
+    Parse one i2b2 XML file once and write every requested artifact of it.
+    Return the encoding of the file (detected if not given).
+    '''
+    root, encoding = _read_xml(xml_file, encoding)
+    name = os.path.splitext(os.path.basename(xml_file))[0]
+    for target in targets:
+        converter, extension = CONVERTERS[target]
+        output_file = os.path.join(output_dir, target, name + extension)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(converter(root))
+    return encoding
+
+
+def _convert_corpus(input_dir, output_dir, targets, desc, processes = None):
+    for target in targets:
+        path = os.path.join(output_dir, target)
+        if not os.path.exists(path):
+            os.makedirs(path)
+    train_files = glob.glob(os.path.join(input_dir, 'train/*.xml'))
+    test_files = glob.glob(os.path.join(input_dir, 'test/*.xml'))
+    xml_files = train_files + test_files
+
+    # Encodings detected by previous runs
+    manifest = load_encoding_manifest(output_dir)
+    keys = [_manifest_key(xml_file) for xml_file in xml_files]
+
+    # Spread files across processes; each file is read and parsed only once
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        futures = [executor.submit(convert_file, xml_file, output_dir, targets, manifest.get(key))
+                   for xml_file, key in zip(xml_files, keys)]
+        for future, xml_file, key in td.tqdm(zip(futures, xml_files, keys), total=len(xml_files), desc=desc, unit="file"):
+            try:
+                manifest[key] = future.result()
+            except Exception as e:
+                logging.error(f'error converting {xml_file}: \n{e}')
+    save_encoding_manifest(output_dir, manifest)
+
+
+def generate_data(input_dir, output_dir, processes = None):
+    '''
+    input - i2b2 corpus with train/test folders
+    result -- input data - NER; RE; NER+RE;
+            |- eval data (gold standard) - NER; RE; NER+RE;
+
+    Single pass conversion: every i2b2 file is parsed once and all six artifacts
+    (data/ner, data/re, data/nerre, eval/ner, eval/re, eval/nerre) are written from it.
+    Files are spread across a pool of `processes` processes (default: number of cores).
+    '''
+    logging.info('Generating input and eval data...')
+    _convert_corpus(input_dir, output_dir, INPUT_TARGETS + EVAL_TARGETS, "Generating input and eval data", processes)
+
+
+def generate_input_data(input_dir, output_dir, processes = None):
     '''
     input - i2b2 corpus with train/test folders
     result -- input data - NER; RE; NER+RE;
             |- output data - NER; RE; NRE+RE;
             |- eval data (gold standard) - NER; RE; NER+RE;
-    
+
     Convert i2b2 corpus into input-format data:
     NER - text
     RE - text with in-line NER annotaiton
     NER+RE - text
-    
+
     Only EVENTs (problem, test, and treatment) with positive, factual, and TIMEX3 will be extracted.
     '''
-    # Create the data saving paths
-    # input
-    # input_dir = "/phi_home/jp4453/Temporal-Phenotype/i2b2-2012-original"    
-    # output_dir = "/phi_home/jp4453/Temporal-Phenotype/result"
-    subdirs = ['data/ner', 'data/re', 'data/nerre']
-    for subdir in subdirs:
-        path = os.path.join(output_dir, subdir)
-        if not os.path.exists(path):
-            os.makedirs(path)
-    train_files = glob.glob(os.path.join(input_dir, 'train/*.xml'))
-    test_files = glob.glob(os.path.join(input_dir, 'test/*.xml'))
-    xml_files = train_files + test_files
-        
-    ### Generate NER input data
-    logging.info('Generating NER input data...')
-    for xml_file in td.tqdm(xml_files, desc="Generating NER input data", unit="file"):
-        with open(xml_file, 'rb') as f:
-            rawdata = f.read()
-        encoding = chardet.detect(rawdata)['encoding']
-        xml_data = rawdata.decode(encoding)
-        xml_data = xml_data.replace('&', '&amp;')
-        
-        root = ET.fromstring(xml_data)
-        i2b2 = root.find('TEXT').text
-        
-        output_file = os.path.join(os.path.join(output_dir, 'data/ner'), os.path.splitext(os.path.basename(xml_file))[0] + '.txt')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(i2b2)
-     
-    ### Generate NER-RE input data
-    logging.info('Generating NER-RE input data...')
-    for xml_file in td.tqdm(xml_files, desc="Generating NER-RE input data", unit="file"):
-        with open(xml_file, 'rb') as f:
-            rawdata = f.read()
-        encoding = chardet.detect(rawdata)['encoding']
-        xml_data = rawdata.decode(encoding)
-        xml_data = xml_data.replace('&', '&amp;')
-        
-        root = ET.fromstring(xml_data)
-        i2b2 = root.find('TEXT').text
-        
-        output_file = os.path.join(os.path.join(output_dir, 'data/nerre'), os.path.splitext(os.path.basename(xml_file))[0] + '.txt')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(i2b2)
+    logging.info('Generating NER, RE and NER-RE input data...')
+    _convert_corpus(input_dir, output_dir, INPUT_TARGETS, "Generating input data", processes)
 
-    ### Generate RE input data
-    logging.info('Generating RE input data...')
-    train_files = glob.glob(os.path.join(input_dir, 'train/*.xml'))
-    test_files = glob.glob(os.path.join(input_dir, 'test/*.xml'))
-    xml_files = train_files + test_files
-    for xml_file in td.tqdm(xml_files, desc="Generating RE input data", unit="file"):
-        with open(xml_file, 'rb') as f:
-            rawdata = f.read()
-        encoding = chardet.detect(rawdata)['encoding']
-        xml_data = rawdata.decode(encoding)
-
-        # Replace unescaped special characters
-        xml_data = xml_data.replace('&', '&amp;')
-         # Parse the XML string
-        root = ET.fromstring(xml_data)
-        # root = etree.fromstring
-        i2b2 = root.find('TEXT').text
-        
-        # Extract EVENT and TIMEX3 annotations and sort by start offset
-        annotations = []
-        for event in root.findall(".//EVENT"): 
-            event_modality = event.attrib.get('modality', '')
-            event_polarity = event.attrib.get('polarity', '')
-            event_type = event.attrib.get('type', '').lower()  # converting type to lowercase for comparison
-            if event_modality == 'FACTUAL' and event_polarity == 'POS' and event_type in ['problem', 'treatment', 'test', 'occurrence']:
-                annotations.append((int(event.attrib['start']), int(event.attrib['end']), f'<EVENT id:"{event.attrib["id"]}" type:"{event.attrib["type"]}">', f'</EVENT>'))
-        for timex in root.findall(".//TIMEX3"):
-            annotations.append((int(timex.attrib['start']), int(timex.attrib['end']), f'<TIMEX3 id:"{timex.attrib["id"]}" type:"{timex.attrib["type"]}" val:"{timex.attrib["val"]}">', f'</TIMEX3>'))
-        annotations.sort(key=lambda x: x[0])
-        
-        # Replace the portions of the main text with the annotations
-        offset = 0    
-        converted_text = i2b2            
-        for start, end, type, closer in annotations:
-            converted_text = converted_text[:+start+offset] + type + converted_text[+start+offset:]
-            offset += len(type)
-            converted_text = converted_text[:+end+offset] + closer + converted_text[+end+offset:]
-            offset += len(closer)
-            
-        # Write the converted data to the output directory
-        output_file = os.path.join(os.path.join(output_dir, 'data/re'), os.path.splitext(os.path.basename(xml_file))[0] + '.txt')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(converted_text)
 
-def generate_eval_data(input_dir, output_dir):
+def generate_eval_data(input_dir, output_dir, processes = None):
     '''
     input - i2b2 corpus with train/test folders
     result -- input data - NER; RE; NER+RE;
             |- output data - NER; RE; NRE+RE;
             |- eval data (gold standard) - NER; RE; NER+RE;
-    
+
     Only EVENTs (problem, test, and treatment) with positive, factual, and TIMEX3 will be extracted.
-   
+
     Generate eval datasets for NER, RE, NER-RE
     For RE, only TLINK of PROBLEM, TEST, TREATMENT, and TIMEX3 will be extracted
     '''
-    subdir = ['eval/ner', 'eval/re', 'eval/nerre']
-    for subdir in subdir:
-        path = os.path.join(output_dir, subdir)
-        if not os.path.exists(path):
-            os.makedirs(path)
-    train_files = glob.glob(os.path.join(input_dir, 'train/*.xml'))
-    test_files = glob.glob(os.path.join(input_dir, 'test/*.xml'))
-    xml_files = train_files + test_files        
-            
-    ### Generate NER eval data    
-    logging.info('Generating NER eval data...')
-    for xml_file in td.tqdm(xml_files, desc="Generating NER eval data", unit="file"):
-        with open(xml_file, 'rb') as f:
-            rawdata = f.read()
-        encoding = chardet.detect(rawdata)['encoding']
-        xml_data = rawdata.decode(encoding)
-        
-        # Replace unescaped special characters
-        xml_data = xml_data.replace('&', '&amp;')
-        # Parse the XML string
-        root = ET.fromstring(xml_data)
-        
-        # Extract EVENT and TIMEX3 annotations and sort by start offset
-        target_events = []
-        for event in root.findall(".//EVENT"):
-            event_modality = event.attrib.get('modality', '')
-            event_polarity = event.attrib.get('polarity', '')
-            event_type = event.attrib.get('type', '')
-            if event_modality == 'FACTUAL' and event_polarity == 'POS' and event_type in ['PROBLEM', 'TREATMENT', 'TEST', 'OCCURRENCE']:
-                target_events.append(event.attrib)
-        for timex in root.findall(".//TIMEX3"):
-            target_events.append(timex.attrib)
-        
-        # Iterating through the target_tlink list and creating XML sub-elements
-        root2 = ET.Element("TAGS")
-        
-        for item in target_events:
-            ET.SubElement(root2, 'EVENT', item)
-            
-        # Creating the XML tree with the root2 element
-        tree = ET.ElementTree(root2)
-        rough_string = ET.tostring(tree.getroot(), 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        reparsed = reparsed.toprettyxml(indent="  ")        
-    
-        output_file = os.path.join(os.path.join(output_dir, 'eval/ner'), os.path.splitext(os.path.basename(xml_file))[0] + '.xml')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(reparsed)
-        
-    ### Generate RE eval data    
-    for xml_file in td.tqdm(xml_files, desc="Generating RE eval data", unit="file"):
-        with open(xml_file, 'rb') as f:
-            rawdata = f.read()
-        encoding = chardet.detect(rawdata)['encoding']
-        xml_data = rawdata.decode(encoding)
-        
-        # Replace unescaped special characters
-        xml_data = xml_data.replace('&', '&amp;')
-        # Parse the XML string
-        root = ET.fromstring(xml_data)                
-        
-        # Extract EVENT and TIMEX3 annotations and sort by start offset
-        target_events = []
-        for event in root.findall(".//EVENT"):
-            event_modality = event.attrib.get('modality', '')
-            event_polarity = event.attrib.get('polarity', '')
-            event_type = event.attrib.get('type', '').lower()  # converting type to lowercase for comparison
-            if event_modality == 'FACTUAL' and event_polarity == 'POS' and event_type in ['problem', 'treatment', 'test', 'occurrence']:
-                target_events.append(event.attrib['id'])
-        for timex in root.findall(".//TIMEX3"):
-            target_events.append(timex.attrib['id'])
-        target_events.sort(key=lambda x: x[0])
-                
-        event = list(filter(lambda x:'E' in x, target_events))
-        timex = list(filter(lambda x:'T' in x, target_events))
-        
-        target_tlink = []
-        # Extract related TLINK of target event/timex
-        for tlink in root.findall(".//TLINK"):
-            # EVENT to EVENT
-            if (tlink.attrib["fromID"] in event and tlink.attrib["toID"] in event) and tlink.attrib["id"].startswith('TL'):
-                target_tlink.append(tlink.attrib)
-            # EVENT to TIME X
-            if (tlink.attrib["fromID"] in event and tlink.attrib["toID"] in timex) and tlink.attrib["id"].startswith('TL'):
-                target_tlink.append(tlink.attrib)
-            # TIMEX to EVENT
-            if (tlink.attrib["fromID"] in timex and tlink.attrib["toID"] in event) and tlink.attrib["id"].startswith('TL'):
-                target_tlink.append(tlink.attrib)
-                        
-        root2 = ET.Element("TAGS")
-        
-        # Iterating through the target_tlink list and creating XML sub-elements
-        for item in target_tlink:
-            ET.SubElement(root2, 'TLINK', item)
-        
-        # Creating the XML tree with the root2 element
-        tree = ET.ElementTree(root2)
-        rough_string = ET.tostring(tree.getroot(), 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        reparsed = reparsed.toprettyxml(indent="  ")
-        
-        # Writing the XML tree to the output file                    
-        output_file = os.path.join(os.path.join(output_dir, 'eval/re'), os.path.splitext(os.path.basename(xml_file))[0] + '.xml')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(reparsed)
-    
-    ### Generate NER-RE eval data
-    for xml_file in td.tqdm(xml_files, desc="Generating NER-RE eval data", unit="file"):
-        with open(xml_file, 'rb') as f:
-            rawdata = f.read()
-        encoding = chardet.detect(rawdata)['encoding']
-        xml_data = rawdata.decode(encoding)
-        
-        # Replace unescaped special characters
-        xml_data = xml_data.replace('&', '&amp;')
-        # Parse the XML string
-        root = ET.fromstring(xml_data)
-        
-        # Extract EVENT and TIMEX3 annotations and sort by start offset
-        target = []
-        target_list = []
-        for event in root.findall(".//EVENT"):
-            event_modality = event.attrib.get('modality', '')
-            event_polarity = event.attrib.get('polarity', '')
-            event_type = event.attrib.get('type', '').lower()  # converting type to lowercase for comparison
-            if event_modality == 'FACTUAL' and event_polarity == 'POS' and event_type in ['problem', 'treatment', 'test', 'occurrence']:
-                target.append(event.attrib)
-                target_list.append(event.attrib['id'])
-        for timex in root.findall(".//TIMEX3"):
-            target.append(timex.attrib)
-            target_list.append(timex.attrib['id'])
-            
-        target_list.sort(key=lambda x: x[0])                
-        event = list(filter(lambda x:'E' in x, target_list))
-        timex = list(filter(lambda x:'T' in x, target_list))
-            
-        # Extract related TLINK of target event/timex
-        for tlink in root.findall(".//TLINK"):
-            # EVENT to EVENT
-            if (tlink.attrib["fromID"] in event and tlink.attrib["toID"] in event) and tlink.attrib["id"].startswith('TL'):
-                target.append(tlink.attrib)
-            # EVENT to TIME X
-            if (tlink.attrib["fromID"] in event and tlink.attrib["toID"] in timex) and tlink.attrib["id"].startswith('TL'):
-                target.append(tlink.attrib)
-            # TIMEX to EVENT
-            if (tlink.attrib["fromID"] in timex and tlink.attrib["toID"] in event) and tlink.attrib["id"].startswith('TL'):
-                target.append(tlink.attrib)
-                
-        root2 = ET.Element("TAGS")
-        
-        # Iterating through the target_tlink list and creating XML sub-elements
-        for item in target:
-            ET.SubElement(root2, 'EVENT', item)
-        
-        # Creating the XML tree with the root2 element
-        tree = ET.ElementTree(root2)
-        rough_string = ET.tostring(tree.getroot(), 'utf-8')
-        reparsed = minidom.parseString(rough_string)
-        reparsed = reparsed.toprettyxml(indent="  ")
-        
-        # Writing the XML tree to the output file                    
-        output_file = os.path.join(os.path.join(output_dir, 'eval/nerre'), os.path.splitext(os.path.basename(xml_file))[0] + '.xml')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(reparsed)
\ No newline at end of file
+    logging.info('Generating NER, RE and NER-RE eval data...')
+    _convert_corpus(input_dir, output_dir, EVAL_TARGETS, "Generating eval data", processes)
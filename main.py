@@ -1,214 +1,297 @@
+import argparse
 import logging, logging.handlers
 import configparser
-import os
+import os, glob
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from generate_data import generate_eval_data, generate_input_data
-from eval import eval_ner, eval_re, eval_nerre
-from run_api import run_ner, run_re, run_nerre
+from annotation_store import GOLD, parse_run
+from api_engine import get_concurrency
+from pipeline import MODES, TASKS, build_pipeline, metrics_path, write_metrics
+from rate_limit import RateLimiter
+from run_manifest import RunManifest
 
 from datetime import datetime as date
 
-if __name__ == "__main__":
-    try:
-        os.chdir('/Users/jimmypark/Documents/git/Temporal-Phenotype')
-        file_log = './tRE_' + date.today().strftime("%y%m%d") + '.log' 
-        
-        # Setup logging
-        logger = logging.getLogger()
-        logger.setLevel(logging.DEBUG)
-        fh = logging.handlers.RotatingFileHandler(file_log, maxBytes=10000000, backupCount=10)
-        fh.setLevel(logging.INFO)
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.ERROR)
-        formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s')
-        fh.setFormatter(formatter)
-        ch.setFormatter(formatter)
-        logger.addHandler(fh)
-        logger.addHandler(ch)
-        
-        logger.info('============================================================')
-        logger.info('Start!')
-        logger.info('============================================================')
-        
-        # Set input and output directories
-        input_dir = os.path.join(os.getcwd(), 'i2b2-2012-original')
-        if not os.path.exists(input_dir):
-            logging.error(f'i2b2-2012-original directory does not exist. Please uploaed data or change directory name to i2b2-2012-original')
-        output_dir = os.path.join(os.getcwd(), 'result') 
-        
-        logger.info(f'i2b2 data path: {input_dir}')
-        logger.info(f'output directory path: {output_dir}\n')
-        
-        # Generate and transform i2b2 data        
-        if not os.path.exists(os.path.join(output_dir, 'data')):
-            logger.info('converting i2b2-2012 data for tasks...')
-            generate_input_data(input_dir, output_dir)
-            logger.info(f'done converting i2b2-2012\n')
-        else:
-            logger.info(f'skip convering i2b2 data. data directory already exists in {output_dir}')
-        
-        # Generate eval datasets
-        if not os.path.exists(os.path.join(output_dir, 'eval')):
-            logger.info(f'generate eval data from i2b2-2012...')
-            generate_eval_data(input_dir, output_dir)
-            logger.info(f'done generating eval data\n')
-        else:
-            logger.info(f'skip convering eval data. eval directory already exists in {output_dir}')
-        
-        ### Run GPT API function
-        ## NER
-        # few shot
-        logger.info('============================================================')
-        logger.info('start API request')
-        logger.info('============================================================')        
-        try:
-            logger.info(f'============================================================')
-            logger.info(f'start one-shot ner...')
-            logger.info(f'============================================================')
-            run_ner(output_dir, few_shot = True, api_retry=6)
-            logger.info(f'done one-shot ner\n')
-        except Exception as e:
-            logger.info(f'error occurred while running few-shot ner: {e}')
-        # zero shot
-        try:
-            logger.info(f'============================================================')
-            logger.info(f'start zero-shot ner...')
-            logger.info(f'============================================================')
-            run_ner(output_dir, few_shot = False, api_retry=6)
-            logger.info(f'done zero-shot ner\n')
-        except Exception as e:
-            logger.info(f'error occurred while running one-shot ner: {e}')
-        ## tRE
-        # few shot
-        try:
-            logger.info(f'============================================================')
-            logger.info(f'start one-shot re...')
-            logger.info(f'============================================================')
-            run_re(output_dir, few_shot = True, api_retry=6)
-            logger.info(f'done one-shot tre\n')
-        except Exception as e:
-            logger.info(f'error occurred while running one-shot tre: {e}')
-        # zero shot
-        try:
-            logger.info(f'============================================================')
-            logger.info(f'start zero-shot re...')
-            logger.info(f'============================================================')
-            run_re(output_dir, few_shot = False, api_retry=6)
-            logger.info(f'done zero-shot tre\n')
-        except Exception as e:
-            logger.info(f'error occurred while running zero-shot tre: {e}')
-        ## NER-RE
-        # few shot
+
+def setup_logging(file_log: str):
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    fh = logging.handlers.RotatingFileHandler(file_log, maxBytes=10000000, backupCount=10)
+    fh.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.ERROR)
+    formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    fh.setFormatter(formatter)
+    ch.setFormatter(formatter)
+    logger.addHandler(fh)
+    logger.addHandler(ch)
+    return logger
+
+
+def read_config(args):
+    '''
+    api.config of the working directory with the model and concurrency given on the command line.
+    '''
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.getcwd(), "api.config"))
+    if getattr(args, 'run_id', None) and args.run_id != GOLD:
+        config['openai']['model'] = parse_run(args.run_id)['model']
+    elif getattr(args, 'model', None):
+        config['openai']['model'] = args.model
+    if getattr(args, 'concurrency', None):
+        config['openai']['concurrency'] = str(args.concurrency)
+    return config
+
+
+def select_runs(args, config) -> list:
+    '''
+    Run names (<mode>_<model>_<yymmdd>) of the command: --run-id, or one per --mode of --model and --date.
+    '''
+    if args.run_id:
+        if args.run_id != GOLD and parse_run(args.run_id)['mode'] not in MODES:
+            raise ValueError(f'run ID {args.run_id} is not <one|zero>_<model>_<yymmdd>')
+        return [args.run_id]
+    return [f"{mode}_{config['openai']['model']}_{args.date}" for mode in args.mode]
+
+
+def select_notes(args, manifest: RunManifest, task: str):
+    '''
+    Note IDs to run for task, None for every note.
+    --notes/--notes-file select notes; --failed keeps only those that failed in the manifest.
+    Without a selection, a resumed run keeps the notes it was started on.
+    '''
+    notes = list(args.notes or [])
+    if args.notes_file:
+        with open(args.notes_file, 'r') as f:
+            notes += [line.strip() for line in f if line.strip()]
+    if args.failed:
+        return [note for note in manifest.notes(task, 'failed') if not notes or note in notes]
+    return notes or manifest.notes(task) or None
+
+
+def prepare(args):
+    '''
+    Convert i2b2 data into task inputs (data/) and gold standards (eval/).
+    '''
+    if not args.force and os.path.exists(os.path.join(args.output_dir, 'data')) and os.path.exists(os.path.join(args.output_dir, 'eval')):
+        logging.info(f'skip converting i2b2 data. data and eval directories already exist in {args.output_dir}')
+        return
+    from generate_data import generate_data
+    logging.info('converting i2b2-2012 data and generating eval data for tasks...')
+    generate_data(args.input_dir, args.output_dir, args.processes)
+    logging.info(f'done converting i2b2-2012\n')
+
+
+def run(args):
+    '''
+    API runs of the selected tasks and runs at the same time, under one rate limit and concurrency budget.
+    Each run is recorded in its manifest; runs resume where they stopped, notes with an output are not sent again.
+    '''
+    from run_api import TASKS as TASK_SECTIONS, run_ner, run_re, run_nerre
+    runners = {'ner': run_ner, 're': run_re, 'nerre': run_nerre}
+    if args.run_id == GOLD:
+        raise ValueError('the gold standard cannot be run')
+    config = read_config(args)
+    if args.batch:
+        return run_in_batch(args, config)
+    limiter = RateLimiter.from_config(config)
+    budget = threading.BoundedSemaphore(get_concurrency(config))
+
+    def run_task(manifest, task, notes):
+        info = parse_run(manifest.run)
+        logging.info(f'start {manifest.run} {task} on {len(notes) if notes is not None else "all"} notes...')
+        manifest.start(task, config, TASK_SECTIONS[task][0])
+        statuses = runners[task](args.output_dir, info['mode'] == 'one', args.api_retry, info['date'],
+                                 limiter, budget, config, notes)
+        manifest.record(task, statuses)
+        return statuses
+
+    jobs = []
+    for run_id in select_runs(args, config):
+        manifest = RunManifest(args.output_dir, run_id)
+        if manifest.exists:
+            logging.info(f'resume {run_id} from {manifest.path}')
+        for task in args.task:
+            notes = select_notes(args, manifest, task)
+            if notes == []:
+                logging.info(f'{run_id} {task}: no notes to run')
+                continue
+            jobs.append((manifest, task, notes))
+
+    with ThreadPoolExecutor(max_workers = len(jobs) or 1) as executor:
+        futures = [(job, executor.submit(run_task, *job)) for job in jobs]
+    failed = []
+    for (manifest, task, _), future in futures:
         try:
-            logger.info(f'============================================================')
-            logger.info(f'start one-shot ner-re...')
-            logger.info(f'============================================================')
-            run_nerre(output_dir, few_shot = True, api_retry=6)
-            logger.info(f'done one-shot ner-re\n')
+            failed += [f'{manifest.run} {task} {note}' for note, status in future.result().items() if status == 'failed']
         except Exception as e:
-            logger.info(f'error occurred while running one-shot ner-re: {e}')
-        # zero shot
+            logging.exception(f'error occurred while running {manifest.run} {task}: \n{e}')
+            failed.append(f'{manifest.run} {task}')
+    if failed:
+        logging.error(f'{len(failed)} notes or tasks failed, re-run them with --failed: {failed[:20]}')
+
+
+def run_in_batch(args, config):
+    '''
+    The selected tasks and runs as one Batch API job per date (batch_api.run_batch), recorded in the run manifests.
+    Every note without an output is sent; notes cannot be selected.
+    '''
+    from api_engine import output_file_path
+    from batch_api import run_batch
+    from run_api import TASKS as TASK_SECTIONS, get_output_path, note_id
+    if args.notes or args.notes_file or args.failed:
+        raise ValueError('--batch sends every note without an output, it cannot select notes')
+    runs = [(RunManifest(args.output_dir, run_id), parse_run(run_id)) for run_id in select_runs(args, config)]
+    for manifest, _ in runs:
+        for task in args.task:
+            manifest.start(task, config, TASK_SECTIONS[task][0])
+    for execute_date in sorted({info['date'] for _, info in runs}):
+        modes = [info['mode'] for _, info in runs if info['date'] == execute_date]
+        logging.info(f'start batch of {args.task} {modes} on {execute_date}...')
+        run_batch(args.output_dir, args.task, [mode == 'one' for mode in modes], execute_date, config)
+    for manifest, info in runs:
+        for task in args.task:
+            path = get_output_path(args.output_dir, config, task, info['mode'] == 'one', info['date'])
+            notes = sorted(glob.glob(os.path.join(args.output_dir, 'data', task, '*.txt')))
+            manifest.record(task, {note_id(note): 'done' if os.path.exists(output_file_path(path, note)) else 'failed'
+                                   for note in notes})
+
+
+def evaluate(args):
+    '''
+    Metrics table of each selected run and task, written to <run dir>/<task>_metrics.csv (pipeline.write_metrics).
+    '''
+    for run_id in select_runs(args, read_config(args)):
+        manifest = RunManifest(args.output_dir, run_id)
+        for task in args.task:
+            if not os.path.isdir(os.path.join(args.output_dir, 'output_' + run_id, task)):
+                logging.info(f'pass evaluating {run_id} {task}, no output\n')
+                continue
+            try:
+                write_metrics(args.output_dir, run_id, task, not args.full, args.resamples)
+            except Exception as e:
+                logging.exception(f'error occurred while evaluating {run_id} {task}: \n{e}')
+                continue
+            manifest.set('evals', os.path.relpath(metrics_path(args.output_dir, run_id, task), args.output_dir), task)
+
+
+def normalize_runs(args):
+    '''
+    Normalized events of each selected run (utils.normalize); --run-id gold normalizes the gold TLINKs.
+    '''
+    from utils import normalize
+    for run_id in select_runs(args, read_config(args)):
         try:
-            logger.info(f'============================================================')
-            logger.info(f'start zero-shot ner-re...')
-            logger.info(f'============================================================')
-            run_nerre(output_dir, few_shot = False, api_retry=6)
-            logger.info(f'done zero-shot ner-re\n')
+            normalize(args.output_dir, run = run_id, processes = args.processes)
         except Exception as e:
-            logger.info(f'error occurred while running zero-shot ner-re: {e}')
-        
-        # Evaluate GPT output
+            logging.exception(f'error occurred while normalizing {run_id}: \n{e}')
+            continue
+        if run_id != GOLD:
+            RunManifest(args.output_dir, run_id).set('normalized', os.path.join('normalized', run_id + '.csv'))
+
+
+def run_pipeline(args):
+    '''
+    Every step of the selected tasks and modes (pipeline.py); up to date stages are skipped.
+    '''
+    config = read_config(args)
+    execute_date, modes = args.date, args.mode
+    if args.run_id:
+        if args.run_id == GOLD:
+            raise ValueError('the gold standard cannot be run')
+        info = parse_run(args.run_id)
+        execute_date, modes = info['date'], [info['mode']]
+    status = build_pipeline(args.input_dir, args.output_dir, config, execute_date, args.task, modes,
+                            args.api_retry, args.processes).run(force = args.force)
+    failed = [stage for stage, result in status.items() if result in ('failed', 'blocked')]
+    if failed:
+        logging.error(f'pipeline stages not completed: {failed}')
+
+
+def parse_args(argv = None):
+    today = date.today().strftime("%y%m%d")
+    parser = argparse.ArgumentParser(description='GPT-based extraction of temporal information from the i2b2-2012 dataset')
+    # options before the command, each taking a value
+    global_options = [
+        parser.add_argument('--workdir', default='.', help='directory with api.config; other paths are relative to it'),
+        parser.add_argument('--input-dir', default='i2b2-2012-original', help='i2b2-2012 corpus with train/test folders'),
+        parser.add_argument('--output-dir', default='result'),
+        parser.add_argument('--processes', type=int, default=None),
+        parser.add_argument('--log', default=None, help=f'log file (default: tRE_{today}.log)'),
+    ]
+    commands = parser.add_subparsers(dest='command')
+
+    select = argparse.ArgumentParser(add_help=False)
+    select.add_argument('--task', nargs='+', choices=TASKS, default=list(TASKS))
+    select.add_argument('--mode', nargs='+', choices=MODES, default=list(MODES), help='one-shot or zero-shot prompts')
+    select.add_argument('--model', default=None, help='model of api.config if not given')
+    select.add_argument('--date', default=today, help='%%y%%m%%d of the runs (default: today)')
+    select.add_argument('--run-id', default=None, help='one run, e.g. one_gpt-4_231027; sets mode, model and date')
+    api = argparse.ArgumentParser(add_help=False)
+    api.add_argument('--concurrency', type=int, default=None, help='requests in flight across all runs ([openai] concurrency)')
+    api.add_argument('--api-retry', type=int, default=6)
+
+    prepare_parser = commands.add_parser('prepare', help='convert i2b2 data into task inputs and gold standards')
+    prepare_parser.add_argument('--force', action='store_true', help='convert even if data/ and eval/ exist')
+    prepare_parser.set_defaults(func=prepare)
+
+    run_parser = commands.add_parser('run', parents=[select, api], help='send notes to the model; resumes unfinished runs')
+    run_parser.add_argument('--notes', nargs='+', default=None, help='note IDs, e.g. 12 103')
+    run_parser.add_argument('--notes-file', default=None, help='file of note IDs, one per line')
+    run_parser.add_argument('--failed', action='store_true', help='only notes that failed in the run manifest')
+    run_parser.add_argument('--batch', action='store_true', help='send every note without an output through the Batch API')
+    run_parser.set_defaults(func=run)
+
+    eval_parser = commands.add_parser('eval', parents=[select], help='score runs against the gold standard')
+    eval_parser.add_argument('--full', action='store_true', help='re-score every note instead of only changed ones')
+    eval_parser.add_argument('--resamples', type=int, default=1000, help='bootstrap resamples of notes (0 skips intervals)')
+    eval_parser.set_defaults(func=evaluate)
+
+    normalize_parser = commands.add_parser('normalize', parents=[select], help='normalize events of runs into timelines')
+    normalize_parser.set_defaults(func=normalize_runs)
+
+    pipeline_parser = commands.add_parser('pipeline', parents=[select, api], help='every step; the default command')
+    pipeline_parser.add_argument('--force', action='store_true', help='run stages even if their outputs are up to date')
+    pipeline_parser.set_defaults(func=run_pipeline)
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # pipeline is the default command: insert it after the global options, so its own options parse too
+    options = {option for action in global_options for option in action.option_strings}
+    position = 0
+    while position < len(argv) and argv[position].split('=')[0] in options:
+        position += 1 if '=' in argv[position] else 2
+    if position >= len(argv) or (argv[position] not in commands.choices and argv[position] not in ('-h', '--help')):
+        argv = argv[:position] + ['pipeline'] + argv[position:]
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    os.chdir(args.workdir)
+    logger = setup_logging(args.log or './tRE_' + date.today().strftime("%y%m%d") + '.log')
+    try:
         logger.info('============================================================')
-        logger.info('start model evaluation')
+        logger.info(f'Start {args.command}!')
         logger.info('============================================================')
-        config = configparser.ConfigParser()
-        config.read(os.path.join(os.getcwd(), "api.config"))
-        model = config['openai']['model']
-        # one_basic_path = "output_" + "one_" + config['openai']['model'] + '_' + date.today().strftime("%y%m%d")
-        # zero_basic_path = "output_" + "zero_" + config['openai']['model'] + '_' + date.today().strftime("%y%m%d")
-        one_basic_path = "output_" + "one_" + config['openai']['model'] + '_' + '231027'
-        zero_basic_path = "output_" + "zero_" + config['openai']['model'] + '_' + '231027'        
-        
-        # one-shot ner
-        if os.path.exists(os.path.join(output_dir, one_basic_path, 'ner')):
-            logger.info(f'============================================================')
-            logger.info('evaluate one-shot ner output...')
-            logger.info(f'============================================================')
-            try:
-                eval_df = eval_ner(output_dir, few_shot=True, execute_date = None)   
-                eval_df.to_csv(os.path.join(output_dir, one_basic_path, 'ner_one_df.csv'), index=False)
-            except Exception as e:
-                logger.error(f'error occurred while evaluating one-shot ner: \n{e}')
-        else:
-            logger.info(f'pass evaluating one-shot ner...\n')
-        # zero-shot ner
-        if os.path.exists(os.path.join(output_dir, zero_basic_path, 'ner')):
-            logger.info(f'============================================================')
-            logger.info('evaluate zero-shot ner output')
-            logger.info(f'============================================================')
-            try:
-                eval_df = eval_ner(output_dir, few_shot=False, execute_date = None)
-                eval_df.to_csv(os.path.join(output_dir, zero_basic_path, 'ner_zero_df.csv'), index=False)
-            except Exception as e:
-                logger.error(f'error occurred while evaluting zero-shot ner: \n{e}')
-        else:
-            logger.info(f'pass evaluating zero-shot ner output...\n')
-            
-        # one-shot re
-        if os.path.exists(os.path.join(output_dir, one_basic_path, 're')):
-            logger.info(f'============================================================')
-            logger.info('evaluate one-shot tre output')
-            logger.info(f'============================================================')
-            try:
-                eval_df = eval_re(output_dir, few_shot=True, execute_date = '231027')
-                eval_df.to_csv(os.path.join(output_dir, one_basic_path, 're_one_df.csv'), index=False)
-            except Exception as e:
-                logger.error(f'error occurred while evaluating one-shot tre: \n{e}')
-        else:
-            logger.info(f'pass evaluating one-shot tre...\n')
-        # zero-shot re
-        if os.path.exists(os.path.join(output_dir, zero_basic_path, 're')):
-            logger.info(f'============================================================')
-            logger.info('evaluate zero-shot tre output')
-            logger.info(f'============================================================')
-            try:
-                eval_df = eval_re(output_dir, few_shot=False, execute_date = None)
-                eval_df.to_csv(os.path.join(output_dir, one_basic_path, 're_zero_df.csv'), index=False)
-            except Exception as e:
-                logger.error(f'error occurred while evaluating zero-shot tre: \n{e}')
-        else:
-            logger.info(f'pass evaluating zero-shot tre output...\n')
-        
-        # one-shot ner-re
-        if os.path.exists(os.path.join(output_dir, one_basic_path, 'nerre')):
-            logger.info(f'============================================================')
-            logger.info('evaluate one-shot ner-re output')
-            logger.info(f'============================================================')
-            try:
-                eval_df = eval_nerre(output_dir, few_shot=True, execute_date = None)
-                eval_df.to_csv(os.path.join(output_dir, one_basic_path, 'nerre_one_df.csv'), index=False)
-            except Exception as e:
-                logger.error(f'error occurred while evaluating one-shot ner-re: \n{e}')
-        else:
-            logger.info(f'pass evaluating one-shot ner...\n')
-        # zero-shot ner
-        if os.path.exists(os.path.join(output_dir, zero_basic_path, 'ner')):
-            logger.info(f'============================================================')
-            logger.info('evaluate zero-shot ner-re output')
-            logger.info(f'============================================================')
-            try:
-                eval_df = eval_nerre(output_dir, few_shot=False, execute_date = None)
-                eval_df.to_csv(os.path.join(output_dir, one_basic_path, 'nerre_one_df.csv'), index=False)
-            except Exception as e:
-                logger.error(f'error occurred while evaluting zero-shot ner-re: \n{e}')
-        else:
-            logger.info(f'pass evaluating zero-shot ner-re output...\n')
-        
-        # Normalize temporal information into structured format
-        
+
+        # Set input and output directories
+        args.input_dir = os.path.abspath(args.input_dir)
+        args.output_dir = os.path.abspath(args.output_dir)
+        if args.command in ('prepare', 'pipeline') and not os.path.exists(args.input_dir):
+            logging.error(f'{args.input_dir} does not exist. Please upload i2b2-2012 data or pass --input-dir')
+        logger.info(f'i2b2 data path: {args.input_dir}')
+        logger.info(f'output directory path: {args.output_dir}\n')
+
+        args.func(args)
+
         logger.info('============================================================')
         logger.info('Done!')
         logger.info('============================================================')
-
     except Exception as e:
-        logger.exception(e)       
+        logger.exception(e)
+
+
+if __name__ == "__main__":
+    main()
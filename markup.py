@@ -0,0 +1,66 @@
+def render_spans(text: str, spans: list) -> str:
+    '''
+    Insert inline markup into text in one pass.
+
+    spans - list of (start, end, opener, closer); opener is inserted at start and closer at end.
+
+    The text is cut at every span boundary once and the segments are joined with the markup,
+    so the cost is linear in text length plus number of spans (instead of rebuilding the
+    string for every annotation). Nested spans are written inside their outer span; spans
+    sharing a start are opened longest first. When two spans cross (a starts, b starts,
+    a ends, b ends), b is closed before a and reopened right after, so the markup stays
+    well-formed.
+    '''
+    length = len(text)
+    # (start, end, original order, opener, closer)
+    items = []
+    for i, (start, end, opener, closer) in enumerate(spans):
+        start = min(max(int(start), 0), length)
+        end = min(max(int(end), start), length)
+        items.append((start, end, i, opener, closer))
+
+    starts = {}
+    ends = {}
+    for item in items:
+        starts.setdefault(item[0], []).append(item)
+        ends.setdefault(item[1], []).append(item)
+    # Outer (longer) spans open first; ties keep the given order
+    for position in starts:
+        starts[position].sort(key=lambda item: (-item[1], item[2]))
+
+    segments = []
+    stack = []
+    last = 0
+    for position in sorted(set(starts) | set(ends)):
+        segments.append(text[last:position])
+        last = position
+
+        # Close spans ending here; spans opened inside them are closed and reopened
+        closing = [item for item in ends.get(position, []) if item[0] < position]
+        if closing:
+            closing = set(closing)
+            reopen = []
+            while closing:
+                item = stack.pop()
+                segments.append(item[4])
+                if item in closing:
+                    closing.discard(item)
+                else:
+                    reopen.append(item)
+            for item in reversed(reopen):
+                segments.append(item[3])
+                stack.append(item)
+
+        for item in starts.get(position, []):
+            segments.append(item[3])
+            if item[1] == position:
+                # Empty span
+                segments.append(item[4])
+            else:
+                stack.append(item)
+
+    segments.append(text[last:])
+    # Close anything left open at the end of the text
+    while stack:
+        segments.append(stack.pop()[4])
+    return ''.join(segments)
@@ -0,0 +1,195 @@
+import argparse
+import email
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backends import MockBackend, MockAPIError
+
+
+def empty_response(body: dict) -> str:
+    return ''
+
+
+def chat_completion(body: dict, content: str) -> dict:
+    '''
+    Chat completion object in the shape returned by the OpenAI API.
+    '''
+    prompt_tokens = sum(len(message['content']) for message in body.get('messages', [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        'id': 'chatcmpl-' + uuid.uuid4().hex,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'mock'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens}
+    }
+
+
+class MockState:
+    '''
+    Files and batches held by the stand-in server.
+    respond(body) returns the assistant content of a chat completion request body.
+    It may raise backends.MockAPIError, which is sent back with its status and headers.
+    '''
+    def __init__(self, respond = empty_response):
+        self.respond = respond
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, content: bytes, purpose: str, filename: str = 'file') -> dict:
+        file_id = 'file-' + uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose}
+
+    def run_batch(self, batch_id: str):
+        batch = self.batches[batch_id]
+        batch['status'] = 'in_progress'
+        lines = self.files[batch['input_file_id']].decode('utf-8').splitlines()
+        outputs, errors = [], []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                content = self.respond(request['body'])
+                outputs.append({'id': 'batch_req_' + uuid.uuid4().hex, 'custom_id': request['custom_id'],
+                                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex,
+                                             'body': chat_completion(request['body'], content)},
+                                'error': None})
+                batch['request_counts']['completed'] += 1
+            except Exception as e:
+                errors.append({'id': 'batch_req_' + uuid.uuid4().hex, 'custom_id': request['custom_id'],
+                               'response': None, 'error': {'code': 'server_error', 'message': str(e)}})
+                batch['request_counts']['failed'] += 1
+        if outputs:
+            batch['output_file_id'] = self.add_file('\n'.join(json.dumps(o) for o in outputs).encode('utf-8'), 'batch_output')['id']
+        if errors:
+            batch['error_file_id'] = self.add_file('\n'.join(json.dumps(e) for e in errors).encode('utf-8'), 'batch_output')['id']
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logging.debug('mock server: ' + format % args)
+
+        def _send(self, status: int, payload = None, raw: bytes = None, headers: dict = None):
+            data = raw if raw is not None else json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream' if raw is not None else 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def _path(self) -> list:
+            # Accept both /v1/... and /... routes
+            parts = [part for part in self.path.split('?')[0].split('/') if part]
+            return parts[1:] if parts and parts[0] == 'v1' else parts
+
+        def do_GET(self):
+            parts = self._path()
+            if len(parts) == 3 and parts[0] == 'files' and parts[2] == 'content':
+                if parts[1] not in state.files:
+                    return self._send(404, {'error': {'message': 'file not found'}})
+                return self._send(200, raw = state.files[parts[1]])
+            if len(parts) == 2 and parts[0] == 'batches':
+                if parts[1] not in state.batches:
+                    return self._send(404, {'error': {'message': 'batch not found'}})
+                return self._send(200, state.batches[parts[1]])
+            self._send(404, {'error': {'message': 'not found'}})
+
+        def do_POST(self):
+            parts = self._path()
+            if parts == ['files']:
+                message = email.message_from_bytes(b'Content-Type: ' + self.headers['Content-Type'].encode('utf-8')
+                                                   + b'\r\n\r\n' + self._body())
+                fields = {}
+                for part in message.get_payload():
+                    fields[part.get_param('name', header='content-disposition')] = (
+                        part.get_payload(decode=True), part.get_filename())
+                content, filename = fields['file']
+                return self._send(200, state.add_file(content, fields['purpose'][0].decode('utf-8'), filename))
+            if parts == ['chat', 'completions']:
+                body = json.loads(self._body())
+                try:
+                    content = state.respond(body)
+                except MockAPIError as e:
+                    return self._send(e.http_status, {'error': {'message': str(e)}}, headers = e.headers)
+                except TimeoutError as e:
+                    return self._send(408, {'error': {'message': str(e)}})
+                return self._send(200, chat_completion(body, content))
+            if parts == ['batches']:
+                payload = json.loads(self._body())
+                if payload.get('input_file_id') not in state.files:
+                    return self._send(400, {'error': {'message': 'input file not found'}})
+                batch_id = 'batch_' + uuid.uuid4().hex
+                total = sum(1 for line in state.files[payload['input_file_id']].splitlines() if line.strip())
+                state.batches[batch_id] = {
+                    'id': batch_id, 'object': 'batch', 'endpoint': payload.get('endpoint'),
+                    'input_file_id': payload['input_file_id'], 'completion_window': payload.get('completion_window'),
+                    'status': 'validating', 'output_file_id': None, 'error_file_id': None,
+                    'created_at': int(time.time()), 'completed_at': None, 'metadata': payload.get('metadata'),
+                    'request_counts': {'total': total, 'completed': 0, 'failed': 0}
+                }
+                threading.Thread(target=state.run_batch, args=(batch_id,), daemon=True).start()
+                return self._send(200, state.batches[batch_id])
+            self._send(404, {'error': {'message': 'not found'}})
+
+    return Handler
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, respond = empty_response):
+    '''
+    Start the stand-in server in a background thread.
+    Return (server, api_base); call server.shutdown() to stop it.
+    '''
+    state = MockState(respond)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+def gold_responder(output_dir: str, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+    '''
+    respond(body) replaying gold annotations of output_dir/eval (see backends.MockBackend).
+    '''
+    backend = MockBackend(output_dir, latency, error_rate, seed)
+    return lambda body: backend.respond(body['messages'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in server of the OpenAI chat completion, Files and Batch endpoints')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--result-dir', default=None, help='replay gold annotations of this result directory')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean secs per chat completion')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of failing chat completions')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+
+    respond = empty_response
+    if args.result_dir is not None:
+        respond = gold_responder(args.result_dir, args.latency, args.error_rate, args.seed)
+    server, api_base = start_server(args.host, args.port, respond)
+    logging.info(f'serving on {api_base}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,72 @@
+import logging
+import re
+
+# One self-closing record, e.g. <EVENT id="E1" start="0" end="9" text="chest pain" type="PROBLEM"/>
+# Quoted values may hold '<' and '>', so no escaping is needed before matching
+RECORD = {tag: re.compile(r'<%s((?:\s+[\w:-]+\s*=\s*"[^"]*")*)\s*/>' % tag) for tag in ('EVENT', 'TIMEX3', 'TLINK')}
+ATTRIBUTE = re.compile(r'([\w:-]+)\s*=\s*"([^"]*)"')
+# In-line NER markup of the RE input that the model copies into fromText/toText
+INLINE_MARKUP = re.compile(r'(<EVENT.*?/EVENT>)|(<TIMEX.*?/TIMEX>)|(<EVENT|<TIMEX|</EVENT>|</TIMEX>)')
+# Lines that hold no record and are not counted as dropped
+WRAPPER = re.compile(r'\s*(<\?xml[^>]*\?>|</?TAGS>|```\w*)?\s*$')
+
+
+def has_keywords(line: str, keywords: tuple) -> bool:
+    return all(keyword in line for keyword in keywords)
+
+
+def filter_lines(text: str, keywords: tuple):
+    '''
+    Lines of a model response holding every keyword.
+    Return (lines, number of dropped lines); empty and <TAGS> wrapper lines are not counted.
+    '''
+    lines, dropped = [], 0
+    for line in text.strip().split('\n'):
+        if has_keywords(line, keywords):
+            lines.append(line)
+        elif not WRAPPER.match(line):
+            dropped += 1
+    return lines, dropped
+
+
+def iter_records(lines, tag: str, keywords: tuple = (), counts: dict = None):
+    '''
+    Stream the attributes of every <tag .../> record in lines as dicts (values as written by the model).
+
+    lines - any iterable of lines, e.g. an open file
+    keywords - attributes a line needs to hold; other lines are dropped
+    counts - if given, 'records' and 'dropped' (malformed or incomplete lines) are added to it
+
+    For TLINKs, in-line EVENT/TIMEX markup copied from the RE input is removed first.
+    '''
+    pattern = RECORD[tag]
+    records, dropped = 0, 0
+    for line in lines:
+        if WRAPPER.match(line):
+            continue
+        found = 0
+        if has_keywords(line, keywords):
+            if tag == 'TLINK':
+                line = INLINE_MARKUP.sub('', line)
+            for match in pattern.finditer(line):
+                found += 1
+                yield dict(ATTRIBUTE.findall(match.group(1)))
+        if found:
+            records += found
+        else:
+            dropped += 1
+    if counts is not None:
+        counts['records'] = counts.get('records', 0) + records
+        counts['dropped'] = counts.get('dropped', 0) + dropped
+
+
+def parse_file(path: str, tag: str, keywords: tuple = ()):
+    '''
+    Return (records, number of dropped lines) of a model output file, read line by line.
+    '''
+    counts = {}
+    with open(path, 'r') as f:
+        records = list(iter_records(f, tag, keywords, counts))
+    if counts['dropped']:
+        logging.debug(f'{path}: dropped {counts["dropped"]} malformed lines')
+    return records, counts['dropped']
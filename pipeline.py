@@ -0,0 +1,243 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from api_engine import get_concurrency, output_file_path
+from eval_cache import file_hash
+from rate_limit import RateLimiter
+from run_manifest import RunManifest
+
+STATE_FILE = 'pipeline_state.json'
+TASKS = ('ner', 're', 'nerre')
+MODES = ('one', 'zero')
+# task: (config section of its prompts, gold standard directory)
+TASK_SOURCES = {'ner': ('NER', 'eval/ner'), 're': ('RE', 'eval/re'), 'nerre': ('NERRE', 'eval/re')}
+
+
+def hash_files(paths: list, root: str = None) -> str:
+    '''
+    sha256 over the relative paths and contents of files, in sorted order.
+    '''
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, root or os.path.dirname(path)).encode('utf-8'))
+        digest.update(file_hash(path).encode('ascii'))
+    return digest.hexdigest()
+
+
+class Stage:
+    '''
+    One step of the pipeline.
+
+    name - unique name, e.g. run_ner_one
+    func - callable without arguments doing the work
+    deps - names of the stages that have to succeed first
+    inputs / outputs - callables returning the files the stage reads / writes
+    params - anything else the result depends on (model, prompts, ...), JSON serializable
+    complete - callable telling whether the outputs are complete, e.g. every note has an output
+    '''
+    def __init__(self, name: str, func, deps = (), inputs = None, outputs = None, params = None, complete = None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.inputs = inputs or (lambda: [])
+        self.outputs = outputs or (lambda: [])
+        self.params = params
+        self.complete = complete or (lambda: True)
+
+    def fingerprint(self, root: str) -> str:
+        payload = json.dumps({'params': self.params, 'inputs': hash_files(self.inputs(), root)}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Pipeline:
+    '''
+    Run stages in dependency order, independent stages at the same time.
+
+    A stage is skipped when its fingerprint (content hashes of its inputs and its params) and the
+    content hash of its outputs are the ones recorded after its last successful run, and its outputs
+    are complete. The record is kept in <output_dir>/pipeline_state.json. Stages whose dependencies
+    failed are not run.
+    '''
+    def __init__(self, output_dir: str, stages: list):
+        self.output_dir = output_dir
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = os.path.join(output_dir, STATE_FILE)
+        self.lock = threading.Lock()
+        for stage in stages:
+            missing = [dep for dep in stage.deps if dep not in self.stages]
+            if missing:
+                raise ValueError(f'stage {stage.name} depends on unknown stages: {missing}')
+
+    def _read_state(self) -> dict:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, state: dict):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def up_to_date(self, stage: Stage, state: dict) -> bool:
+        record = state.get(stage.name)
+        if record is None or not stage.outputs() or not stage.complete():
+            return False
+        return (record.get('fingerprint') == stage.fingerprint(self.output_dir)
+                and record.get('outputs') == hash_files(stage.outputs(), self.output_dir))
+
+    def _run_stage(self, stage: Stage, state: dict, force: bool) -> str:
+        if not force and self.up_to_date(stage, state):
+            logging.info(f'pipeline: skip {stage.name}, outputs are up to date')
+            return 'skipped'
+        logging.info(f'pipeline: start {stage.name}')
+        # Fingerprint the inputs before running, so changes made meanwhile trigger another run
+        fingerprint = stage.fingerprint(self.output_dir)
+        stage.func()
+        record = {'fingerprint': fingerprint, 'outputs': hash_files(stage.outputs(), self.output_dir)}
+        with self.lock:
+            state[stage.name] = record
+            self._write_state(state)
+        logging.info(f'pipeline: done {stage.name}')
+        return 'done'
+
+    def targets(self, names: list) -> list:
+        '''
+        The given stages with everything they depend on.
+        '''
+        selected, pending = set(), list(names)
+        while pending:
+            name = pending.pop()
+            if name not in selected:
+                selected.add(name)
+                pending += list(self.stages[name].deps)
+        return [name for name in self.stages if name in selected]
+
+    def run(self, targets: list = None, force: bool = False, max_workers: int = None) -> dict:
+        '''
+        Run the target stages (default: all) and their dependencies.
+        Return {stage: 'done' | 'skipped' | 'failed' | 'blocked'}.
+        '''
+        names = self.targets(targets) if targets else list(self.stages)
+        state = self._read_state()
+        status = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers = max_workers or len(names) or 1) as executor:
+            while len(status) < len(names):
+                for name in names:
+                    if name in status or name in running.values():
+                        continue
+                    deps = [status.get(dep) for dep in self.stages[name].deps]
+                    if any(dep in ('failed', 'blocked') for dep in deps):
+                        logging.error(f'pipeline: {name} not run, a dependency failed')
+                        status[name] = 'blocked'
+                    elif all(dep in ('done', 'skipped') for dep in deps):
+                        running[executor.submit(self._run_stage, self.stages[name], state, force)] = name
+                if not running:
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        status[name] = future.result()
+                    except Exception as e:
+                        logging.exception(f'pipeline: error occurred in {name}: \n{e}')
+                        status[name] = 'failed'
+        logging.info('pipeline: ' + ', '.join(f'{name} {status[name]}' for name in names))
+        return status
+
+
+def metrics_path(output_dir: str, run: str, task: str) -> str:
+    return os.path.join(output_dir, 'output_' + run, f'{task}_metrics.csv')
+
+
+def write_metrics(output_dir: str, run: str, task: str, incremental: bool = True, resamples: int = 1000) -> list:
+    '''
+    Metrics rows of one run and task (eval_sweep.evaluate_run), written to <run dir>/<task>_metrics.csv.
+    '''
+    import pandas as pd
+    from eval_sweep import evaluate_run
+    rows = evaluate_run(output_dir, run, task, incremental, resamples)
+    pd.DataFrame(rows).to_csv(metrics_path(output_dir, run, task), index=False)
+    for row in rows:
+        logging.info(f"{run} {task} {row['match']}: micro f1 {round(row['micro_f1'], 4)}, macro f1 {round(row['macro_f1'], 4)}")
+    return rows
+
+
+def build_pipeline(input_dir: str, output_dir: str, config, execute_date: str, tasks = TASKS, modes = MODES,
+                   api_retry: int = 6, processes: int = None) -> Pipeline:
+    '''
+    conversion -> run_<task>_<mode> -> eval_<task>_<mode>; eval_re_<mode> -> normalize_<mode>
+    Metrics of each run and task are written to <run dir>/<task>_metrics.csv (write_metrics).
+
+    API runs of all tasks and modes share one rate limiter and one [openai] concurrency budget
+    of requests in flight, so running them at the same time stays within the account quota.
+    Outputs go to output_<mode>_<model>_<execute_date>, whose run manifest (run_manifest.py) records
+    the notes of every run and its metrics and normalized files; a run started on a subset of notes
+    from the command line stays on it.
+    '''
+    from generate_data import generate_data
+    from run_api import get_output_path, run_ner, run_re, run_nerre
+    from utils import normalize
+
+    runners = {'ner': run_ner, 're': run_re, 'nerre': run_nerre}
+    limiter = RateLimiter.from_config(config)
+    budget = threading.BoundedSemaphore(get_concurrency(config))
+    model = {key: config['openai'][key] for key in ('model', 'temperature')}
+
+    def files(*patterns):
+        return lambda: [path for pattern in patterns for path in glob.glob(os.path.join(output_dir, pattern))]
+
+    stages = [Stage('convert', lambda: generate_data(input_dir, output_dir, processes),
+                    inputs = lambda: glob.glob(os.path.join(input_dir, 'train/*.xml')) + glob.glob(os.path.join(input_dir, 'test/*.xml')),
+                    outputs = files('data/*/*.txt', 'eval/*/*.xml'))]
+
+    for mode in modes:
+        few_shot = mode == 'one'
+        run = f"{mode}_{config['openai']['model']}_{execute_date}"
+        manifest = RunManifest(output_dir, run)
+        for task in tasks:
+            section, gold_dir = TASK_SOURCES[task]
+            path = get_output_path(output_dir, config, task, few_shot, execute_date)
+            run_dir = os.path.relpath(path, output_dir)
+
+            def complete(task = task, path = path, manifest = manifest):
+                notes = manifest.notes(task) or glob.glob(os.path.join(output_dir, 'data', task, '*.txt'))
+                return all(os.path.exists(output_file_path(path, note)) for note in notes)
+
+            def run_task(task = task, few_shot = few_shot, section = section, manifest = manifest):
+                manifest.start(task, config, section)
+                manifest.record(task, runners[task](output_dir, few_shot, api_retry, execute_date, limiter, budget, config,
+                                                    manifest.notes(task) or None))
+
+            stages.append(Stage(
+                f'run_{task}_{mode}', run_task,
+                deps = ['convert'], inputs = files(f'data/{task}/*.txt'), outputs = files(f'{run_dir}/*.xml'),
+                params = dict(model, prompts = dict(config[section]), few_shot = few_shot), complete = complete))
+            def evaluate(run = run, task = task, manifest = manifest):
+                write_metrics(output_dir, run, task)
+                manifest.set('evals', os.path.relpath(metrics_path(output_dir, run, task), output_dir), task)
+
+            stages.append(Stage(
+                f'eval_{task}_{mode}', evaluate,
+                deps = [f'run_{task}_{mode}'], inputs = files(f'{gold_dir}/*.xml', f'{run_dir}/*.xml'),
+                outputs = lambda run = run, task = task: [metrics_path(output_dir, run, task)]))
+
+        if 're' in tasks:
+            def normalize_run(run = run, manifest = manifest):
+                normalize(output_dir, run = run, processes = processes)
+                manifest.set('normalized', os.path.join('normalized', run + '.csv'))
+
+            stages.append(Stage(
+                f'normalize_{mode}', normalize_run,
+                deps = [f'eval_re_{mode}'],
+                inputs = files('eval/ner/*.xml', os.path.join('output_' + run, 're', '*.xml')),
+                outputs = files(os.path.join('normalized', run + '.csv'))))
+    return Pipeline(output_dir, stages)
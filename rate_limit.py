@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+# Keep the pace slightly under the quota so bursts from other clients don't trigger 429s.
+HEADROOM = 0.95
+# Rough number of characters per token for English clinical text.
+CHARS_PER_TOKEN = 4
+# Tokens added by the chat format for every message (role, separators).
+TOKENS_PER_MESSAGE = 4
+
+
+def estimate_tokens(messages: list) -> int:
+    '''
+    Estimate the prompt tokens of a chat request before sending it.
+    messages - system prompt, few-shot pair and note text as chat messages.
+    '''
+    tokens = 3  # reply priming
+    for message in messages:
+        tokens += TOKENS_PER_MESSAGE + len(message['content']) // CHARS_PER_TOKEN + 1
+    return tokens
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket refilled continuously with `per_minute` tokens per minute.
+    per_minute <= 0 disables the bucket.
+    '''
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        '''
+        Take `amount` tokens from the bucket and return how long the caller has to wait
+        until the bucket would have had them. The balance may go negative, which queues
+        later callers behind this one instead of letting them race for the same refill.
+        '''
+        if not self.enabled:
+            return 0.0
+        # A request larger than the whole budget can never fit; cap it so it waits at most a minute.
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def consume(self, amount: float):
+        '''
+        Debit tokens without waiting (e.g. completion tokens reported after the response).
+        '''
+        if not self.enabled or amount <= 0:
+            return
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class RateLimiter:
+    '''
+    Pace API requests under requests-per-minute (RPM) and tokens-per-minute (TPM) budgets.
+
+    Each request reserves one request and its estimated prompt tokens up front
+    and sleeps only as long as the budgets require.
+    After the response, the reported completion tokens are charged to the TPM budget.
+    '''
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm * HEADROOM)
+        self.tokens = TokenBucket(tpm * HEADROOM)
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+        Read [openai] rpm_limit and tpm_limit from api.config. Missing or 0 means unlimited.
+        The mock backend has no account quota; it uses mock_rpm_limit and mock_tpm_limit instead.
+        '''
+        prefix = 'mock_' if config['openai'].get('backend', 'openai') == 'mock' else ''
+        return cls(rpm = config['openai'].getfloat(prefix + 'rpm_limit', fallback=0),
+                   tpm = config['openai'].getfloat(prefix + 'tpm_limit', fallback=0))
+
+    def acquire(self, estimated_tokens: int):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            logging.debug(f'rate limit: waiting {round(wait, 2)} secs')
+            time.sleep(wait)
+
+    def record(self, usage):
+        '''
+        usage - `usage` field of the API response
+        '''
+        if usage:
+            self.tokens.consume(usage.get('completion_tokens', 0))
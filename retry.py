@@ -0,0 +1,147 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Status codes worth retrying: timeout, conflict, rate limit and server errors.
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# openai.error classes (and similar client errors) that will succeed on a later attempt.
+RETRYABLE_ERRORS = {'RateLimitError', 'Timeout', 'APITimeoutError', 'APIConnectionError',
+                    'ServiceUnavailableError', 'APIError', 'TryAgain', 'InternalServerError'}
+# Errors that fail the same way every time: bad key, no access, too long context, bad request.
+FATAL_ERRORS = {'AuthenticationError', 'PermissionError', 'PermissionDeniedError',
+                'InvalidRequestError', 'BadRequestError', 'NotFoundError', 'InvalidAPIType'}
+
+
+def is_retryable(e: Exception) -> bool:
+    '''
+    Classify an API error.
+    Rate limits, timeouts, connection and server errors are retried;
+    authentication and invalid requests (e.g. context length exceeded) fail at once.
+    '''
+    status = getattr(e, 'http_status', None) or getattr(e, 'status_code', None)
+    if status is not None:
+        return int(status) in RETRYABLE_STATUS or int(status) >= 500
+    name = type(e).__name__
+    if name in FATAL_ERRORS:
+        return False
+    if name in RETRYABLE_ERRORS or isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if 'maximum context length' in str(e):
+        return False
+    # Unknown errors keep the previous behavior of being retried
+    return True
+
+
+def get_retry_after(e: Exception):
+    '''
+    Seconds to wait from the Retry-After (or retry-after-ms) header of the error response.
+    Return None if the server did not send one.
+    '''
+    headers = getattr(e, 'headers', None)
+    if not headers:
+        return None
+    headers = {str(k).lower(): v for k, v in dict(headers).items()}
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            value = headers['retry-after']
+            try:
+                return float(value)
+            except ValueError:
+                # HTTP-date form
+                retry_at = parsedate_to_datetime(value)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class RetryPolicy:
+    '''
+    Exponential backoff with full jitter.
+
+    max_attempts - total number of attempts per note
+    base - delay cap of the first retry in secs, doubled on every retry upto max_delay
+    A Retry-After header sent by the server takes precedence over the backoff delay,
+    upto max_retry_after secs (max_delay if None), so one response cannot hold a worker for hours.
+
+    Per-note metrics (attempts, retries, waited secs and errors) are kept in `metrics`.
+    '''
+    def __init__(self, max_attempts: int = 5, base: float = 1.0, max_delay: float = 60.0, max_retry_after: float = None):
+        self.max_attempts = max(1, max_attempts)
+        self.base = base
+        self.max_delay = max_delay
+        self.max_retry_after = max_delay if max_retry_after is None else max_retry_after
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, api_retry: int = 6):
+        '''
+        api_retry keeps its previous meaning: upto (api_retry - 1) attempts per note.
+        Delays are read from [openai] backoff_base, backoff_max and retry_after_max (backoff_max if missing) in api.config.
+        '''
+        max_delay = config['openai'].getfloat('backoff_max', fallback=60.0)
+        return cls(max_attempts = api_retry - 1,
+                   base = config['openai'].getfloat('backoff_base', fallback=1.0),
+                   max_delay = max_delay,
+                   max_retry_after = config['openai'].getfloat('retry_after_max', fallback=max_delay))
+
+    def delay(self, attempt: int, e: Exception = None) -> float:
+        retry_after = get_retry_after(e) if e is not None else None
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                logging.warning(f'Retry-After of {round(retry_after, 2)} secs clamped to {self.max_retry_after} secs')
+                return self.max_retry_after
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base * 2 ** (attempt - 1)))
+
+    def call(self, fn, note: str):
+        '''
+        Run fn() until it succeeds, a fatal error occurs or attempts run out.
+        Return the result of fn, or None if every attempt failed.
+        '''
+        stats = {'attempts': 0, 'retries': 0, 'waited': 0.0, 'errors': [], 'success': False}
+        result = None
+        for attempt in range(1, self.max_attempts + 1):
+            stats['attempts'] = attempt
+            try:
+                result = fn()
+                stats['success'] = True
+                break
+            except Exception as e:
+                stats['errors'].append(type(e).__name__)
+                if not is_retryable(e):
+                    logging.error(f"{note}: {attempt}th API error (not retryable): \n{e}")
+                    break
+                logging.error(f"{note}: {attempt}th API error: \n{e}")
+                if attempt == self.max_attempts:
+                    break
+                wait = self.delay(attempt, e)
+                logging.info(f"{note}: retrying in {round(wait, 2)} secs...")
+                time.sleep(wait)
+                stats['retries'] += 1
+                stats['waited'] += wait
+
+        with self.lock:
+            self.metrics[note] = stats
+        if stats['retries'] or not stats['success']:
+            logging.info(f"{note}: retry metrics - attempts: {stats['attempts']}, waited: {round(stats['waited'], 2)} secs, "
+                         f"errors: {stats['errors']}, success: {stats['success']}")
+        return result
+
+    def log_summary(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        if not metrics:
+            return
+        retried = sum(1 for m in metrics if m['retries'])
+        failed = sum(1 for m in metrics if not m['success'])
+        retries = sum(m['retries'] for m in metrics)
+        waited = sum(m['waited'] for m in metrics)
+        logging.info(f'retry summary - notes: {len(metrics)}, retried notes: {retried}, failed notes: {failed}, '
+                     f'retries: {retries}, waited: {round(waited, 2)} secs')
@@ -1,385 +1,137 @@
-import openai
 import configparser
 import logging
 
-import tqdm as td
 import os, glob
 from datetime import date
-import time
 
+from api_engine import output_file_path, run_requests
+from api_cache import ResponseCache
+from backends import get_backend
 
-def run_ner(output_dir: str, few_shot: bool = True, api_retry: int = 6):
+# task: (config section, attributes a line needs to keep in the output)
+TASKS = {
+    'ner': ('NER', ('text', 'type')),
+    're': ('RE', ('toID', 'fromID', 'type')),
+    'nerre': ('NERRE', ('toID', 'fromID', 'type'))
+}
+
+
+def get_output_path(output_dir: str, config, task: str, few_shot: bool = True, execute_date: str = None) -> str:
     '''
-    Do named entity recognition - problem, test, treatment
-    
-    output_dir should contain input data for the task.
-    Recommend to execute generate_data.py before executing API functions.
+    output_dir/output_<one|zero>_<model>_<yymmdd>/<task>
+    execute_date = %y%m%d (string), today if None
     '''
-    ### Get prompt parameters
-    config = configparser.ConfigParser()
-    config.read(os.path.join(os.getcwd(), "api.config"))
-    
-    openai.api_key = config['openai']['api_key']
-    model = config['openai']['model']
-    temp = float(config['openai']['temperature'])
-    
-    # Create folder to store output
+    if execute_date is None:
+        execute_date = date.today().strftime("%y%m%d")
     if few_shot:
-        date_path = "output_" + "one_" + config['openai']['model'] + '_' + date.today().strftime("%y%m%d") + "/ner"
+        date_path = "output_" + "one_" + config['openai']['model'] + '_' + execute_date + "/" + task
     else:
-        date_path = "output_" + "zero_" + config['openai']['model'] + '_' + date.today().strftime("%y%m%d") + "/ner"
-    path = os.path.join(output_dir, date_path)
-    if not os.path.exists(path):
-        os.makedirs(path)
-    
-    # Read NER input data
-    notes = glob.glob(os.path.join(output_dir, 'data/ner', '*.txt'))
-    
-    ### Get prompt design
+        date_path = "output_" + "zero_" + config['openai']['model'] + '_' + execute_date + "/" + task
+    return os.path.join(output_dir, date_path)
+
+
+def get_shots(config, task: str, few_shot: bool = True) -> list:
+    '''
+    Messages sent before each note: system prompt, and the example note and answer for few-shot.
+    '''
+    section = TASKS[task][0]
     if few_shot == True:
-        system_msg = config['NER']['few_prompt']
-        few_user = config['RE']['few_user']
-        few_assistant = config['NER']['few_assistant']
-        
-        logging.info(f'start API reqeusts...')
-        for note in td.tqdm(notes, desc = "Generating NER output from i2b2", unit = "files"):
-            if os.path.exists(os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')):
-                logging.info('output exists: %s' % note)
-            else:
-                with open(note, 'r') as f:
-                    content = f.read()
-                
-                # Call GPT API -> Re-call API upto 5 times
-                api_no = 1
-                while api_no < api_retry:
-                    try:
-                        if not api_no == 1:
-                            logging.info(f'{api_no}th API re-requests...')
-                        completions = openai.ChatCompletion.create(
-                            model = model,
-                            temperature = temp,
-                            n = 1,
-                            messages = [
-                                {'role':'system', 'content':system_msg},
-                                {'role':'user', 'content':few_user},
-                                {'role':'assistant', 'content':few_assistant},
-                                {'role':'user', 'content':content}
-                            ]
-                        )
-                        response = completions.choices[0]['message']['content']
-                        break
-                    except Exception as e:
-                        logging.error(f"{note}: {api_no}th API error: \n{e}")
-                        logging.info(f"susepnding 30 secs to avoid max retries...\n")
-                        time.sleep(30)
-                        api_no += 1
-                        response = ''
-                        
-                if not response=='':
-                    # Remove incomplete reponse
-                    lines = response.strip().split('\n')
-                    lines = [line for line in lines if all(keyword in line for keyword in ('text', 'type'))]
-                    response = '\n'.join(lines)
-                    response = '<TAGS>\n' + response + '\n</TAGS>'
-                    
-                    output_file = os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        f.write(response)
-                else: 
-                    logging.info(f"pass saving {os.path.splitext(os.path.basename(note))[0]} file due to empty response...\n")
-                    
+        system_msg = config[section]['few_prompt']
+        # NER uses the example note of RE
+        few_user = config['RE' if task == 'ner' else section]['few_user']
+        few_assistant = config[section]['few_assistant']
+        return [
+            {'role':'system', 'content':system_msg},
+            {'role':'user', 'content':few_user},
+            {'role':'assistant', 'content':few_assistant}
+        ]
     else: # zero_shot
-        system_msg = config['NER']['zero_prompt']
-        
-        logging.info(f'start API reqeusts...')
-        for note in td.tqdm(notes, desc = "Generating NER output from i2b2", unit = "files"):
-            if os.path.exists(os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')):
-                logging.info('output exists: %s' % note)
-            else:
-                with open(note, 'r') as f:
-                    content = f.read()
-                
-                api_no = 1
-                while api_no < api_retry:    
-                    try:
-                        if not api_no == 1:
-                            logging.info(f'{api_no}th API re-requests...')
-                        completions = openai.ChatCompletion.create(
-                            model = model,
-                            temperature = temp,
-                            n = 1,
-                            messages = [
-                                {'role':'system', 'content': system_msg},
-                                {'role':'user', 'content':content}
-                            ]
-                        )
-                        response = completions.choices[0]['message']['content']
-                        break
-                    except Exception as e:
-                        logging.error(f"{note}: {api_no}th API error: \n{e}")
-                        logging.info(f"susepnding 30 secs to avoid max retries...\n")
-                        time.sleep(30)
-                        api_no += 1
-                        response = ''
-                
-                if not response == '':
-                    lines = response.strip().split('\n')
-                    lines = [line for line in lines if all(keyword in line for keyword in ('text', 'type'))]
-                    response = '\n'.join(lines)
-                    response = '<TAGS>\n' + response + '\n</TAGS>'
-                    
-                    output_file = os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')
-                    with open(output_file, 'w', encoding = 'utf-8') as f:
-                        f.write(response)
-                else: 
-                    logging.ingo(f"pass saving {os.path.splitext(os.path.basename(note))[0]} file due to empty response...\n")
-    
+        system_msg = config[section]['zero_prompt']
+        return [{'role':'system', 'content':system_msg}]
+
+
+def note_id(note: str) -> str:
+    return os.path.splitext(os.path.basename(note))[0]
 
-def run_re(output_dir: str, few_shot: bool = True, api_retry: int = 6):
+
+def _run_task(output_dir: str, task: str, few_shot: bool, api_retry: int, desc: str,
+              execute_date: str = None, limiter = None, budget = None, config = None, notes: list = None) -> dict:
+    ### Get prompt parameters
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read(os.path.join(os.getcwd(), "api.config"))
+
+    # Create folder to store output
+    path = get_output_path(output_dir, config, task, few_shot, execute_date)
+    os.makedirs(path, exist_ok=True)
+
+    # Read input data, only the given note IDs if any
+    selected = None if notes is None else {str(note) for note in notes}
+    notes = [note for note in sorted(glob.glob(os.path.join(output_dir, 'data', task, '*.txt')))
+             if selected is None or note_id(note) in selected]
+    if selected is not None and len(notes) < len(selected):
+        logging.warning(f'{task}: no input for notes {sorted(selected - {note_id(note) for note in notes})}')
+
+    ### Get prompt design
+    shots = get_shots(config, task, few_shot)
+
+    # Long NER notes are split into overlapping windows
+    chunk_chars, chunk_overlap = 0, 0
+    if task == 'ner':
+        chunk_chars = config['NER'].getint('chunk_chars', fallback=0)
+        chunk_overlap = config['NER'].getint('chunk_overlap', fallback=0)
+
+    # One cache connection for the run, closed when the run ends or fails
+    cache = ResponseCache.from_config(config, output_dir)
+    try:
+        # Remove incomplete response: lines without the task's attributes
+        run_requests(notes, path, shots, config, keywords = TASKS[task][1], api_retry = api_retry, desc = desc,
+                     cache = cache, task = task, chunk_chars = chunk_chars, chunk_overlap = chunk_overlap,
+                     backend = get_backend(config, output_dir), limiter = limiter, budget = budget)
+    finally:
+        if cache is not None:
+            cache.close()
+    return {note_id(note): 'done' if os.path.exists(output_file_path(path, note)) else 'failed' for note in notes}
+
+
+def run_ner(output_dir: str, few_shot: bool = True, api_retry: int = 6, execute_date: str = None,
+            limiter = None, budget = None, config = None, notes: list = None) -> dict:
+    '''
+    Do named entity recognition - problem, test, treatment
+
+    output_dir should contain input data for the task.
+    Recommend to execute generate_data.py before executing API functions.
+
+    execute_date - %y%m%d of the output directory, today if None
+    limiter, budget - rate limiter and request slots shared with runs executed at the same time
+    config - api.config settings, read from the working directory if None
+    notes - note IDs to run, every note of the task if None
+
+    Return {note ID: 'done' | 'failed'}: whether each note has an output after the run.
+    '''
+    return _run_task(output_dir, 'ner', few_shot, api_retry, "Generating NER output from i2b2",
+                     execute_date, limiter, budget, config, notes)
+
+
+def run_re(output_dir: str, few_shot: bool = True, api_retry: int = 6, execute_date: str = None,
+           limiter = None, budget = None, config = None, notes: list = None) -> dict:
     '''
     Do temporal relation extraction
-    
+
     output_dir should contain input data for the task.
     Recommend to execute generate_data.py before executing API functions.
     '''
-    ### Get prompt parameters
-    config = configparser.ConfigParser()
-    config.read(os.path.join(os.getcwd(), "api.config"))
-    
-    openai.api_key = config['openai']['api_key']
-    model = config['openai']['model']
-    temp = float(config['openai']['temperature'])
-    
-    # Create folder to store output
-    if few_shot:
-        date_path = "output_" + 'one_' + config['openai']['model'] + '_' + date.today().strftime("%y%m%d") + "/re"
-    else:
-        date_path = "output_" + 'zero_' + config['openai']['model'] + '_' + date.today().strftime("%y%m%d") + "/re"
-    path = os.path.join(output_dir, date_path)
-    if not os.path.exists(path):
-        os.makedirs(path)
-    # Read RE input data
-    notes = glob.glob(os.path.join(output_dir, 'data/re', '*.txt'))
-    
-    ### Get prompt design
-    if few_shot == True:
-        system_msg = config['RE']['few_prompt']
-        few_user = config['RE']['few_user']
-        few_assistant = config['RE']['few_assistant']
-        
-        logging.info(f'start API requests...')
-        for note in td.tqdm(notes, desc="Generating RE output from i2b2", unit="files"):
-            if os.path.exists(os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')):
-                logging.info('output exists: %s' % note)
-            else:
-                with open(note, 'r') as f:
-                    content = f.read()
-                
-                api_no = 1
-                while api_no < api_retry:
-                    try:
-                        if not api_no == 1:
-                            logging.info(f'{api_no}th API re-requests...')
-                        completions = openai.ChatCompletion.create(
-                            model = model,
-                            temperature = temp,
-                            n = 1,
-                            messages = [
-                                {'role':'system', 'content':system_msg},
-                                {'role':'user', 'content':few_user},
-                                {'role':'assistant', 'content':few_assistant},
-                                {'role':'user', 'content':content}
-                            ]
-                        )
-                        response = completions.choices[0]['message']['content']
-                        break
-                    except Exception as e:
-                        logging.error(f"{note}: {api_no}th API error: \n{e}")
-                        logging.info(f"susepnding 30 secs to avoid max retries...\n")
-                        time.sleep(30)
-                        api_no += 1
-                        response = ''
-                                            
-                if not response == '':
-                    # Remove the last XML entity if it doesn't have toID, fromID, or type.
-                    lines = response.strip().split('\n')
-                    lines = [line for line in lines if all(keyword in line for keyword in ('toID', 'fromID', 'type'))]
-                    response = '\n'.join(lines)
-                    response = '<TAGS>\n' + response + '\n</TAGS>'
-                    
-                    output_file = os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        f.write(response)
-                else: 
-                    logging.info(f"pass saving {os.path.splitext(os.path.basename(note))[0]} file due to empty response...\n")
-        
-    else:
-        system_msg = config['RE']['zero_prompt']
-        
-        logging.info(f'start API requests...')
-        for note in td.tqdm(notes, desc="Generating RE output from i2b2", unit="files"):
-            if os.path.exists(os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')):
-                logging.info('output exists: %s' % note)
-            else:
-                with open(note, 'r') as f:
-                    content = f.read()
-                
-                # GPT API call
-                api_no = 1
-                while api_no < api_retry:
-                    try:
-                        if not api_no == 1:
-                            logging.info(f'{api_no}th API re-requests...')
-                        completions = openai.ChatCompletion.create(
-                            model = model,
-                            temperature = temp,
-                            n = 1,
-                            messages = [
-                                {'role':'system', 'content':system_msg},
-                                {'role':'user', 'content':content}
-                            ]
-                        )
-                        response = completions.choices[0]['message']['content']
-                        break
-                    except Exception as e:
-                        logging.error(f"{note}: {api_no}th API error: \n{e}")
-                        logging.info(f"susepnding 30 secs to avoid max retries...\n")
-                        time.sleep(30)
-                        api_no += 1
-                        response = ''
-                                        
-                if not response == '':
-                    lines = response.strip().split('\n')
-                    lines = [line for line in lines if all(keyword in line for keyword in ('toID', 'fromID', 'type'))]
-                    response = '\n'.join(lines)
-                    response = '<TAGS>\n' + response + '\n</TAGS>'
-                    
-                    output_file = os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        f.write(response)
-                else: 
-                    logging.info(f"pass saving {os.path.splitext(os.path.basename(note))[0]} file...")
+    return _run_task(output_dir, 're', few_shot, api_retry, "Generating RE output from i2b2",
+                     execute_date, limiter, budget, config, notes)
+
 
-def run_nerre(output_dir: str, few_shot: bool = True, api_retry: int = 6):
+def run_nerre(output_dir: str, few_shot: bool = True, api_retry: int = 6, execute_date: str = None,
+              limiter = None, budget = None, config = None, notes: list = None) -> dict:
     '''
     Do end-to-end relation extraction
-    
+
     output_dir should contain input data for the task.
     Recommend to execute generate_data.py before executing API functions.
     '''
-    ### Get prompt parameters
-    config = configparser.ConfigParser()
-    config.read(os.path.join(os.getcwd(), "api.config"))
-    
-    openai.api_key = config['openai']['api_key']
-    model = config['openai']['model']
-    temp = float(config['openai']['temperature'])
-    
-    # Create folder to store output
-    if few_shot:
-        date_path = "output_" + 'one_' + config['openai']['model'] + '_' + date.today().strftime("%y%m%d") + "/nerre"
-    else:
-        date_path = "output_" + 'zero_' + config['openai']['model'] + '_' + date.today().strftime("%y%m%d") + "/nerre"
-    path = os.path.join(output_dir, date_path)
-    if not os.path.exists(path):
-        os.makedirs(path)
-    # Read NERRE input data
-    notes = glob.glob(os.path.join(output_dir, 'data/nerre', '*.txt'))
-    
-    ### Get prompt design
-    if few_shot == True:
-        system_msg = config['NERRE']['few_prompt']
-        few_user = config['NERRE']['few_user']
-        few_assistant = config['NERRE']['few_assistant']
-        
-        logging.info(f'start API requests...')
-        for note in td.tqdm(notes, desc="Generating NER-RE output from i2b2", unit="files"):
-            if os.path.exists(os.path.join(path, os.path.splitext(os.path.basename(note))[0] + ".xml")):
-                logging.info("output exists: %s" % note)
-            else:
-                with open(note, 'r') as f:
-                    content = f.read()
-                    
-                api_no = 1
-                while api_no < api_retry:
-                    try:
-                        if not api_no == 1:
-                            logging.info(f'{api_no}th API re-requests...')
-                        completions = openai.ChatCompletion.create(
-                            model = model,
-                            temperature = temp,
-                            n = 1,
-                            messages = [
-                                {'role':'system', 'content':system_msg},
-                                {'role':'user', 'content':few_user},
-                                {'role':'assistant', 'content':few_assistant},
-                                {'role':'user', 'content':content}
-                            ]
-                        )
-                        response = completions.choices[0]['message']['content']
-                        break
-                    except Exception as e:
-                        logging.error(f"{note}: {api_no}th API error: \n{e}")
-                        logging.info(f"susepnding 30 secs to avoid max retries...\n")
-                        time.sleep(30)
-                        api_no += 1
-                        response = ''
-
-                if not response == '':                                            
-                    # Remove incomplete responses
-                    lines = response.strip().split('\n')
-                    lines = [line for line in lines if all(keyword in line for keyword in ('toID', 'fromID', 'type'))]
-                    response = '\n'.join(lines)
-                    response = '<TAGS>\n' + response + '\n</TAGS>'
-                    
-                    output_file = os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')
-                    with open(output_file, 'w', encoding = 'utf-8') as f:
-                        f.write(response)
-                else: 
-                    logging.info(f"pass saving {os.path.splitext(os.path.basename(note))[0]} file due to empty response...\n")
-    
-    else:
-        system_msg = config['NERRE']['zero_prompt']
-        
-        logging.info(f'start API requests...')
-        for note in td.tqdm(notes, desc="Generating NERRE output from i2b2", unit = "files"):
-            if os.path.exists(os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')):
-                logging.info('output exists: %s' % note)
-            else:
-                with open(note, 'r') as f:
-                    content = f.read()
-                       
-                api_no = 1
-                while api_no < api_retry:
-                    try:
-                        if not api_no == 1:
-                            logging.info(f'{api_no}th API re-requests...')
-                        completions = openai.ChatCompletion.create(
-                            model = model,
-                            temperature = temp,
-                            n = 1,
-                            messages = [
-                                {'role':'system', 'content':system_msg},
-                                {'role':'user', 'content':content}
-                            ]
-                        )
-                        response = completions.choices[0]['message']['content']
-                        break
-                    except Exception as e:
-                        logging.error(f"{note}: {api_no}th API error: \n{e}")
-                        logging.info(f"susepnding 30 secs to avoid max retries...\n")
-                        time.sleep(30)
-                        api_no += 1
-                        response = ''
-                
-                if not response == '':                                    
-                    lines = response.strip().split('\n')
-                    lines = [line for line in lines if all(keyword in line for keyword in ('toID','fromID','type'))]
-                    response = '\n'.join(lines)
-                    response = '<TAGS>\n' + response + '\n</TAGS>'
-                    
-                    output_file = os.path.join(path, os.path.splitext(os.path.basename(note))[0] + '.xml')
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        f.write(response)
-                else: 
-                    logging.info(f"pass saving {os.path.splitext(os.path.basename(note))[0]} file due to empty response...\n")
\ No newline at end of file
+    return _run_task(output_dir, 'nerre', few_shot, api_retry, "Generating NER-RE output from i2b2",
+                     execute_date, limiter, budget, config, notes)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from annotation_store import parse_run
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def prompt_hash(config, section: str) -> str:
+    '''
+    sha256 of a task's prompts in api.config, to tell whether a resumed run still uses the same prompts.
+    '''
+    return hashlib.sha256(json.dumps(dict(config[section]), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RunManifest:
+    '''
+    Persistent record of one run (output_<mode>_<model>_<yymmdd>), kept in its directory as manifest.json.
+
+    run, mode, model, date - see annotation_store.parse_run
+    temperature - of the first run
+    tasks - {task: {'notes': {note ID: 'done' | 'failed'}, 'attempts': {note ID: n}, 'prompts': prompt_hash}}
+            the notes selected for the task and whether they have an output after their last attempt
+    evals - {task: metrics table path}, normalized - normalized csv path; relative to output_dir
+
+    A run started on a subset of notes is resumed on the same subset; notes marked 'failed'
+    can be re-run on their own. Updates from runs of different tasks at the same time are serialized.
+    '''
+    def __init__(self, output_dir: str, run: str):
+        self.output_dir = output_dir
+        self.run = run
+        self.path = os.path.join(output_dir, 'output_' + run, MANIFEST_FILE)
+        self.lock = threading.Lock()
+        self.data = dict(parse_run(run), run = run, tasks = {}, evals = {})
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data.update(json.load(f))
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.data['updated'] = datetime.now().isoformat(timespec='seconds')
+        tmp = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def task(self, task: str) -> dict:
+        return self.data['tasks'].setdefault(task, {'notes': {}, 'attempts': {}})
+
+    def notes(self, task: str, status: str = None) -> list:
+        '''
+        Note IDs recorded for task, only those with the given status if any.
+        '''
+        notes = self.data['tasks'].get(task, {}).get('notes', {})
+        return sorted(note for note, note_status in notes.items() if status is None or note_status == status)
+
+    def start(self, task: str, config, section: str):
+        '''
+        Record the settings of a (resumed) run of task; warn if its prompts changed since the last one.
+        '''
+        with self.lock:
+            self.data.setdefault('temperature', config['openai']['temperature'])
+            self.data.setdefault('created', datetime.now().isoformat(timespec='seconds'))
+            record = self.task(task)
+            prompts = prompt_hash(config, section)
+            if record.get('prompts', prompts) != prompts:
+                logging.warning(f'{self.run} {task}: prompts changed since the last run, outputs mix both')
+            record['prompts'] = prompts
+            self.save()
+
+    def record(self, task: str, statuses: dict):
+        '''
+        Status of every note of a finished run of task (run_api.run_*).
+        '''
+        with self.lock:
+            record = self.task(task)
+            for note, status in statuses.items():
+                # notes done before were skipped, not sent again
+                if record['notes'].get(note) != 'done':
+                    record['attempts'][note] = record['attempts'].get(note, 0) + 1
+                record['notes'][note] = status
+            self.save()
+        failed = [note for note, status in statuses.items() if status == 'failed']
+        logging.info(f'{self.run} {task}: {len(statuses) - len(failed)} of {len(statuses)} notes done'
+                     + (f', failed: {failed}' if failed else ''))
+
+    def set(self, key: str, value, task: str = None):
+        '''
+        Record an output of the run, e.g. set('evals', path, 'ner') or set('normalized', path).
+        '''
+        with self.lock:
+            if task is None:
+                self.data[key] = value
+            else:
+                self.data.setdefault(key, {})[task] = value
+            self.save()
@@ -0,0 +1,204 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from temporal_graph import note_links
+
+# Each TLINK type as constraints between the start (0) and end (1) points of its events:
+# (point of fromID, point of toID, strict); strict is '<', otherwise '<='. Every event has start <= end.
+# A OVERLAP B and B BEFORE_OVERLAP A share time; the latter also starts first.
+POINT_CONSTRAINTS = {
+    'BEFORE': [((0, 1), (1, 0), True)],
+    'AFTER': [((1, 1), (0, 0), True)],
+    'SIMULTANEOUS': [((0, 0), (1, 0), False), ((1, 0), (0, 0), False), ((0, 1), (1, 1), False), ((1, 1), (0, 1), False)],
+    'DURING': [((1, 0), (0, 0), False), ((0, 1), (1, 1), False)],
+    'OVERLAP': [((0, 0), (1, 1), False), ((1, 0), (0, 1), False)],
+    'BEFORE_OVERLAP': [((0, 0), (1, 0), True), ((1, 0), (0, 1), False)],
+}
+# Relations the closure is expressed in; AFTER is written as BEFORE of the swapped pair
+CLOSURE_TYPES = ('BEFORE', 'SIMULTANEOUS', 'DURING', 'BEFORE_OVERLAP', 'OVERLAP')
+SYMMETRIC = ('SIMULTANEOUS', 'OVERLAP')
+CLOSURE_COLUMNS = ['noteID', 'fromID', 'toID', 'type', 'derived']
+CYCLE_COLUMNS = ['noteID', 'ids', 'links']
+
+
+def canonical(from_id: str, to_id: str, rel_type: str):
+    '''
+    (fromID, toID, type) in closure form: AFTER as swapped BEFORE, symmetric relations with sorted IDs.
+    None for self links and types without point constraints.
+    '''
+    rel_type = str(rel_type).upper()
+    if rel_type not in POINT_CONSTRAINTS or from_id == to_id:
+        return None
+    if rel_type == 'AFTER':
+        return to_id, from_id, 'BEFORE'
+    if rel_type in SYMMETRIC and to_id < from_id:
+        return to_id, from_id, rel_type
+    return from_id, to_id, rel_type
+
+
+def canonical_links(re_df) -> pd.DataFrame:
+    '''
+    Distinct TLINKs (noteID, fromID, toID, type) of a table in closure form (see canonical).
+    '''
+    rows = []
+    for note, from_ids, to_ids, types in note_links(re_df):
+        for link in set(filter(None, map(canonical, from_ids, to_ids, types))):
+            rows.append((note,) + link)
+    return pd.DataFrame(rows, columns=CLOSURE_COLUMNS[:4]).sort_values(CLOSURE_COLUMNS[:4], ignore_index=True)
+
+
+def _bits_to_matrix(bitsets: list, size: int):
+    # boolean (len(bitsets), size) matrix of Python int bitsets, bit i -> column i
+    width = (size + 7) // 8
+    data = b''.join(bits.to_bytes(width, 'little') for bits in bitsets)
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8).reshape(len(bitsets), width), axis=1, bitorder='little')[:, :size].astype(bool)
+
+
+def point_order(ids: list, links: list):
+    '''
+    (le, lt, cycles) of the start/end points of ids (event i: start 2i, end 2i+1) under links.
+
+    le[p, q] - p <= q is implied; lt[p, q] - p < q is implied
+    cycles - [(event ids, links)] of strongly connected point sets holding a strict edge, i.e.
+             links implying p < p; le and lt read those strict edges as <=.
+
+    Points are condensed into strongly connected components (equal points); reachability over the
+    condensed DAG is propagated in reverse topological order as int bitsets, one per component.
+    '''
+    index = {event: i for i, event in enumerate(ids)}
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(2 * len(ids)))
+    edges = {(2 * i, 2 * i + 1): False for i in range(len(ids))}
+    for from_id, to_id, rel_type in links:
+        sides = (index[from_id], index[to_id])
+        for (side_p, point_p), (side_q, point_q), strict in POINT_CONSTRAINTS[rel_type]:
+            edge = (2 * sides[side_p] + point_p, 2 * sides[side_q] + point_q)
+            edges[edge] = edges.get(edge, False) or strict
+    graph.add_edges_from(edges)
+
+    condensed = nx.condensation(graph)
+    component = condensed.graph['mapping']
+    size = condensed.number_of_nodes()
+    strict_out = {c: {} for c in range(size)}
+    inconsistent = set()
+    for (p, q), strict in edges.items():
+        c, d = component[p], component[q]
+        if c == d:
+            if strict:
+                inconsistent.add(c)
+        else:
+            strict_out[c][d] = strict_out[c].get(d, False) or strict
+
+    le, lt = [0] * size, [0] * size
+    for c in reversed(list(nx.topological_sort(condensed))):
+        le_c, lt_c = 1 << c, 0
+        for d, strict in strict_out[c].items():
+            le_c |= le[d]
+            lt_c |= le[d] if strict else lt[d]
+        le[c], lt[c] = le_c, lt_c
+
+    cycles = []
+    for c in sorted(inconsistent):
+        events = sorted({ids[p // 2] for p in condensed.nodes[c]['members']})
+        members = set(events)
+        cycles.append((events, [link for link in links if link[0] in members and link[1] in members]))
+
+    points = np.array([component[p] for p in range(2 * len(ids))], dtype=np.int64)
+    le = _bits_to_matrix(le, size)[np.ix_(points, points)]
+    lt = _bits_to_matrix(lt, size)[np.ix_(points, points)]
+    return le, lt, cycles
+
+
+def interval_relations(le, lt) -> dict:
+    '''
+    {type: boolean (events, events) matrix} of every closure relation implied between events i and j.
+    A relation implies the weaker ones, e.g. SIMULTANEOUS implies DURING both ways and OVERLAP.
+    '''
+    starts, ends = slice(0, None, 2), slice(1, None, 2)
+    ss_le, ss_lt = le[starts, starts], lt[starts, starts]
+    ee_le, se_le = le[ends, ends], le[starts, ends]
+    relations = {
+        'BEFORE': lt[ends, starts],
+        'SIMULTANEOUS': ss_le & ss_le.T & ee_le & ee_le.T,
+        'DURING': ss_le.T & ee_le,
+        'BEFORE_OVERLAP': ss_lt & se_le.T,
+        'OVERLAP': se_le & se_le.T,
+    }
+    off_diagonal = ~np.eye(le.shape[0] // 2, dtype=bool)
+    return {rel_type: matrix & off_diagonal for rel_type, matrix in relations.items()}
+
+
+def close_note(from_ids, to_ids, types):
+    '''
+    (closure, cycles) of one note's TLINKs.
+    closure - distinct (fromID, toID, type, derived) implied by the links, in closure form;
+              derived is False for relations given by a link
+    cycles - [(event ids, links)] of inconsistent link sets (see point_order)
+
+    Links of inconsistent cycles stay in the closure as given, but nothing is derived from them.
+    '''
+    links = sorted(set(filter(None, map(canonical, from_ids, to_ids, types))))
+    ids = sorted({event for link in links for event in link[:2]})
+    if not links:
+        return [], []
+    le, lt, cycles = point_order(ids, links)
+    given = set(links)
+    closure = []
+    if cycles:
+        # Every strict cycle lies within one cycle's events; close the remaining links
+        excluded = {link for _, cycle_links in cycles for link in cycle_links}
+        closure = [link + (False,) for link in sorted(excluded)]
+        le, lt, _ = point_order(ids, [link for link in links if link not in excluded])
+    for rel_type, matrix in interval_relations(le, lt).items():
+        for i, j in zip(*np.nonzero(matrix)):
+            if rel_type in SYMMETRIC and j < i:
+                continue
+            link = (ids[i], ids[j], rel_type)
+            if not (cycles and link in excluded):
+                closure.append(link + (link not in given,))
+    return closure, cycles
+
+
+def _close_notes(links: list):
+    # closure rows and cycle rows of a batch of notes
+    closure_rows, cycle_rows = [], []
+    for note, from_ids, to_ids, types in links:
+        closure, cycles = close_note(from_ids, to_ids, types)
+        closure_rows += [(note,) + row for row in closure]
+        cycle_rows += [(note, ' '.join(events), '; '.join(' '.join(link) for link in cycle_links))
+                       for events, cycle_links in cycles]
+    return closure_rows, cycle_rows
+
+
+def closure(re_df, processes: int = 1, batch_size: int = 64):
+    '''
+    Temporal closure of every note of a TLINK table (noteID, fromID, toID, type).
+    Return (closure, cycles):
+    closure - noteID, fromID, toID, type, derived: every relation implied by the note's links
+    cycles - noteID, ids, links: inconsistent link sets, e.g. A BEFORE B, B BEFORE C, C BEFORE A
+
+    BEFORE/AFTER/OVERLAP/SIMULTANEOUS/BEFORE_OVERLAP/DURING links become start/end point
+    constraints (POINT_CONSTRAINTS); other types are ignored. Notes are closed in batches,
+    across processes if processes != 1.
+    '''
+    links = note_links(re_df)
+    batches = [links[i:i + batch_size] for i in range(0, len(links), batch_size)]
+    if processes == 1 or len(batches) <= 1:
+        results = [_close_notes(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as executor:
+            results = list(executor.map(_close_notes, batches))
+
+    closure_rows = [row for result in results for row in result[0]]
+    cycle_rows = [row for result in results for row in result[1]]
+    closure_df = pd.DataFrame(closure_rows, columns=CLOSURE_COLUMNS)
+    cycle_df = pd.DataFrame(cycle_rows, columns=CYCLE_COLUMNS)
+    for row in cycle_df.itertuples():
+        logging.warning(f'inconsistent TLINKs in note {row.noteID}: {row.links}')
+    logging.info(f'closed TLINKs of {len(links)} notes: {int(closure_df["derived"].sum())} derived relations, '
+                 f'{len(cycle_df)} inconsistent cycles')
+    return closure_df, cycle_df
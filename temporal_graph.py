@@ -0,0 +1,103 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# Relation types that make the order of the linked events certain
+CERTAIN_TYPES = ('BEFORE', 'AFTER')
+ORDER_COLUMNS = ['noteID', 'id', 'order', 'certainty']
+
+
+def adjacency(from_ids, to_ids, types) -> dict:
+    '''
+    {node: [(neighbour, relation type)]} of the TLINKs of one note, both directions, in link order.
+    '''
+    relations = {}
+    for from_id, to_id, rel_type in zip(from_ids, to_ids, types):
+        relations.setdefault(from_id, []).append((to_id, rel_type))
+        relations.setdefault(to_id, []).append((from_id, rel_type))
+    return relations
+
+
+def event_order(from_ids, to_ids, types):
+    '''
+    (order, certainty) of the events of one note's TLINKs.
+
+    Events are ordered by a depth-first search over the links, started from each unvisited
+    fromID and then toID in link order. An event is 'Certain' if the search reached it through
+    a BEFORE or AFTER link, otherwise 'Uncertain'. The search keeps its own stack, so densely
+    linked notes do not hit the recursion limit.
+    '''
+    relations = adjacency(from_ids, to_ids, types)
+    visited, order, certainty = set(), [], []
+    for root in list(from_ids) + list(to_ids):
+        if root in visited:
+            continue
+        visited.add(root)
+        order.append(root)
+        certainty.append('Uncertain')
+        stack = [(iter(relations.get(root, ())), False)]
+        while stack:
+            neighbours, is_certain = stack[-1]
+            for neighbour, rel_type in neighbours:
+                if neighbour not in visited:
+                    new_certainty = is_certain or rel_type in CERTAIN_TYPES
+                    visited.add(neighbour)
+                    order.append(neighbour)
+                    certainty.append('Certain' if new_certainty else 'Uncertain')
+                    stack.append((iter(relations.get(neighbour, ())), new_certainty))
+                    break
+            else:
+                stack.pop()
+    return order, certainty
+
+
+def note_links(re_df) -> list:
+    '''
+    [(noteID, fromIDs, toIDs, types)] of every note of a TLINK table, split from the columns in one pass.
+    '''
+    re_df = re_df.dropna(subset=['fromID', 'toID'])
+    notes = re_df['noteID'].astype(str).to_numpy()
+    from_ids = re_df['fromID'].astype(str).to_numpy()
+    to_ids = re_df['toID'].astype(str).to_numpy()
+    types = re_df['type'].astype(str).to_numpy()
+    links = []
+    for note, index in pd.Series(notes).groupby(notes, sort=True).indices.items():
+        links.append((note, from_ids[index], to_ids[index], types[index]))
+    return links
+
+
+def _order_notes(links: list) -> list:
+    # (noteIDs, ids, order, certainty) columns of a batch of notes
+    note_column, ids, positions, certainties = [], [], [], []
+    for note, from_ids, to_ids, types in links:
+        order, certainty = event_order(from_ids, to_ids, types)
+        note_column += [note] * len(order)
+        ids += order
+        positions += range(len(order))
+        certainties += certainty
+    return note_column, ids, positions, certainties
+
+
+def find_event_orders(re_df, processes: int = None, batch_size: int = 64) -> pd.DataFrame:
+    '''
+    Event order and certainty of every note of a TLINK table (noteID, fromID, toID, type).
+    Return noteID, id, order (position within the note) and certainty (see event_order).
+
+    Notes are split from the columns at once and ordered in batches across processes;
+    processes = 1 orders them in this process.
+    '''
+    links = note_links(re_df)
+    batches = [links[i:i + batch_size] for i in range(0, len(links), batch_size)]
+    if processes == 1 or len(batches) <= 1:
+        results = [_order_notes(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as executor:
+            results = list(executor.map(_order_notes, batches))
+
+    columns = [[], [], [], []]
+    for result in results:
+        for column, values in zip(columns, result):
+            column += values
+    logging.info(f'ordered events of {len(links)} notes')
+    return pd.DataFrame(dict(zip(ORDER_COLUMNS, columns)), columns=ORDER_COLUMNS).astype({'order': int})
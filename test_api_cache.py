@@ -0,0 +1,68 @@
+import configparser
+
+from api_cache import ResponseCache, cache_key
+from api_engine import request_completion
+from backends import MockBackend, OpenAIBackend
+from retry import RetryPolicy
+
+MESSAGES = [{'role': 'system', 'content': 'annotate'}, {'role': 'user', 'content': 'pain after CBC.'}]
+
+
+class Backend:
+    # answers every request with content and counts the calls
+    def __init__(self, name: str, content: str):
+        self.name = name
+        self.content = content
+        self.calls = 0
+
+    def create(self, messages: list, model: str, temp: float):
+        self.calls += 1
+        return self.content, None
+
+
+def complete(backend, cache):
+    return request_completion(MESSAGES, 'gpt-4', 0.0, 'note', RetryPolicy(1), backend, cache = cache, task = 'ner')
+
+
+def test_cache_key_separates_backends():
+    keys = {cache_key('gpt-4', 0.0, MESSAGES, 'ner', backend.name)
+            for backend in (OpenAIBackend('key'), OpenAIBackend('key', 'http://localhost:8000/v1'), MockBackend('result'))}
+    assert len(keys) == 3
+    # keys of the OpenAI API are unchanged, so existing caches stay valid
+    assert cache_key('gpt-4', 0.0, MESSAGES, 'ner', 'openai') == cache_key('gpt-4', 0.0, MESSAGES, 'ner')
+
+
+def test_mock_response_never_reaches_real_backend(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'))
+    mock, real = Backend(MockBackend.name, 'gold'), Backend('openai', 'model')
+    assert complete(mock, cache) == 'gold'
+    assert complete(real, cache) == 'model' and real.calls == 1
+    # each backend is served its own cached response
+    assert complete(mock, cache) == 'gold' and mock.calls == 1
+    assert complete(real, cache) == 'model' and real.calls == 1
+    cache.close()
+
+
+def test_mock_backend_cache_is_off_by_default(tmp_path):
+    config = configparser.ConfigParser()
+    config['openai'] = {'backend': 'mock', 'cache': 'true'}
+    assert ResponseCache.from_config(config, str(tmp_path)) is None
+    config['openai']['mock_cache'] = 'true'
+    cache = ResponseCache.from_config(config, str(tmp_path))
+    assert cache is not None
+    cache.close()
+
+
+def test_size_budget_holds_across_caches_sharing_a_file(tmp_path):
+    # caches of runs executing at the same time write to one file
+    path = str(tmp_path / 'responses.sqlite')
+    caches = [ResponseCache(path, max_bytes = 1000) for _ in range(3)]
+    for i in range(30):
+        caches[i % 3].put(f'key{i}', 'x' * 100)
+        stored = caches[0].conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        assert stored <= 1000
+        assert all(cache.stats()['bytes'] == stored for cache in caches)
+    # the most recent responses are kept
+    assert caches[1].get('key29') is not None and caches[2].get('key0') is None
+    for cache in caches:
+        cache.close()
@@ -0,0 +1,107 @@
+import configparser
+import json
+import os
+
+from backends import MockAPIError
+from batch_api import fan_out, run_batch
+from mock_server import gold_responder, start_server
+from run_api import get_output_path
+
+# NER notes: a short one sent whole, and two split into one window per sentence (chunk_chars = 40)
+NOTES = {
+    '1': 'pain after CBC.',
+    '2': 'pain was noted today.\nCBC was normal today.\n',
+    '3': 'pain was noted today.\nCBC was normal today.\nFAIL fever was seen.\n',
+}
+EVENTS = [('pain', 'PROBLEM'), ('CBC', 'TEST'), ('fever', 'PROBLEM')]
+
+
+def config_for(model: str = 'gpt-4'):
+    config = configparser.ConfigParser()
+    config['openai'] = {'model': model, 'temperature': '0.0', 'api_key': 'key'}
+    return config
+
+
+def result_line(custom_id: str, content: str = None) -> str:
+    # one line of a batch output file, or of its error file if content is None
+    if content is None:
+        return json.dumps({'custom_id': custom_id, 'response': None, 'error': {'code': 'server_error', 'message': 'failed'}})
+    return json.dumps({'custom_id': custom_id, 'error': None,
+                       'response': {'status_code': 200, 'body': {'choices': [{'message': {'content': content}}]}}})
+
+
+def test_fan_out_merges_windows_of_complete_notes(tmp_path):
+    results = '\n'.join([
+        result_line('ner/one/7/0-of-2/0', '<EVENT id="E1" start="0" end="4" text="pain" type="PROBLEM"/>'),
+        result_line('ner/one/7/1-of-2/10', '<EVENT id="E1" start="2" end="5" text="CBC" type="TEST"/>'),
+    ])
+    assert fan_out(str(tmp_path), config_for(), results, '231027') == 1
+    path = os.path.join(get_output_path(str(tmp_path), config_for(), 'ner', True, '231027'), '7.xml')
+    with open(path) as f:
+        output = f.read()
+    assert 'start="0" end="4" text="pain"' in output and 'start="12" end="15" text="CBC"' in output
+
+
+def test_fan_out_skips_notes_with_missing_or_failed_windows(tmp_path):
+    # windows in the error file never reach the output file
+    results = '\n'.join([
+        result_line('ner/one/7/0-of-3/0', '<EVENT id="E1" start="0" end="4" text="pain" type="PROBLEM"/>'),
+        result_line('ner/one/7/2-of-3/20', '<EVENT id="E2" start="0" end="5" text="fever" type="PROBLEM"/>'),
+        result_line('ner/one/8/0-of-2/0', '<EVENT id="E1" start="0" end="4" text="pain" type="PROBLEM"/>'),
+        result_line('ner/one/8/1-of-2/10'),
+        result_line('ner/one/9/0-of-1/0', '<EVENT id="E1" start="0" end="4" text="pain" type="PROBLEM"/>'),
+    ])
+    assert fan_out(str(tmp_path), config_for(), results, '231027') == 1
+    path = get_output_path(str(tmp_path), config_for(), 'ner', True, '231027')
+    assert sorted(os.listdir(path)) == ['9.xml']
+
+
+def write_corpus(output_dir: str):
+    # task inputs in data/ner and the gold standard in eval/ner, which the stand-in server replays
+    for folder in ('data', 'eval'):
+        os.makedirs(os.path.join(output_dir, folder, 'ner'))
+    for note, text in NOTES.items():
+        with open(os.path.join(output_dir, 'data', 'ner', note + '.txt'), 'w') as f:
+            f.write(text)
+        events = [(text.index(word), word, type) for word, type in EVENTS if word in text]
+        with open(os.path.join(output_dir, 'eval', 'ner', note + '.xml'), 'w') as f:
+            f.write('<TAGS>\n' + ''.join(f'<EVENT id="E{i}" start="{start}" end="{start + len(word)}" text="{word}" type="{type}"/>\n'
+                                         for i, (start, word, type) in enumerate(events)) + '</TAGS>\n')
+
+
+def batch_config(api_base: str):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api.config'))
+    config['openai'].update({'model': 'gpt-4', 'api_key': 'key', 'api_base': api_base, 'batch_poll_interval': '0.05'})
+    config['NER'].update({'chunk_chars': '40', 'chunk_overlap': '0'})
+    return config
+
+
+def test_run_batch_against_stand_in_server(tmp_path):
+    output_dir = str(tmp_path)
+    write_corpus(output_dir)
+    replay = gold_responder(output_dir)
+
+    def respond(body):
+        # the window with the third sentence of note 3 fails and goes to the error file
+        if 'FAIL' in body['messages'][-1]['content']:
+            raise MockAPIError('mock server error', 500)
+        return replay(body)
+
+    server, api_base = start_server(respond = respond)
+    try:
+        config = batch_config(api_base)
+        assert run_batch(output_dir, ('ner',), (True,), '231027', config) == 2
+        path = get_output_path(output_dir, config, 'ner', True, '231027')
+        assert sorted(os.listdir(path)) == ['1.xml', '2.xml']
+        # offsets of the windows of note 2 are shifted back into the note
+        with open(os.path.join(path, '2.xml')) as f:
+            output = f.read()
+        assert 'start="0" end="4" text="pain"' in output and 'start="22" end="25" text="CBC"' in output
+
+        # the next batch only sends the failed note, which now succeeds
+        server.state.respond = replay
+        assert run_batch(output_dir, ('ner',), (True,), '231027', config) == 1
+        assert sorted(os.listdir(path)) == ['1.xml', '2.xml', '3.xml']
+    finally:
+        server.shutdown()
@@ -0,0 +1,58 @@
+import random
+import re
+
+from chunking import merge_event_responses, sentence_spans, split_windows
+
+
+def random_note(rng, sentences):
+    return ''.join(' '.join(rng.choice(['pain', 'fever', 'CBC', 'given']) for _ in range(rng.randint(1, 12)))
+                   + rng.choice(['.\n', '. ', '\n']) for _ in range(sentences))
+
+
+def records(markup):
+    return [dict(re.findall(r'(\w+)="([^"]*)"', line)) for line in markup.split('\n') if line]
+
+
+def test_split_windows_short_or_disabled():
+    assert split_windows('one. two.', 0) == [(0, 'one. two.')]
+    assert split_windows('one. two.', 100) == [(0, 'one. two.')]
+
+
+def test_split_windows_cover_note_on_sentence_boundaries():
+    rng = random.Random(0)
+    for _ in range(100):
+        text = random_note(rng, rng.randint(1, 30))
+        max_chars, overlap = rng.randint(20, 200), rng.randint(0, 60)
+        windows = split_windows(text, max_chars, overlap)
+        boundaries = {start for start, _ in sentence_spans(text)} | {len(text)}
+        covered = 0
+        for i, (offset, window) in enumerate(windows):
+            assert text[offset:offset + len(window)] == window
+            assert offset in boundaries and offset + len(window) in boundaries
+            # a window only exceeds max_chars if it is a single sentence
+            assert len(window) <= max_chars or len(sentence_spans(window)) == 1
+            # windows move forward without gaps
+            assert offset <= covered and offset + len(window) > covered
+            if i:
+                assert offset > windows[i - 1][0]
+            covered = offset + len(window)
+        assert covered == len(text)
+
+
+def test_merge_event_responses_shifts_offsets_and_drops_duplicates():
+    responses = [
+        (0, '<EVENT id="E1" start="0" end="4" text="pain" type="PROBLEM"/>\n'
+            '<EVENT id="E2" start="10" end="13" text="CBC" type="TEST"/>'),
+        # second window starts at 10: CBC is found again, E1 is reused for another entity
+        (10, '<EVENT id="E1" start="0" end="3" text="CBC" type="TEST"/>\n'
+             '<EVENT id="E1" start="20" end="25" text="fever" type="PROBLEM"/>'),
+    ]
+    merged = records(merge_event_responses(responses))
+    assert [(r['start'], r['end'], r['text']) for r in merged] == [('0', '4', 'pain'), ('10', '13', 'CBC'), ('30', '35', 'fever')]
+    ids = [r['id'] for r in merged]
+    assert ids[:2] == ['E1', 'E2'] and len(set(ids)) == 3
+
+
+def test_merge_event_responses_skips_incomplete_records():
+    responses = [(5, '<EVENT id="E1" start="x" end="4" text="pain" type="PROBLEM"/>\n<EVENT id="E2" start="1" end="2" text="a"/>')]
+    assert merge_event_responses(responses) == ''
@@ -0,0 +1,98 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from eval import check_exact_type_counts, exact_type_counts, exact_type_counts_reference, relax_match
+
+TYPES = ['PROBLEM', 'TEST', 'TREATMENT']
+
+
+def ner_frame(rows):
+    # rows of (noteID, start, end, text, type); ids are not part of the match keys
+    return pd.DataFrame([(note, f'E{i}', str(start), str(end), text, type) for i, (note, start, end, text, type) in enumerate(rows)],
+                        columns=['noteID', 'id', 'start', 'end', 'text', 'type'])
+
+
+def assert_matches_reference(df_original, df_output, types = TYPES):
+    counts = exact_type_counts(df_original, df_output, types)
+    pd.testing.assert_frame_equal(counts, exact_type_counts_reference(df_original, df_output, types), check_names=False)
+    assert check_exact_type_counts(df_original, df_output, types)
+    return counts
+
+
+def test_exact_type_counts_mismatched_types():
+    gold = ner_frame([('1', 0, 4, 'pain', 'PROBLEM'), ('1', 10, 13, 'CBC', 'TEST')])
+    model = ner_frame([('1', 0, 4, 'pain', 'TEST'), ('1', 10, 13, 'CBC', 'TEST')])
+    counts = assert_matches_reference(gold, model)
+    assert counts.loc['PROBLEM'].tolist() == [0, 0, 1]
+    assert counts.loc['TEST'].tolist() == [1, 1, 0]
+    assert counts.loc['TREATMENT'].tolist() == [0, 0, 0]
+
+
+def test_exact_type_counts_duplicates():
+    gold = ner_frame([('1', 0, 4, 'pain', 'PROBLEM')] * 2)
+    model = ner_frame([('1', 0, 4, 'pain', 'PROBLEM')] * 3)
+    counts = assert_matches_reference(gold, model)
+    assert counts.loc['PROBLEM'].tolist() == [2, 0, 0]
+
+
+def test_exact_type_counts_keyed_by_note():
+    # the same annotation in another note is not a match
+    gold = ner_frame([('1', 0, 4, 'pain', 'PROBLEM'), ('2', 0, 4, 'pain', 'PROBLEM')])
+    model = ner_frame([('1', 0, 4, 'pain', 'PROBLEM'), ('3', 0, 4, 'pain', 'PROBLEM')])
+    counts = assert_matches_reference(gold, model)
+    assert counts.loc['PROBLEM'].tolist() == [1, 1, 1]
+
+
+def test_exact_type_counts_empty_frames():
+    gold = ner_frame([('1', 0, 4, 'pain', 'PROBLEM')])
+    empty = ner_frame([])
+    assert assert_matches_reference(gold, empty).loc['PROBLEM'].tolist() == [0, 0, 1]
+    assert assert_matches_reference(empty, gold).loc['PROBLEM'].tolist() == [0, 1, 0]
+    assert assert_matches_reference(empty, empty).to_numpy().sum() == 0
+
+
+def test_exact_type_counts_random_frames():
+    rng = random.Random(0)
+    for _ in range(30):
+        def rows(n):
+            return [(str(rng.randint(1, 3)), start, start + rng.randint(1, 3), rng.choice(['pain', 'CBC', 'fever']), rng.choice(TYPES))
+                    for start in (rng.randint(0, 5) for _ in range(n))]
+        gold = ner_frame(rows(rng.randint(0, 12)))
+        assert_matches_reference(gold, pd.concat([gold.sample(frac=0.5, random_state=rng.randint(0, 99)), ner_frame(rows(4))]))
+
+
+def relax_match_reference(df_original, df_output):
+    # every gold and model pair compared one by one, as eval_ner did before relax_match
+    def overlaps(gold, model):
+        gold_start, gold_end, model_start, model_end = int(gold.start), int(gold.end), int(model.start), int(model.end)
+        condition1 = (gold_start < model_start < gold_end) and (gold_start < model_end)
+        condition2 = (model_start < gold_start) and (gold_start < model_end)
+        return (condition1 or condition2) and (gold.noteID, gold.text, gold.type) == (model.noteID, model.text, model.type)
+    gold_rows, model_rows = list(df_original.itertuples()), list(df_output.itertuples())
+    return (np.array([any(overlaps(gold, model) for model in model_rows) for gold in gold_rows], dtype=bool),
+            np.array([any(overlaps(gold, model) for gold in gold_rows) for model in model_rows], dtype=bool))
+
+
+def test_relax_match_overlap_conditions():
+    gold = ner_frame([('1', 10, 20, 'pain', 'PROBLEM')] * 5)
+    model = ner_frame([('1', 12, 25, 'pain', 'PROBLEM'),    # starts inside the gold span
+                       ('1', 5, 15, 'pain', 'PROBLEM'),     # starts before, ends inside
+                       ('1', 10, 20, 'pain', 'PROBLEM'),    # identical span: neither condition holds
+                       ('1', 12, 15, 'pain', 'TEST'),       # other type
+                       ('2', 12, 15, 'pain', 'PROBLEM')])   # other note
+    gold_matched, model_matched = relax_match(gold, model)
+    assert gold_matched.all()
+    assert model_matched.tolist() == [True, True, False, False, False]
+
+
+def test_relax_match_random_frames():
+    rng = random.Random(1)
+    for _ in range(30):
+        def rows(n):
+            return [(str(rng.randint(1, 2)), start, start + rng.randint(1, 6), rng.choice(['pain', 'fever']), rng.choice(TYPES[:2]))
+                    for start in (rng.randint(0, 10) for _ in range(n))]
+        gold, model = ner_frame(rows(rng.randint(0, 10))), ner_frame(rows(rng.randint(0, 10)))
+        for flags, reference in zip(relax_match(gold, model), relax_match_reference(gold, model)):
+            assert flags.tolist() == reference.tolist()
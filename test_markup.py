@@ -0,0 +1,57 @@
+import random
+import re
+
+from markup import render_spans
+
+
+def render_reference(text, spans):
+    # the offset loop generate_data.re_input used before render_spans; correct for disjoint spans only
+    offset = 0
+    for start, end, opener, closer in sorted(spans, key=lambda span: span[0]):
+        text = text[:start + offset] + opener + text[start + offset:]
+        offset += len(opener)
+        text = text[:end + offset] + closer + text[end + offset:]
+        offset += len(closer)
+    return text
+
+
+def is_well_formed(markup):
+    stack = []
+    for tag, name in re.findall(r'<(/?)(\w+)', markup):
+        if tag:
+            if not stack or stack.pop() != name:
+                return False
+        else:
+            stack.append(name)
+    return not stack
+
+
+def test_render_spans_matches_reference_on_disjoint_spans():
+    rng = random.Random(0)
+    for _ in range(200):
+        text = ''.join(rng.choice('abc \n') for _ in range(rng.randint(0, 60)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, 2 * rng.randint(0, 5))))
+        spans = [(cuts[i], cuts[i + 1], f'<E{i}>', f'</E{i}>') for i in range(0, len(cuts) - 1, 2)]
+        rng.shuffle(spans)
+        assert render_spans(text, spans) == render_reference(text, spans)
+
+
+def test_render_spans_nested_and_crossing():
+    text = 'abcdefghij'
+    assert render_spans(text, [(2, 4, '<B>', '</B>'), (0, 6, '<A>', '</A>')]) == '<A>ab<B>cd</B>ef</A>ghij'
+    crossing = render_spans(text, [(0, 5, '<A>', '</A>'), (3, 8, '<B>', '</B>')])
+    assert crossing == '<A>abc<B>de</B></A><B>fgh</B>ij'
+    assert re.sub(r'</?\w+>', '', crossing) == text
+
+
+def test_render_spans_well_formed_on_random_spans():
+    rng = random.Random(1)
+    for _ in range(200):
+        text = 'x' * rng.randint(1, 40)
+        spans = []
+        for i in range(rng.randint(0, 8)):
+            start = rng.randint(0, len(text))
+            spans.append((start, rng.randint(start, len(text)), f'<T{i}>', f'</T{i}>'))
+        markup = render_spans(text, spans)
+        assert is_well_formed(markup)
+        assert re.sub(r'</?\w+>', '', markup) == text
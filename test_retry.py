@@ -0,0 +1,27 @@
+import configparser
+import logging
+
+from backends import MockAPIError
+from retry import RetryPolicy
+
+
+def rate_limited(retry_after: str):
+    return MockAPIError('rate limit reached', 429, {'Retry-After': retry_after})
+
+
+def test_retry_after_is_honored_upto_the_ceiling(caplog):
+    policy = RetryPolicy(base = 1.0, max_delay = 60.0)
+    assert policy.delay(1, rate_limited('5')) == 5.0
+    with caplog.at_level(logging.WARNING):
+        assert policy.delay(1, rate_limited('86400')) == 60.0
+    assert 'clamped' in caplog.text
+
+
+def test_retry_after_ceiling_from_config():
+    config = configparser.ConfigParser()
+    config['openai'] = {'backoff_max': '30'}
+    assert RetryPolicy.from_config(config).delay(1, rate_limited('86400')) == 30.0
+    config['openai']['retry_after_max'] = '120'
+    assert RetryPolicy.from_config(config).delay(1, rate_limited('86400')) == 120.0
+    # backoff without Retry-After stays under backoff_max
+    assert 0 <= RetryPolicy.from_config(config).delay(10) <= 30.0
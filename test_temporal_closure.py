@@ -0,0 +1,88 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from temporal_closure import POINT_CONSTRAINTS, canonical, closure, point_order
+
+
+def point_order_reference(ids, links):
+    # Floyd-Warshall over the start/end points: le - a path exists, lt - a path with a strict edge exists
+    index = {event: i for i, event in enumerate(ids)}
+    size = 2 * len(ids)
+    le = np.eye(size, dtype=bool)
+    lt = np.zeros((size, size), dtype=bool)
+    for i in range(len(ids)):
+        le[2 * i, 2 * i + 1] = True
+    for from_id, to_id, rel_type in links:
+        sides = (index[from_id], index[to_id])
+        for (side_p, point_p), (side_q, point_q), strict in POINT_CONSTRAINTS[rel_type]:
+            p, q = 2 * sides[side_p] + point_p, 2 * sides[side_q] + point_q
+            le[p, q] = True
+            lt[p, q] |= strict
+    for k in range(size):
+        lt |= (lt[:, [k]] & le[[k], :]) | (le[:, [k]] & lt[[k], :])
+        le |= le[:, [k]] & le[[k], :]
+    return le, lt
+
+
+def random_links(rng, events):
+    # links consistent with random intervals, so no strict cycles
+    ids = [f'E{i}' for i in range(events)]
+    times = {event: sorted(rng.sample(range(12), 2)) for event in ids}
+    links = []
+    for _ in range(rng.randint(0, 2 * events)):
+        a, b = rng.sample(ids, 2)
+        (a_start, a_end), (b_start, b_end) = times[a], times[b]
+        if a_end < b_start:
+            rel_type = 'BEFORE'
+        elif (a_start, a_end) == (b_start, b_end):
+            rel_type = 'SIMULTANEOUS'
+        elif b_start <= a_start and a_end <= b_end:
+            rel_type = 'DURING'
+        elif a_start < b_start <= a_end:
+            rel_type = 'BEFORE_OVERLAP'
+        else:
+            continue
+        links.append(canonical(a, b, rel_type))
+    return sorted({event for link in links for event in link[:2]}), sorted(set(filter(None, links)))
+
+
+def test_point_order_matches_floyd_warshall():
+    rng = random.Random(0)
+    for _ in range(200):
+        ids, links = random_links(rng, rng.randint(2, 8))
+        le, lt, cycles = point_order(ids, links)
+        le_ref, lt_ref = point_order_reference(ids, links)
+        assert not cycles
+        assert (le == le_ref).all() and (lt == lt_ref).all()
+
+
+def test_closure_derives_transitive_relations():
+    df = pd.DataFrame([('1', 'A', 'B', 'BEFORE'), ('1', 'C', 'B', 'AFTER'), ('1', 'D', 'A', 'DURING')],
+                      columns=['noteID', 'fromID', 'toID', 'type'])
+    closure_df, cycles = closure(df)
+    links = set(closure_df[['fromID', 'toID', 'type', 'derived']].itertuples(index=False, name=None))
+    assert ('B', 'C', 'BEFORE', False) in links          # C AFTER B in closure form
+    assert ('A', 'C', 'BEFORE', True) in links
+    assert ('D', 'C', 'BEFORE', True) in links           # D happens during A
+    assert cycles.empty
+
+
+def test_closure_reports_inconsistent_cycles():
+    df = pd.DataFrame([('1', 'X', 'Y', 'BEFORE'), ('1', 'Y', 'Z', 'BEFORE'), ('1', 'Z', 'X', 'BEFORE'), ('2', 'A', 'B', 'BEFORE')],
+                      columns=['noteID', 'fromID', 'toID', 'type'])
+    closure_df, cycles = closure(df)
+    assert cycles['noteID'].tolist() == ['1'] and cycles['ids'].tolist() == ['X Y Z']
+    # links of the cycle are kept as given, nothing is derived from them
+    note = closure_df[closure_df['noteID'] == '1']
+    assert not note['derived'].any() and len(note) == 3
+
+
+def test_closure_in_processes_matches_serial():
+    rng = random.Random(1)
+    rows = [(str(note),) + link for note in range(40) for link in random_links(rng, 6)[1]]
+    df = pd.DataFrame(rows, columns=['noteID', 'fromID', 'toID', 'type'])
+    serial, _ = closure(df, processes=1, batch_size=8)
+    parallel, _ = closure(df, processes=2, batch_size=8)
+    pd.testing.assert_frame_equal(serial, parallel)
@@ -0,0 +1,63 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from timex import parse_duration, parse_value, parse_values, resolve
+
+
+def day(value):
+    return np.datetime64(value, 's')
+
+
+def test_parse_value_dates_at_their_precision():
+    assert parse_value('2012-05-03')[:2] == (day('2012-05-03'), day('2012-05-04'))
+    assert parse_value('2012-05')[:2] == (day('2012-05-01'), day('2012-06-01'))
+    assert parse_value('2012-12')[:2] == (day('2012-12-01'), day('2013-01-01'))
+    assert parse_value('2012')[:2] == (day('2012-01-01'), day('2013-01-01'))
+    assert parse_value('2012-W18')[:2] == (day('2012-04-30'), day('2012-05-07'))
+    assert parse_value('2012-05-03T14:00')[:2] == (day('2012-05-03T14:00'), day('2012-05-03T14:01'))
+
+
+def test_parse_value_times_durations_and_frequencies():
+    value = parse_value('T14')
+    assert np.isnat(value.start) and (value.time, value.time_end) == (np.timedelta64(14 * 3600, 's'), np.timedelta64(15 * 3600, 's'))
+    assert parse_value('TNI').time_end == np.timedelta64(30 * 3600, 's')
+    assert parse_value('P3D').duration == np.timedelta64(3 * 86400, 's')
+    assert parse_duration('PT4H') == np.timedelta64(4 * 3600, 's')
+    twice_a_day = parse_value('R2P1D')
+    assert twice_a_day.count == 2 and twice_a_day.duration == np.timedelta64(86400, 's')
+    assert math.isinf(parse_value('RP1D').count)
+
+
+def test_parse_value_unparsed_values_are_empty():
+    for val in ('PRESENT_REF', 'PXD', '2012-13-45', '', 'yesterday'):
+        value = parse_value(val)
+        assert np.isnat(value.start) and np.isnat(value.duration) and np.isnat(value.time) and math.isnan(value.count)
+
+
+def test_parse_value_is_memoized_and_normalized():
+    parse_value.cache_clear()
+    assert parse_value(' 2012-05-03 ') == parse_value('2012-05-03')
+    parse_value('2012-05-03')
+    assert parse_value.cache_info().hits >= 1
+
+
+def test_parse_values_matches_parse_value():
+    vals = ['2012-05-03', 'P3D', 'T14:30', 'R2P1D', 'PXD', None, '2012-05-03', 'TMO']
+    df = parse_values(vals)
+    for row, val in zip(df.itertuples(index=False), vals):
+        expected = parse_value('' if val is None else val)
+        for got, want in zip(row, expected):
+            assert (pd.isna(got) and pd.isna(want)) or got == want
+
+
+def test_resolve_against_admission_and_discharge():
+    parsed = parse_values(['2012-05-03', 'T14', 'P3D', 'P30D', 'R2P1D'])
+    start, end = resolve(parsed, day('2012-05-01T09:00'), day('2012-05-10'))
+    assert (start[0], end[0]) == (day('2012-05-03'), day('2012-05-04'))
+    assert (start[1], end[1]) == (day('2012-05-01T14:00'), day('2012-05-01T15:00'))
+    assert (start[2], end[2]) == (day('2012-05-01T09:00'), day('2012-05-04T09:00'))
+    # durations end at discharge at the latest
+    assert end[3] == day('2012-05-10')
+    assert np.isnat(start[4]) and np.isnat(end[4])
@@ -0,0 +1,159 @@
+import logging
+import os
+import sqlite3
+
+import pandas as pd
+
+DATE_COLUMNS = ['start_date', 'end_date', 'earliest', 'latest']
+EVENT_COLUMNS = ['run', 'noteID', 'id', 'text', 'type', 'ord', 'certainty'] + DATE_COLUMNS + ['anchors', 'consistent']
+LINK_COLUMNS = ['run', 'noteID', 'fromID', 'toID', 'type', 'derived']
+# ISO-8601 text sorts in time order, so dates are compared and indexed as strings
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def to_iso(value):
+    '''
+    ISO-8601 text of a date (str, datetime, numpy/pandas datetime) as stored in the timeline; None for NaT.
+    '''
+    if value is None or pd.isna(value):
+        return None
+    return pd.Timestamp(value).strftime(DATE_FORMAT)
+
+
+class TimelineStore:
+    '''
+    Normalized events of the corpus in SQLite, one timeline per run.
+
+    events - every event of a run with text, type, order (ord) and certainty in its note, the range
+             [start_date, end_date) it happens in, earliest/latest bounds, anchors and consistency
+             (see utils.normalize); dates are ISO-8601 text
+    tlinks - the run's TLINKs (derived = 0) and the relations its temporal closure adds (derived = 1)
+    Indexed on noteID, event type and dates, so queries across notes do not scan the corpus.
+    '''
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS events (
+                                run TEXT,
+                                noteID TEXT,
+                                id TEXT,
+                                text TEXT,
+                                type TEXT,
+                                ord INTEGER,
+                                certainty TEXT,
+                                start_date TEXT,
+                                end_date TEXT,
+                                earliest TEXT,
+                                latest TEXT,
+                                anchors INTEGER,
+                                consistent INTEGER,
+                                PRIMARY KEY (run, noteID, id))''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tlinks (
+                                run TEXT,
+                                noteID TEXT,
+                                fromID TEXT,
+                                toID TEXT,
+                                type TEXT,
+                                derived INTEGER)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_events_note ON events (noteID, run)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_events_type_start ON events (type, start_date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_events_start ON events (start_date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_events_latest ON events (latest)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_tlinks_from ON tlinks (run, noteID, fromID)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_tlinks_to ON tlinks (run, noteID, toID)')
+        self.conn.commit()
+
+    @classmethod
+    def for_output_dir(cls, output_dir: str):
+        '''
+        The timeline of a result directory: <output_dir>/timeline.sqlite
+        '''
+        return cls(os.path.join(output_dir, 'timeline.sqlite'))
+
+    def write(self, run: str, events: pd.DataFrame, links: pd.DataFrame = None):
+        '''
+        Replace the timeline of run with events (utils.NORMALIZED_COLUMNS) and
+        links (noteID, fromID, toID, type, derived) in one transaction.
+        '''
+        events = events.rename(columns={'order': 'ord'}).assign(run = run)
+        for column in DATE_COLUMNS:
+            events[column] = [to_iso(value) for value in events[column]]
+        events['ord'] = events['ord'].astype(object).where(events['ord'].notna(), None)
+        events['consistent'] = events['consistent'].astype(int)
+        event_rows = events[EVENT_COLUMNS].astype(object).where(events[EVENT_COLUMNS].notna(), None).itertuples(index=False, name=None)
+        link_rows = []
+        if links is not None:
+            link_rows = links.assign(run = run, derived = links['derived'].astype(int))[LINK_COLUMNS].astype(object).itertuples(index=False, name=None)
+        with self.conn:
+            self.conn.execute('DELETE FROM events WHERE run = ?', (run,))
+            self.conn.execute('DELETE FROM tlinks WHERE run = ?', (run,))
+            self.conn.executemany(f'INSERT OR REPLACE INTO events VALUES ({", ".join("?" * len(EVENT_COLUMNS))})', event_rows)
+            self.conn.executemany(f'INSERT INTO tlinks VALUES ({", ".join("?" * len(LINK_COLUMNS))})', link_rows)
+        logging.info(f'timeline {self.db_path}: wrote {len(events)} events of run {run}')
+
+    def _read(self, sql: str, params: list) -> pd.DataFrame:
+        df = pd.read_sql_query(sql, self.conn, params=params)
+        for column in DATE_COLUMNS:
+            if column in df:
+                df[column] = pd.to_datetime(df[column], format=DATE_FORMAT)
+        return df.rename(columns={'ord': 'order'})
+
+    def events(self, run: str = None, notes: list = None, types: list = None, certainty: str = None,
+               start = None, end = None, possible: bool = False) -> pd.DataFrame:
+        '''
+        Events matching every given filter, ordered by noteID and order.
+        start, end - only events happening within [start, end), e.g. '2012-05-01', '2012-06-01':
+                     their [start_date, end_date) overlaps it. With possible, events that are not
+                     anchored but whose earliest/latest bounds do not rule it out are included too.
+        '''
+        clauses, params = [], []
+        if run is not None:
+            clauses.append('run = ?')
+            params.append(run)
+        for column, values in (('noteID', notes), ('type', types)):
+            if values is not None:
+                values = [values] if isinstance(values, str) else list(values)
+                clauses.append(f'{column} IN ({", ".join("?" * len(values))})')
+                params += [str(value) for value in values]
+        if certainty is not None:
+            clauses.append('certainty = ?')
+            params.append(certainty)
+        if start is not None or end is not None:
+            start, end = to_iso(start) or '0001-01-01T00:00:00', to_iso(end) or '9999-12-31T23:59:59'
+            anchored = '(start_date < ? AND end_date > ?)'
+            if possible:
+                clauses.append(f'({anchored} OR (start_date IS NULL AND (earliest IS NULL OR earliest < ?) '
+                               f'AND (latest IS NULL OR latest > ?) AND (earliest IS NOT NULL OR latest IS NOT NULL)))')
+                params += [end, start, end, start]
+            else:
+                clauses.append(anchored)
+                params += [end, start]
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        return self._read(f'SELECT * FROM events {where} ORDER BY run, noteID, ord', params)
+
+    def overlapping(self, types, start, end, run: str = None) -> pd.DataFrame:
+        '''
+        Events of the given types happening within [start, end) across notes,
+        e.g. overlapping('TREATMENT', '2012-05-01', '2012-06-01').
+        '''
+        return self.events(run = run, types = types, start = start, end = end)
+
+    def tlinks(self, run: str, note: str, event_id: str = None, derived: bool = None) -> pd.DataFrame:
+        '''
+        TLINKs of a note, optionally only those of one event and only given (derived = False) or derived ones.
+        '''
+        clauses, params = ['run = ?', 'noteID = ?'], [run, str(note)]
+        if event_id is not None:
+            clauses.append('(fromID = ? OR toID = ?)')
+            params += [event_id, event_id]
+        if derived is not None:
+            clauses.append('derived = ?')
+            params.append(int(derived))
+        return self._read(f'SELECT * FROM tlinks WHERE {" AND ".join(clauses)}', params)
+
+    def runs(self) -> list:
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT run FROM events ORDER BY run')]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,187 @@
+import re
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+NAT = np.datetime64('NaT', 's')
+NAT_DELTA = np.timedelta64('NaT', 's')
+
+DATE = re.compile(r'(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?(?:T(\d{2})(?::(\d{2})(?::(\d{2}))?)?)?$')
+WEEK = re.compile(r'(\d{4})-W(\d{2})$')
+TIME = re.compile(r'T(\d{2})(?::(\d{2})(?::(\d{2}))?)?$')
+DURATION = re.compile(r'P(?:([\d.]+)Y)?(?:([\d.]+)M)?(?:([\d.]+)W)?(?:([\d.]+)D)?'
+                      r'(?:T(?:([\d.]+)H)?(?:([\d.]+)M)?(?:([\d.]+)S)?)?$')
+FREQUENCY = re.compile(r'R(\d+)?(P\S*)?$')
+
+# Seconds per duration unit; years and months are averages of the Gregorian calendar
+UNIT_SECONDS = (365.2425 * 86400, 365.2425 / 12 * 86400, 7 * 86400, 86400, 3600, 60, 1)
+# TIMEX3 parts of the day: (start hour, hours)
+DAY_PARTS = {'TMO': (6, 6), 'TAF': (12, 6), 'TEV': (18, 4), 'TNI': (22, 8)}
+
+# start, end - absolute range [start, end) of a DATE or TIME with a date
+# duration - length of a DURATION, or the period of a FREQUENCY
+# count - repetitions of a FREQUENCY (inf if unbounded, e.g. RP1D); NaN for other values
+# time, time_end - time of day range [time, time_end) of a TIME without a date
+TimexValue = namedtuple('TimexValue', ['start', 'end', 'duration', 'count', 'time', 'time_end'])
+VALUE_COLUMNS = list(TimexValue._fields)
+EMPTY = TimexValue(NAT, NAT, NAT_DELTA, np.nan, NAT_DELTA, NAT_DELTA)
+
+
+def _seconds(value: float):
+    return np.timedelta64(int(round(value)), 's')
+
+
+def _date_range(groups):
+    # [start, end) of a calendar date at the precision it is written in
+    year, month, day, hour, minute, second = (int(group) if group else None for group in groups)
+    if month is None:
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    if day is None:
+        return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+    start = datetime(year, month, day, hour or 0, minute or 0, second or 0)
+    if hour is None:
+        return start, start + timedelta(days=1)
+    if minute is None:
+        return start, start + timedelta(hours=1)
+    return start, start + timedelta(minutes=1) if second is None else start + timedelta(seconds=1)
+
+
+def parse_duration(val: str):
+    '''
+    timedelta64 of an ISO-8601 duration, e.g. P3D, P2W, PT4H, P1Y6M; NaT if it is not one (e.g. PXD).
+    '''
+    match = DURATION.match(val)
+    if not match or not any(match.groups()):
+        return NAT_DELTA
+    try:
+        return _seconds(sum(float(amount) * unit for amount, unit in zip(match.groups(), UNIT_SECONDS) if amount))
+    except ValueError:
+        return NAT_DELTA
+
+
+@lru_cache(maxsize=65536)
+def parse_value(val: str) -> TimexValue:
+    '''
+    TimexValue of a TIMEX3 val, by its ISO-8601 form:
+    DATE / TIME - 2012-05-03, 2012-05, 2012, 2012-W18, 2012-05-03T14:00 -> start, end
+    TIME of day - T14:00, TMO (morning), TAF, TEV, TNI -> time, time_end
+    DURATION - P3D, PT4H, P1Y2M -> duration
+    FREQUENCY - R2P1D (twice a day), RP1D (daily), R3 -> count, duration (period)
+    Anything else (PRESENT_REF, PXD, ...) is all NaT. Memoized: values repeat heavily across notes.
+    '''
+    val = str(val).strip().upper()
+    try:
+        match = DATE.match(val)
+        if match:
+            start, end = _date_range(match.groups())
+            return EMPTY._replace(start=np.datetime64(start, 's'), end=np.datetime64(end, 's'))
+        match = WEEK.match(val)
+        if match:
+            start = date.fromisocalendar(int(match.group(1)), int(match.group(2)), 1)
+            return EMPTY._replace(start=np.datetime64(start, 's'), end=np.datetime64(start + timedelta(weeks=1), 's'))
+        match = TIME.match(val)
+        if match:
+            hour, minute, second = (int(group) if group else None for group in match.groups())
+            time = 3600 * hour + 60 * (minute or 0) + (second or 0)
+            span = 3600 if minute is None else 60 if second is None else 1
+            return EMPTY._replace(time=_seconds(time), time_end=_seconds(time + span))
+        if val in DAY_PARTS:
+            hour, hours = DAY_PARTS[val]
+            return EMPTY._replace(time=_seconds(3600 * hour), time_end=_seconds(3600 * (hour + hours)))
+        if val.startswith('P'):
+            return EMPTY._replace(duration=parse_duration(val))
+        match = FREQUENCY.match(val)
+        if match:
+            count, period = match.groups()
+            return EMPTY._replace(count=float(count) if count else np.inf,
+                                  duration=parse_duration(period) if period else NAT_DELTA)
+    except ValueError:
+        # e.g. 2012-13-45
+        pass
+    return EMPTY
+
+
+def parse_values(vals) -> pd.DataFrame:
+    '''
+    Typed columns (VALUE_COLUMNS) of many TIMEX3 values: start/end as datetime64[s],
+    duration/time/time_end as timedelta64[s], count as float. Each distinct value is parsed once.
+    '''
+    codes, uniques = pd.factorize(pd.Series(vals, dtype=object).fillna(''), sort=False)
+    parsed = [parse_value(val) for val in uniques]
+    columns = {}
+    for i, (name, dtype) in enumerate(zip(VALUE_COLUMNS, ('M8[s]', 'M8[s]', 'm8[s]', float, 'm8[s]', 'm8[s]'))):
+        values = np.array([value[i] for value in parsed], dtype=dtype) if parsed else np.array([], dtype=dtype)
+        columns[name] = values[codes]
+    return pd.DataFrame(columns)
+
+
+### Vectorized interval arithmetic over datetime64/timedelta64 arrays; NaT propagates
+
+def shift(dates, durations, sign: int = 1):
+    '''
+    dates moved by durations (sign = -1 moves them back).
+    '''
+    return np.asarray(dates, dtype='M8[s]') + sign * np.asarray(durations, dtype='m8[s]')
+
+
+def day_start(dates):
+    return np.asarray(dates, dtype='M8[s]').astype('M8[D]').astype('M8[s]')
+
+
+def overlaps(start_a, end_a, start_b, end_b):
+    '''
+    True where [start_a, end_a) and [start_b, end_b) share time; False if any bound is NaT.
+    '''
+    return (np.asarray(start_a, dtype='M8[s]') < np.asarray(end_b, dtype='M8[s]')) & \
+           (np.asarray(start_b, dtype='M8[s]') < np.asarray(end_a, dtype='M8[s]'))
+
+
+def clip(start, end, lower, upper):
+    '''
+    [start, end) limited to [lower, upper); NaT bounds do not limit.
+    '''
+    start, end = np.asarray(start, dtype='M8[s]'), np.asarray(end, dtype='M8[s]')
+    lower, upper = np.asarray(lower, dtype='M8[s]'), np.asarray(upper, dtype='M8[s]')
+    start = np.where(~np.isnat(lower) & ~np.isnat(start) & (start < lower), lower, start)
+    end = np.where(~np.isnat(upper) & ~np.isnat(end) & (end > upper), upper, end)
+    return start, end
+
+
+def resolve(parsed: pd.DataFrame, admission, discharge = None):
+    '''
+    (start, end) absolute ranges of parsed values (parse_values), one per row:
+    DATE / TIME with a date - their own range
+    TIME of day - that time on the day of admission
+    DURATION - from admission for its length, ending at discharge at the latest
+    FREQUENCY and unparsed values - NaT
+    admission, discharge - datetime64 per row, e.g. the note's dates (note_dates) mapped to its TIMEX3s
+    '''
+    admission = np.broadcast_to(np.asarray(admission, dtype='M8[s]'), (len(parsed),))
+    discharge = np.broadcast_to(np.asarray(discharge if discharge is not None else NAT, dtype='M8[s]'), (len(parsed),))
+    start, end = parsed['start'].to_numpy('M8[s]'), parsed['end'].to_numpy('M8[s]')
+    time = parsed['time'].to_numpy('m8[s]')
+    is_time = np.isnat(start) & ~np.isnat(time)
+    start = np.where(is_time, shift(day_start(admission), time), start)
+    end = np.where(is_time, shift(day_start(admission), parsed['time_end'].to_numpy('m8[s]')), end)
+    is_duration = np.isnat(start) & ~np.isnat(parsed['duration'].to_numpy('m8[s]')) & parsed['count'].isna().to_numpy()
+    duration_end = shift(admission, parsed['duration'].to_numpy('m8[s]'))
+    duration_end = np.where(~np.isnat(discharge) & (duration_end > discharge), discharge, duration_end)
+    start = np.where(is_duration, admission, start)
+    end = np.where(is_duration, duration_end, end)
+    return start, end
+
+
+def note_dates(ner_df) -> pd.DataFrame:
+    '''
+    noteID, admission, discharge: the first two DATE TIMEX3s of each note in text order.
+    i2b2 discharge summaries open with "Admission Date :" and "Discharge Date :".
+    '''
+    dates = ner_df[ner_df['type'].astype(str) == 'DATE'].assign(start=lambda df: pd.to_numeric(df['start'], errors='coerce'))
+    dates = dates.sort_values(['noteID', 'start'], kind='stable')
+    dates = dates.assign(date=parse_values(dates['val'])['start'].to_numpy())[['noteID', 'date']]
+    admission = dates.drop_duplicates('noteID').rename(columns={'date': 'admission'})
+    discharge = dates[dates['noteID'].duplicated()].drop_duplicates('noteID').rename(columns={'date': 'discharge'})
+    return admission.merge(discharge, on='noteID', how='left').reset_index(drop=True)
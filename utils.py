@@ -1,206 +1,151 @@
 import pandas as pd
-import tqdm as td
-import networkx as nx
-from networkx.algorithms.dag import topological_sort
 
-import xml.etree.ElementTree as ET
+from annotation_store import AnnotationStore, GOLD
+from temporal_closure import closure
+from temporal_graph import event_order, find_event_orders
+from timeline_store import TimelineStore
+from timex import note_dates, parse_values, resolve
 
-import matplotlib.pyplot as plt
-import glob, os, logging
-import re as reg
+import os, logging
 import configparser
 from datetime import date
 
+TIME_TYPES = ['DATE', 'DURATION', 'FREQUENCY', 'TIME']
+# TIMEX3 types with a value events are anchored to; durations run from admission
+ANCHOR_TYPES = ['DATE', 'TIME', 'DURATION']
+EVENT_TYPES = ['TEST', 'TREATMENT', 'PROBLEM']
+# closure relation of (event, timex) and (timex, event) pairs: what the timex value bounds
+# overlap - the event happens at the value; latest - the event ends before it; earliest - it starts after it
+EVENT_TO_TIME = {'BEFORE': 'latest', 'DURING': 'overlap', 'SIMULTANEOUS': 'overlap', 'OVERLAP': 'overlap', 'BEFORE_OVERLAP': 'overlap'}
+TIME_TO_EVENT = {'BEFORE': 'earliest', 'DURING': 'overlap', 'SIMULTANEOUS': 'overlap', 'OVERLAP': 'overlap', 'BEFORE_OVERLAP': 'overlap'}
+NORMALIZED_COLUMNS = ['noteID', 'id', 'text', 'type', 'order', 'certainty', 'start_date', 'end_date', 'earliest', 'latest', 'anchors', 'consistent']
+
 # Function to find the order of EVENT IDs with certainty based on relationship types
 def find_event_order_with_certainty(df):
-    # Dictionary to hold the relations with their type
-    relations = {}
-    for _, row in df.iterrows():
-        fromID, toID, rel_type = row['fromID'], row['toID'], row['type']
-        if fromID not in relations:
-            relations[fromID] = []
-        if toID not in relations:
-            relations[toID] = []
-        relations[fromID].append((toID, rel_type))
-        relations[toID].append((fromID, rel_type))
-
-    # Dictionary to store the certainty of each event
-    certainty_dict = {}
-
-    # Finding the order of EVENT IDs using DFS (Depth-First Search algorithm)
-    visited = set()
-    order = []
-
-    # In DFS, note will be event IDs and edges will be relation types
-    def dfs(node, is_certain):
-        if node not in visited:
-            visited.add(node)
-            order.append(node)
-            certainty_dict[node] = "Certain" if is_certain else "Uncertain"
-            for neighbour, rel_type in relations.get(node, []):
-                # If the relationship is BEFORE or AFTER, it adds certainty
-                new_certainty = is_certain or rel_type in ["BEFORE", "AFTER"]
-                dfs(neighbour, new_certainty)
-
-    # Starting DFS from each unvisited node
-    for node in df['fromID'].tolist() + df['toID'].tolist():
-        if node not in visited:
-            dfs(node, False)
-            
+    '''
+    Order of EVENT IDs with certainty of one note's TLINKs (see temporal_graph.event_order).
+    For many notes at once, use temporal_graph.find_event_orders.
+    '''
+    order, certainty = event_order(df['fromID'].tolist(), df['toID'].tolist(), df['type'].tolist())
+
     # Creating the DataFrame with EVENT and CERTAINTY
-    event_certainty_df = pd.DataFrame({"id": order, "certainty": [certainty_dict[event] for event in order]})
-    event_certainty_df
+    return pd.DataFrame({"id": order, "certainty": certainty})
 
-    return event_certainty_df
+def timex_ranges(ner_df) -> pd.DataFrame:
+    '''
+    noteID, id, range_start, range_end: absolute range [start, end) of every DATE, TIME and DURATION TIMEX3.
+    Values are parsed with timex.parse_values; times of day and durations are resolved against
+    the note's admission and discharge dates (timex.note_dates).
+    '''
+    timex = ner_df[ner_df['type'].isin(ANCHOR_TYPES)]
+    dates = timex[['noteID']].merge(note_dates(ner_df), on='noteID', how='left')
+    range_start, range_end = resolve(parse_values(timex['val']), dates['admission'].to_numpy('M8[s]'), dates['discharge'].to_numpy('M8[s]'))
+    timex = timex[['noteID', 'id']].assign(range_start = range_start, range_end = range_end)
+    return timex.dropna(subset=['range_start']).reset_index(drop=True)
 
-def normalize(output_dir: str, execute_date: str, few_shot: bool = True):
+
+def anchor_events(ner_df, closure_df) -> pd.DataFrame:
+    '''
+    Date range of every event linked, directly or through the temporal closure, to a DATE/TIME/DURATION.
+    Return noteID, id, start_date/end_date (first and last time [start_date, end_date) the event happens at),
+    earliest (it starts after) and latest (it ends before), and anchors (number of TIMEX3s it is linked to).
+    All joins are keyed on (noteID, id).
+    '''
+    keys = ['noteID', 'id']
+    timex = timex_ranges(ner_df)
+    events = ner_df.loc[ner_df['type'].isin(EVENT_TYPES), keys]
+
+    # (event, timex) links with the event on either side
+    forward = (closure_df.merge(events, left_on=['noteID', 'fromID'], right_on=keys)
+               .merge(timex, left_on=['noteID', 'toID'], right_on=keys, suffixes=('', '_timex')))
+    backward = (closure_df.merge(timex, left_on=['noteID', 'fromID'], right_on=keys)
+                .merge(events, left_on=['noteID', 'toID'], right_on=keys, suffixes=('_timex', '')))
+    columns = ['range_start', 'range_end']
+    bounds = pd.concat([
+        forward[['noteID', 'fromID', 'toID'] + columns].rename(columns={'fromID': 'id', 'toID': 'timex'}).assign(bound = forward['type'].map(EVENT_TO_TIME)),
+        backward[['noteID', 'toID', 'fromID'] + columns].rename(columns={'toID': 'id', 'fromID': 'timex'}).assign(bound = backward['type'].map(TIME_TO_EVENT)),
+    ], ignore_index=True).dropna(subset=['bound'])
+
+    # an event overlapping a range happens within it, ends before its start or starts after its end
+    overlap = bounds['bound'] == 'overlap'
+    grouped = bounds.assign(
+        start_date = bounds['range_start'].where(overlap),
+        end_date = bounds['range_end'].where(overlap),
+        earliest = bounds['range_end'].where(bounds['bound'] == 'earliest'),
+        latest = bounds['range_start'].where(bounds['bound'] == 'latest'),
+    ).groupby(keys, sort=False)
+    return grouped.agg(start_date = ('start_date', 'min'), end_date = ('end_date', 'max'),
+                       earliest = ('earliest', 'max'), latest = ('latest', 'min'),
+                       anchors = ('timex', 'nunique')).reset_index()
+
+
+def normalize(output_dir: str, execute_date: str = None, few_shot: bool = True, run: str = None, processes: int = None):
     '''
     Normalize extracted entities by their temporal order
     
     Both NER & RE result is needed because temporal information is in RE, and entity type & date is in NER.
-    Normalization will be performed per each entity in NER output file.
+    Normalization is performed for every event of the corpus at once.
     
     execute_date: %y%m%d
-    '''    
-    ## Temp for the dev
-    os.chdir('./Temporal-Phenotype')
-    output_dir = './result'
-    ner = os.path.join(output_dir, 'eval/ner')
-    re = os.path.join(output_dir, 'eval/re')
-    
-    # Read GPT-generated output
-    config = configparser.ConfigParser()
-    config.read(os.path.join(os.getcwd(), 'api.config'))
-    model = config['openai']['model']
-    
-    # if execute_date is None:
-    #     if few_shot == True:
-    #         ner_path = "output_one_" + model + "_" + date.today().strftime("%y%m%d") + "/ner"
-    #         re_path = "output_one_" + model + "_" + date.today().strftime("%y%m%d") + "/re"            
-    #     else:
-    #         ner_path = "output_zero_" + model + "_" + date.today().strftime("%y%m%d") + "/ner"
-    #         re_path = "output_zero_" + model + "_" + date.today().strftime("%y%m%d") + "/re"            
-    # else:
-    #     if few_shot == True:
-    #         ner_path = "output_one_" + model + "_" + execute_date + "/ner"
-    #         re_path = "output_one_" + model + "_" + execute_date + "/re"
-    #     else:
-    #         ner_path = "output_zero_" + model + "_" + execute_date + "/ner"
-    #         re_path = "output_zero_" + model + "_" + execute_date + "/re"
-    # ner = os.path.join(output_dir, ner_path)
-    # re = os.path.join(output_dir, re_path)
-    ner_files = glob.glob(os.path.join(ner, "*.xml"))
-    re_files = glob.glob(os.path.join(re, "*.xml"))
-    
-    # ## For devel purpose, use eval files
-    # ner_files = glob.glob('./result/eval/ner/*.xml')
-    # re_files = glob.glob('./result/eval/re/*.xml')
-    
-    ## Process NER and RE results and transform as tabular form.
-    ner_df = []
-    re_df = []
-    try:
-        for ner in ner_files:
-            with open(ner, 'r') as f:
-                ner_output = f.read()
-            
-            ## post-process output
-            # Replace unescaped special characters
-            ner_output = ner_output.replace('&', '&amp;')
-            # Remove incomplete lines
-            lines = ner_output.strip().split('\n')
-            lines = [line for line in lines if all(keyword in line for keyword in ('text', 'type'))]
-            ner_output = '\n'.join(lines)
-            # Remove complete lines
-            pattern = r'<EVENT[^>]*\/>'
-            matches = reg.findall(pattern, ner_output)
-            ner_output = '<TAGS>\n' + '\n'.join(matches) + '\n</TAGS>'
-            
-            # parse xml            
-            root = ET.fromstring(ner_output)
-            ner_note = []
-            for event in root.findall('EVENT'):
-                # Standardize time text to normalized value
-                if any(type_attr in event.get("type") for type_attr in ['DATE', 'DURATION', 'FREQUENCY', 'TIME']):
-                    event.set("text", event.get("val"))  # Replace text with val                
-                    
-                ner_note.append({
-                    'noteID': os.path.splitext(os.path.basename(ner))[0],
-                    'id': event.attrib['id'],
-                    'text': event.attrib['text'],
-                    'type': event.attrib['type']
-                })
-            ner_df.append(pd.DataFrame(ner_note))
-    except Exception as e:
-        logging.error(f'Error occured while parsing ner_xml file: \n{e}')
-    
-    try:
-        for re in re_files:
-            with open(re, 'r') as f:
-                re_output = f.read()
-            
-            ## post-process output
-            # Replace unescaped special characters
-            re_output = re_output.replace('&', '&amp;')
-            # Remove incomplete lines
-            lines = re_output.strip().split('\n')
-            lines = [line for line in lines if all(keyword in line for keyword in ('toText', 'fromText', 'type'))]
-            re_output = '\n'.join(lines)
-            # Remove xml tags in text snippet
-            re_output = reg.sub(r'(<EVENT.*?/EVENT>)|(<TIMEX.*?/TIMEX>)|(<EVENT|<TIMEX|</EVENT>|</TIMEX>)', '', re_output)
-            # Remove complete lines
-            pattern = r'<TLINK[^>]*\/>'
-            matches = reg.findall(pattern, re_output)
-            re_output = '<TAGS>\n' + '\n'.join(matches) + '\n</TAGS>'
-            
-            # parse xml
-            root = ET.fromstring(re_output)
-            re_note = []
-            for tlink in root.findall('TLINK'):
-                re_note.append({
-                    'noteID': os.path.splitext(os.path.basename(re))[0],
-                    'fromID': tlink.get('fromID'),
-                    'toID': tlink.get('toID'),
-                    'fromText': tlink.get('fromText'),
-                    'toText': tlink.get('toText'),
-                    'type': tlink.attrib['type']
-                })
-            re_df.append(pd.DataFrame(re_note))
-    except Exception as e:
-        logging.error(f'Error occured while parsing re_xml file: \n{e}')
-        
-    ner_df = pd.concat(ner_df, ignore_index=True)
-    re_df = pd.concat(re_df, ignore_index=True)
-    
-    # Replace temporal expression in re_df using ner_df
-    id_text_map = pd.Series(ner_df.text.values, index=ner_df.id).to_dict()
-    re_df['fromText'] = re_df['fromID'].map(id_text_map)
-    re_df['toText'] = re_df['toID'].map(id_text_map)
-    
-    # Extract Time entities from ner_df
-    absolute_temp = ner_df[ner_df['type'].isin(['DATE','TIME'])]
-    relative_temp = ner_df[ner_df['type'].isin(['DURATION','FREQUENCY'])]
-    event = ner_df[ner_df['type'].isin(['TEST','TREATMENT','PROBLEM'])]
-       
-    # Identify DATE entity set as baseline temp
-    date = ner_df[ner_df['type'] =='DATE']
-    tmp_re = re_df[re_df['noteID']=='298']
-    tmp_re = re_df[re_df['noteID']=='1']    
-    tmp_ner = ner_df[ner_df['noteID']=='1']
-    
-    # Find the order of EVENT IDs with certainty
-    event_certainty_df = find_event_order_with_certainty(tmp_re)
-    event_certainty_df.merge(tmp_ner, on = "id", how='left')    
+    run - annotation store run whose TLINKs are normalized; 'gold' for the eval files.
+          Default: output_<one|zero>_<model>_<execute_date or today>. TLINK IDs of the RE task
+          refer to the gold EVENTs and TIMEX3s, so entities always come from the gold NER annotations.
 
-    
-            
-    ### Identify potential temporal expression from re_df, use DATE as baseline
-    ## Process absolute temp relation
-    # EVENT to TIME
-    # TIME to EVENT
-    # EVENT to EVENT
-    ## Process relative temp relation
-    # EVENT to TIME
-    # TIME to EVENT
-    # EVENT to EVENT
-    ## Caculate date range of the events
\ No newline at end of file
+    Result (NORMALIZED_COLUMNS), one row per event, also written to <output_dir>/normalized/<run>.csv
+    and, with the TLINKs, to the queryable timeline <output_dir>/timeline.sqlite (timeline_store.py):
+    order, certainty - position and certainty of the event in its note's TLINK graph
+    start_date, end_date - [first, last) time of the TIMEX3s the event happens at (OVERLAP, DURING, ...)
+    earliest, latest - time the event starts after / ends before
+    anchors - number of DATE/TIME/DURATIONs the event is linked to, also through the temporal closure
+    TIMEX3 values are parsed into ranges by timex.py, e.g. 2013-09 is September 2013 and
+    P3D the first three days from admission
+    consistent - False if the bounds contradict each other
+    '''
+    if run is None:
+        config = configparser.ConfigParser()
+        config.read(os.path.join(os.getcwd(), 'api.config'))
+        model = config['openai']['model']
+        run = ("one_" if few_shot else "zero_") + model + "_" + (execute_date or date.today().strftime("%y%m%d"))
+
+    ## Read NER and RE results in tabular form from the annotation store
+    store = AnnotationStore(output_dir, processes)
+    ner_df = store.load(GOLD, 'ner')[['noteID', 'id', 'start', 'text', 'type', 'val']].astype({'noteID': str, 'id': str, 'type': str})
+    re_df = store.load(run, 're')[['noteID', 'fromID', 'toID', 'fromText', 'toText', 'type']].astype({'noteID': str, 'fromID': str, 'toID': str, 'type': str})
+
+    # Standardize time text to normalized value
+    is_time = ner_df['type'].isin(TIME_TYPES)
+    ner_df = ner_df.assign(text = ner_df['text'].where(~is_time, ner_df['val']))
+
+    # Replace entity text in re_df using ner_df, keyed on (noteID, id): IDs repeat across notes
+    text = ner_df.set_index(['noteID', 'id'])['text']
+    text = text[~text.index.duplicated()]
+    re_df['fromText'] = text.reindex(pd.MultiIndex.from_arrays([re_df['noteID'], re_df['fromID']])).to_numpy()
+    re_df['toText'] = text.reindex(pd.MultiIndex.from_arrays([re_df['noteID'], re_df['toID']])).to_numpy()
+
+    # Order of EVENT IDs with certainty, and every relation implied by the TLINKs, for all notes at once
+    event_certainty_df = find_event_orders(re_df, processes)
+    closure_df, cycles = closure(re_df, processes if processes is not None else 1)
+
+    ### Date range of the events: anchor events to DATE/TIME directly or through the closure
+    normalized = (ner_df[ner_df['type'].isin(EVENT_TYPES)][['noteID', 'id', 'text', 'type']]
+                  .merge(event_certainty_df, on=['noteID', 'id'], how='left')
+                  .merge(anchor_events(ner_df, closure_df), on=['noteID', 'id'], how='left'))
+    normalized['anchors'] = normalized['anchors'].fillna(0).astype(int)
+    normalized['order'] = normalized['order'].astype('Int64')
+    normalized['consistent'] = ~((normalized['earliest'] > normalized['start_date']) | (normalized['end_date'] > normalized['latest'])
+                                 | (normalized['earliest'] > normalized['latest']))
+    normalized = normalized[NORMALIZED_COLUMNS]
+
+    path = os.path.join(output_dir, 'normalized')
+    os.makedirs(path, exist_ok=True)
+    normalized.to_csv(os.path.join(path, run + '.csv'), index=False)
+
+    # Indexed timeline with the run's TLINKs and the relations their closure adds
+    links = pd.concat([re_df[['noteID', 'fromID', 'toID', 'type']].assign(derived = False),
+                       closure_df.loc[closure_df['derived'], ['noteID', 'fromID', 'toID', 'type', 'derived']]], ignore_index=True)
+    timeline = TimelineStore.for_output_dir(output_dir)
+    timeline.write(run, normalized, links)
+    timeline.close()
+    logging.info(f'normalized {len(normalized)} events of {normalized["noteID"].nunique()} notes: '
+                 f'{int((normalized["anchors"] > 0).sum())} anchored to a time, {int((~normalized["consistent"]).sum())} inconsistent')
+    return normalized